@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Microbenchmarks for Resource object construction.
+
+Compares the general Resource constructor with the fast paths used when
+parsing sitemaps, scanning disk and building change lists:
+
+    python benchmarks/resource_construction.py --num 100000
+"""
+
+import argparse
+import copy
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from resync.resource import Resource  # noqa: E402
+
+URI = 'http://example.org/collection/items/00001234/file.xml'
+
+
+def sitemap_entry_general():
+    return(Resource(uri=URI))
+
+
+def sitemap_entry_fast():
+    return(Resource.from_values(URI))
+
+
+def disk_entry_general():
+    r = Resource(uri=URI, timestamp=1234567890.0)
+    r.path = '/data/file.xml'
+    return(r)
+
+
+def disk_entry_fast():
+    return(Resource.from_values(URI, timestamp=1234567890.0, path='/data/file.xml'))
+
+
+SRC = Resource(uri=URI, timestamp=1234567890.0, length=1234, md5='abcdef')
+
+
+def change_copy_general():
+    return(Resource(resource=SRC, change='updated'))
+
+
+def change_copy_fast():
+    r = copy.copy(SRC)
+    r.change = 'updated'
+    return(r)
+
+
+BENCHMARKS = [
+    ('sitemap entry', sitemap_entry_general, sitemap_entry_fast),
+    ('disk entry', disk_entry_general, disk_entry_fast),
+    ('change copy', change_copy_general, change_copy_fast),
+]
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num', type=int, default=100000,
+                        help="number of Resource objects to create in each run")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of runs, best is reported")
+    args = parser.parse_args()
+    print("%-14s %12s %12s %8s" % ('', 'general us', 'fast us', 'speedup'))
+    for (name, general, fast) in BENCHMARKS:
+        tg = min(timeit.repeat(general, number=args.num, repeat=args.repeat))
+        tf = min(timeit.repeat(fast, number=args.num, repeat=args.repeat))
+        print("%-14s %12.3f %12.3f %7.1fx" %
+              (name, tg * 1e6 / args.num, tf * 1e6 / args.num, tg / tf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Benchmark for generating every component sitemap of a large list.
+
+Serving a split resource list dynamically means calling as_xml_part(...)
+once for each part, which should take time proportional to the part:
+
+    python benchmarks/sitemap_parts.py --num 200000 --entries 5000
+"""
+
+import argparse
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from resync.resource import Resource  # noqa: E402
+from resync.resource_list import ResourceList  # noqa: E402
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num', type=int, default=200000,
+                        help="number of resources in list")
+    parser.add_argument('--entries', type=int, default=5000,
+                        help="max_sitemap_entries for each component sitemap")
+    args = parser.parse_args()
+    rl = ResourceList()
+    for j in range(args.num, 0, -1):
+        rl.add(Resource.from_values('http://example.org/items/%08d' % (j),
+                                    timestamp=1234567890.0 + j))
+    rl.max_sitemap_entries = args.entries
+    t0 = time.time()
+    num_parts = len(rl.part_starts())
+    t1 = time.time()
+    for n in range(0, num_parts):
+        rl.as_xml_part(basename='http://example.org/sitemap.xml', part_number=n)
+    t2 = time.time()
+    print("%d parts: boundaries %.3fs, all parts %.3fs, %.1fms per part" %
+          (num_parts, t1 - t0, t2 - t1, (t2 - t1) * 1000.0 / num_parts))
+
+
+if __name__ == '__main__':
+    main()
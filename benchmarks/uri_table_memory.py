@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Memory benchmark for sharing URIs between source and destination lists.
+
+Simulates the lists held during an audit: a source resource list with
+URIs as parsed from a sitemap, and a destination resource list with URIs
+mapped back from file paths by a Mapper. Reports the memory held by the
+two lists with and without a shared UriTable.
+
+    python benchmarks/uri_table_memory.py --num 5000000
+
+A 5M entry run needs several GB of memory, use a smaller --num to try.
+"""
+
+import argparse
+import gc
+import os.path
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from resync.mapper import Mapper  # noqa: E402
+from resync.resource import Resource  # noqa: E402
+from resync.resource_list import ResourceList  # noqa: E402
+from resync.uri_table import UriTable  # noqa: E402
+
+BASE_URI = 'http://example.org/collection/items'
+BASE_DIR = '/data/mirror/collection/items'
+
+
+def build_lists(num, uri_table=None):
+    """Build source and destination lists of num resources, return both."""
+    mapper = Mapper([BASE_URI, BASE_DIR])
+    mapper.uri_table = uri_table
+    src = ResourceList()
+    for j in range(num):
+        # New string object each time as from parsing XML
+        uri = '%s/%08d/file.xml' % (BASE_URI, j)
+        if (uri_table is not None):
+            uri = uri_table.intern(uri)
+        src.add(Resource(uri=uri, timestamp=1234567890.0 + j, length=j))
+    dst = ResourceList()
+    for j in range(num):
+        uri = mapper.dst_to_src('%s/%08d/file.xml' % (BASE_DIR, j))
+        dst.add(Resource(uri=uri, timestamp=1234567890.0 + j, length=j))
+    return(src, dst)
+
+
+def measure(num, use_table):
+    """Return (bytes held, seconds) for building the lists."""
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.time()
+    uri_table = UriTable() if use_table else None
+    lists = build_lists(num, uri_table)
+    # Measure with the table still held, as during compare in the client
+    gc.collect()
+    (current, peak) = tracemalloc.get_traced_memory()
+    elapsed = time.time() - t0
+    tracemalloc.stop()
+    del lists, uri_table
+    return(current, elapsed)
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num', type=int, default=5000000,
+                        help="number of resources in each list")
+    args = parser.parse_args()
+    results = {}
+    for use_table in (False, True):
+        results[use_table] = measure(args.num, use_table)
+        print("%-14s %8.1f MB held  %6.1fs" %
+              ('with table' if use_table else 'without table',
+               results[use_table][0] / 1e6, results[use_table][1]))
+    saved = results[False][0] - results[True][0]
+    print("saved          %8.1f MB (%.1f%%, %.1f bytes/resource)" %
+          (saved / 1e6, 100.0 * saved / results[False][0], saved / float(args.num)))
+
+
+if __name__ == '__main__':
+    main()
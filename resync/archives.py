@@ -6,23 +6,109 @@ that provide archives of the 4 core capabilities. While some
 optional attributes are different the basic structure is the
 same for the Resource List Archive, Change List Archive,
 Resource Dump Archive, and Change Dump Archive.
+
+Each entry of an archive covers the time from its md_from to its md_until,
+and ListBaseArchive keeps an interval index over these so that the
+entries covering a time, or overlapping a window, can be found without
+walking the whole archive.
 """
 
+import bisect
 import collections
 
 from .list_base_with_index import ListBaseWithIndex
+from .resource_container import CountedList
 from .resource import Resource
 from .sitemap import Sitemap
 
 
-class ResourceListArchive(ListBaseWithIndex):
+class ListBaseArchive(ListBaseWithIndex):
+    """Base class for archives with an interval index over entries.
+
+    An entry without md_from is taken to cover all earlier times and an
+    entry without md_until to cover all later times, e.g. a Change List
+    that is still being added to. The index is built when first needed
+    and kept only while the resources count their changes, as the default
+    CountedList does, so it is built again after entries are added,
+    removed or replaced. The times of an entry already in the archive are
+    not watched: to change them replace the entry.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize ListBaseArchive, see ListBaseWithIndex."""
+        if (kwargs.get('resources_class') is None):
+            kwargs['resources_class'] = CountedList
+        super(ListBaseArchive, self).__init__(*args, **kwargs)
+        self._interval_index = None
+
+    def interval_index(self):
+        """Return (froms, max_untils, entries) with entries sorted by start time.
+
+        max_untils[j] is the latest end time of entries[0] to entries[j]
+        so that bisect finds the first entry that may overlap a time.
+        """
+        changes = self.resources_changes()
+        key = (id(self.resources), changes, len(self))
+        if (changes is not None and self._interval_index is not None
+                and self._interval_index[0] == key):
+            return(self._interval_index[1])
+        entries = sorted(self.resources, key=self.entry_from)
+        froms = [self.entry_from(r) for r in entries]
+        max_untils = []
+        latest = float('-inf')
+        for r in entries:
+            latest = max(latest, self.entry_until(r))
+            max_untils.append(latest)
+        index = (froms, max_untils, entries)
+        self._interval_index = (key, index) if (changes is not None) else None
+        return(index)
+
+    def add(self, resource):
+        """Add resource or resources to the archive, see ListBaseWithIndex."""
+        self._interval_index = None
+        super(ListBaseArchive, self).add(resource)
+
+    def entry_from(self, resource):
+        """Start time of archive entry resource, -inf if not given."""
+        return(resource.ts_from if resource.ts_from is not None else float('-inf'))
+
+    def entry_until(self, resource):
+        """End time of archive entry resource, inf if not given."""
+        return(resource.ts_until if resource.ts_until is not None else float('inf'))
+
+    def overlapping(self, from_ts=None, until_ts=None):
+        """List of entries that overlap the window from from_ts to until_ts.
+
+        An entry overlaps if it starts before until_ts and ends after
+        from_ts, either may be None for no limit. Entries are returned in
+        order of start time.
+        """
+        (froms, max_untils, entries) = self.interval_index()
+        start = 0
+        if (from_ts is not None):
+            start = bisect.bisect_right(max_untils, from_ts)
+        stop = len(entries)
+        if (until_ts is not None):
+            stop = bisect.bisect_left(froms, until_ts)
+        return([r for r in entries[start:stop]
+                if from_ts is None or self.entry_until(r) > from_ts])
+
+    def covering(self, timestamp):
+        """List of entries that cover timestamp, from <= timestamp < until."""
+        (froms, max_untils, entries) = self.interval_index()
+        start = bisect.bisect_right(max_untils, timestamp)
+        stop = bisect.bisect_right(froms, timestamp)
+        return([r for r in entries[start:stop] if self.entry_until(r) > timestamp])
+
+
+class ResourceListArchive(ListBaseArchive):
     """Class representing an Resource List Archive."""
 
     def __init__(self, resources=None, md=None, ln=None, uri=None,
                  spec_version='1.1', add_lastmod=False,
                  resources_class=None):
         """Initialize ResourceListArchive."""
-        self.resources_class = list if resources_class is None else resources_class
+        self.resources_class = CountedList if resources_class is None else resources_class
         if (resources is None):
             resources = self.resources_class()
         super(ResourceListArchive, self).__init__(
@@ -31,7 +117,7 @@ class ResourceListArchive(ListBaseWithIndex):
             spec_version=spec_version, add_lastmod=add_lastmod)
 
 
-class ChangeListArchive(ListBaseWithIndex):
+class ChangeListArchive(ListBaseArchive):
     """Class representing an Change List Archive."""
 
     def __init__(self, resources=None, md=None, ln=None, uri=None,
@@ -41,10 +127,11 @@ class ChangeListArchive(ListBaseWithIndex):
         super(ChangeListArchive, self).__init__(
             resources=resources, md=md, ln=ln, uri=uri,
             capability_name='changelist-archive',
-            spec_version=spec_version, add_lastmod=add_lastmod)
+            spec_version=spec_version, add_lastmod=add_lastmod,
+            resources_class=resources_class)
 
 
-class ResourceDumpArchive(ListBaseWithIndex):
+class ResourceDumpArchive(ListBaseArchive):
     """Class representing an Resource Dump Archive."""
 
     def __init__(self, resources=None, md=None, ln=None, uri=None,
@@ -58,7 +145,7 @@ class ResourceDumpArchive(ListBaseWithIndex):
             resources_class=resources_class)
 
 
-class ChangeDumpArchive(ListBaseWithIndex):
+class ChangeDumpArchive(ListBaseArchive):
     """Class representing an Change Dump Archive."""
 
     def __init__(self, resources=None, md=None, ln=None, uri=None,
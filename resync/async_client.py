@@ -0,0 +1,453 @@
+"""ResourceSync client using asyncio for concurrent requests.
+
+The AsyncClient follows exactly the same synchronization logic as Client
+(discovery via source description and capability list, comparison of
+resource lists, application of change lists, client state) but makes
+its requests to the source with asyncio so that many may be in flight
+at once from a single process:
+  - the component sitemaps of a sitemapindex are fetched concurrently
+  - resources are downloaded concurrently, bounded by max_concurrency
+    overall and max_per_host for any one host
+
+Requests use a minimal HTTP/1.1 implementation over asyncio streams so
+that no additional dependencies are required. As for Client, gzip or
+deflate content encoding is asked for and decoded as it is received. Retries, backoff and the
+adaptive per-host delay and concurrency follow self.retry_policy, and
+the per-host rate limit set with --delay applies as for Client.
+"""
+
+import asyncio
+import distutils.dir_util
+import gzip
+import http.client
+import io
+import os.path
+import re
+import shutil
+import socket
+import ssl
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+
+from . import __version__
+from .client import Client
+from .client_utils import ClientFatalError
+from .list_base_with_index import ListBaseWithIndex, ListBaseIndexError
+from .url_or_file_open import CONFIG, GZIP_MAGIC, RATE_LIMITER, DecodingWriter
+
+
+class HostLimit(object):
+    """Count of requests in flight to one host with a limit on that number."""
+
+    def __init__(self):
+        """Initialize HostLimit with no requests in flight."""
+        self.active = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, limit):
+        """Wait until fewer than limit requests are in flight, then add one."""
+        async with self.condition:
+            while (self.active >= limit):
+                await self.condition.wait()
+            self.active += 1
+
+    async def release(self):
+        """Remove one request in flight, waking any waiting."""
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+
+class AsyncClient(Client):
+    """Implementation of a ResourceSync client using asyncio.
+
+    max_concurrency - maximum number of requests in flight at any time
+
+    max_per_host - maximum number of requests in flight to any one host,
+        None for no limit beyond max_concurrency. Once a host has throttled
+        us (429 or 503) the limit is further reduced to the adaptive
+        concurrency for that host in self.retry_policy
+
+    Usage is the same as for Client, the synchronous methods baseline_or_audit,
+    incremental etc. each run an event loop for their requests.
+    """
+
+    REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 10
+    CHUNK_SIZE = 65536
+
+    def __init__(self, max_concurrency=100, max_per_host=None, **kwargs):
+        """Initialize AsyncClient, other arguments as for Client."""
+        super(AsyncClient, self).__init__(**kwargs)
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        # Limits belong to an event loop, there may be one in each thread
+        self._local = threading.local()
+
+    def run(self, coro):
+        """Run coroutine coro to completion in a new event loop."""
+        loop = asyncio.new_event_loop()
+        try:
+            return(loop.run_until_complete(self._with_limits(coro)))
+        finally:
+            loop.close()
+
+    async def _with_limits(self, coro):
+        # Synchronization objects must be created within the running loop
+        self._local.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._local.host_limits = {}
+        return(await coro)
+
+    # Overrides of Client methods to use asyncio
+
+    def read_list(self, list_obj, uri):
+        """Read list_obj from uri, fetching any component sitemaps concurrently."""
+        self.run(self.read_list_async(list_obj, uri))
+
+    def apply_changes(self, changes, allow_deletion=False, checkpoint=None):
+        """Apply a sequence of changes with concurrent downloads.
+
+        See Client.apply_changes(). Changes to different resources may
+        complete in any order but changes to the same resource are applied
+        in sequence. checkpoint(n) is called only once all of the first n
+        changes are complete.
+        """
+        return(self.run(self.apply_changes_async(changes, allow_deletion, checkpoint)))
+
+    # Coroutines
+
+    async def read_list_async(self, list_obj, uri):
+        """Read list_obj (ResourceList, ChangeList etc.) from uri.
+
+        Follows ListBaseWithIndex.read() except that all the component
+        sitemaps of a sitemapindex are requested concurrently. Components
+        are added to list_obj in sorted URI order as for the synchronous
+        read.
+        """
+        with_index = isinstance(list_obj, ListBaseWithIndex)
+        try:
+            data = await self.fetch(uri)
+        except IOError as e:
+            raise IOError("Failed to load sitemap/sitemapindex from %s (%s)" %
+                          (uri, str(e)))
+        data = self.record_list_read(list_obj, data)
+        self.logger.info("Read sitemap/sitemapindex from %s" % (uri))
+        s = list_obj.new_sitemap()
+        if (with_index):
+            list_obj.parse_sitemap_xml(s, io.BytesIO(data))
+        else:
+            s.parse_xml(fh=io.BytesIO(data), resources=list_obj,
+                        capability=list_obj.capability_name, sitemapindex=False)
+        list_obj.parsed_index = s.parsed_index
+        if (not s.parsed_index):
+            self.logger.info("Parsed as sitemap, %d resources" % (len(list_obj)))
+            return
+        if (not list_obj.allow_multifile):
+            raise ListBaseIndexError(
+                "Got sitemapindex from %s but support for sitemapindex disabled" %
+                (uri))
+        self.logger.info("Parsed as sitemapindex, %d sitemaps" % (len(list_obj.resources)))
+        sitemaps = list_obj.component_sitemaps(list_obj.resources)
+        list_obj.resources = list_obj.resources_class()
+        sitemapindex_is_file = list_obj.is_file_uri(uri)
+        component_uris = [list_obj.component_sitemap_uri(uri, sitemap.uri, sitemapindex_is_file)
+                          for sitemap in sitemaps]
+        self.logger.info("Now reading %d sitemaps" % (len(component_uris)))
+        tasks = [asyncio.ensure_future(self.fetch(component_uri))
+                 for component_uri in component_uris]
+        try:
+            for (component_uri, task) in zip(component_uris, tasks):
+                try:
+                    data = await task
+                except IOError as e:
+                    raise ListBaseIndexError(
+                        "Failed to load sitemap from %s listed in sitemap index %s (%s)" %
+                        (component_uri, uri, str(e)))
+                data = self.record_list_read(list_obj, data)
+                self.logger.info("Reading sitemap from %s (%d bytes)" %
+                                 (component_uri, len(data)))
+                for r in s.parse_xml(fh=io.BytesIO(data), sitemapindex=False):
+                    list_obj.add(r)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def record_list_read(self, list_obj, data):
+        """Update the counts of files and bytes read by list_obj.
+
+        Returns data, decompressed if it is gzipped.
+        """
+        list_obj.num_files = getattr(list_obj, 'num_files', 0) + 1
+        list_obj.content_length = len(data)
+        list_obj.bytes_read += len(data)
+        if (data[0:2] == GZIP_MAGIC):
+            data = gzip.decompress(data)
+        list_obj.bytes_uncompressed += len(data)
+        return(data)
+
+    async def apply_changes_async(self, changes, allow_deletion=False, checkpoint=None):
+        """Apply a sequence of (resource, change) pairs concurrently.
+
+        No more than 2 * max_concurrency changes are pending at once so that
+        very long lists do not create an equal number of tasks. A change to
+        a resource that already has a change pending waits for that to
+        complete first. Deletions are made directly as they need no requests.
+        The number of changes passed to checkpoint is the length of the
+        run of completed changes from the start of the sequence.
+        """
+        num = {'created': 0, 'updated': 0, 'deleted': 0}
+        pending = {}  # task -> (change, n)
+        by_uri = {}   # uri -> last task for that uri
+        window = 2 * self.max_concurrency
+        completed = set()  # n of changes completed out of order
+        num_done = 0       # changes 1..num_done all completed
+        self.last_checkpoint = time.time()
+
+        def complete(n):
+            nonlocal num_done
+            completed.add(n)
+            while (num_done + 1 in completed):
+                num_done += 1
+                completed.discard(num_done)
+            self.maybe_checkpoint(checkpoint, num_done)
+
+        async def wait_for(tasks, return_when):
+            done, _ = await asyncio.wait(tasks, return_when=return_when)
+            for task in done:
+                (change, n) = pending.pop(task)
+                num[change] += task.result()
+                complete(n)
+
+        try:
+            for (n, (resource, change)) in enumerate(changes, 1):
+                previous = by_uri.get(resource.uri)
+                if (previous is not None and previous in pending):
+                    await wait_for([previous], asyncio.ALL_COMPLETED)
+                if (change not in ('created', 'updated')):
+                    num[change] += self.apply_change(resource, change, allow_deletion)
+                    complete(n)
+                    continue
+                if (len(pending) >= window):
+                    await wait_for(list(pending), asyncio.FIRST_COMPLETED)
+                task = asyncio.ensure_future(self.apply_change_async(resource, change))
+                pending[task] = (change, n)
+                by_uri[resource.uri] = task
+            if (len(pending) > 0):
+                await wait_for(list(pending), asyncio.ALL_COMPLETED)
+        except BaseException:
+            self.maybe_checkpoint(checkpoint, num_done, force=True)
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+        return(num['created'], num['updated'], num['deleted'])
+
+    async def apply_change_async(self, resource, change):
+        """Download one created or updated resource, see Client.apply_change()."""
+        uri = resource.uri
+        filename = self.mapper.src_to_dst(uri)
+        self.logger.info("%s: %s -> %s" % (change, uri, filename))
+        if (self.dryrun):
+            return(self.update_resource(resource, filename, change))
+        return(await self.update_resource_async(resource, filename, change))
+
+    async def update_resource_async(self, resource, filename, change=None):
+        """Update resource from uri to filename, see Client.update_resource().
+
+        Returns the number of resources updated/created (0 or 1)
+        """
+        distutils.dir_util.mkpath(os.path.dirname(filename))
+        try:
+            await self.fetch(resource.uri, filename)
+        except IOError as e:
+            if (self.retry_policy.is_retryable(e)):
+                msg = "Failed to GET %s after %s tries -- %s" % (resource.uri, self.retry_policy.tries_for(e), str(e))
+            else:
+                msg = "Failed to GET %s -- %s" % (resource.uri, str(e))
+            if (self.ignore_failures):
+                self.logger.warning(msg)
+                return(0)
+            raise ClientFatalError(msg)
+        self.record_update(resource, filename, change)
+        return(1)
+
+    async def fetch(self, uri, filename=None):
+        """GET uri with retries according to self.retry_policy.
+
+        If filename is given then the content is written to that file,
+        otherwise it is returned as bytes. Raises IOError (including
+        HTTPError) on final failure.
+        """
+        policy = self.retry_policy
+        try_i = 0
+        while True:
+            try_i += 1
+            if (policy.adaptive):
+                delay = policy.host_throttle(uri).delay
+                if (delay > 0):
+                    await asyncio.sleep(delay)
+            try:
+                data = await self.fetch_once(uri, filename)
+                policy.record_success(uri)
+                return(data)
+            except IOError as e:
+                policy.record_failure(uri, e)
+                if (not policy.is_retryable(e) or try_i >= policy.tries_for(e)):
+                    raise
+                wait = policy.backoff(try_i, e)
+                self.logger.info("Download failed (%s), retrying in %.1fs..." %
+                                 (str(e), wait))
+                await asyncio.sleep(wait)
+
+    async def fetch_once(self, uri, filename=None):
+        """Single attempt to GET uri, within the concurrency limits."""
+        if (not re.match(r'''\w+:''', uri) or uri.startswith('file:')):
+            return(await self.read_local(uri, filename))
+        async with self._local.semaphore:
+            fh = open(filename, 'wb') if filename else io.BytesIO()
+            with fh:
+                await self.http_get(uri, fh)
+                if (filename is None):
+                    return(fh.getvalue())
+
+    def host_limit(self, uri):
+        """HostLimit for the host of uri in the current event loop."""
+        host = urlsplit(uri).netloc
+        host_limits = self._local.host_limits
+        if (host not in host_limits):
+            host_limits[host] = HostLimit()
+        return(host_limits[host])
+
+    def host_concurrency(self, uri):
+        """Number of requests permitted in flight to the host of uri."""
+        limit = self.max_per_host or self.max_concurrency
+        if (self.retry_policy.adaptive):
+            throttle = self.retry_policy.host_throttle(uri)
+            if (throttle.throttles > 0):
+                limit = min(limit, throttle.concurrency)
+        return(limit)
+
+    async def read_local(self, uri, filename=None):
+        """Read local file uri in an executor so as not to block the loop.
+
+        If filename is given then the file is copied in chunks of
+        CHUNK_SIZE bytes, otherwise the content is returned as bytes.
+        """
+        path = re.sub(r'''^file:(//)?''', '', uri)
+
+        def read():
+            with open(path, 'rb') as fh:
+                if (filename is None):
+                    return(fh.read())
+                with open(filename, 'wb') as fh_out:
+                    shutil.copyfileobj(fh, fh_out, self.CHUNK_SIZE)
+        # get_running_loop() is new in Python 3.7
+        loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+        return(await loop.run_in_executor(None, read))
+
+    async def http_get(self, uri, fh_out):
+        """GET uri over HTTP/1.1, following redirects, writing body to fh_out.
+
+        Each request, including those for redirects, is made within the
+        per-host limit and rate limit for the host it is made to. Any
+        Content-Encoding is decoded. Raises HTTPError for an error
+        response, socket.timeout if a read takes longer than self.timeout,
+        and ConnectionResetError if the connection is closed before the
+        full response is read.
+        """
+        for redirect in range(0, self.MAX_REDIRECTS + 1):
+            host_limit = self.host_limit(uri)
+            await host_limit.acquire(self.host_concurrency(uri))
+            try:
+                await RATE_LIMITER.acquire_async(uri)
+                (status, reason, headers, reader, writer) = await self.http_request(uri)
+                try:
+                    if (status in self.REDIRECT_STATUS_CODES and 'Location' in headers):
+                        uri = urljoin(uri, headers['Location'])
+                        continue
+                    if (status >= 400):
+                        raise HTTPError(uri, status, reason, headers, None)
+                    decoder = DecodingWriter(fh_out, headers.get('Content-Encoding'))
+                    await self.read_body(headers, reader, decoder)
+                    decoder.finish()
+                    return(headers)
+                finally:
+                    writer.close()
+            finally:
+                await host_limit.release()
+        raise HTTPError(uri, status, "Too many redirects", headers, None)
+
+    async def http_request(self, uri):
+        """Send GET request for uri, return (status, reason, headers, reader, writer)."""
+        parts = urlsplit(uri)
+        if (parts.scheme not in ('http', 'https')):
+            raise IOError("Unsupported URI scheme in %s" % (uri))
+        https = (parts.scheme == 'https')
+        port = parts.port or (443 if https else 80)
+        (reader, writer) = await self.with_timeout(asyncio.open_connection(
+            parts.hostname, port,
+            ssl=(ssl.create_default_context() if https else None)))
+        path = parts.path or '/'
+        if (parts.query):
+            path += '?' + parts.query
+        lines = ['GET %s HTTP/1.1' % (path),
+                 'Host: %s' % (parts.netloc),
+                 'User-Agent: resync/%s' % (__version__),
+                 'Accept-Encoding: %s' % (CONFIG['accept_encoding'] or 'identity'),
+                 'Connection: close']
+        if (CONFIG['bearer_token'] is not None):
+            lines.append('Authorization: Bearer ' + CONFIG['bearer_token'])
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        try:
+            status_line = await self.with_timeout(reader.readuntil(b'\r\n'))
+            header_block = await self.with_timeout(reader.readuntil(b'\r\n\r\n'))
+        except asyncio.LimitOverrunError:
+            writer.close()
+            raise IOError("Response headers too long from %s" % (uri))
+        except BaseException:
+            writer.close()
+            raise
+        m = re.match(r'''HTTP/\d\.\d\s+(\d{3})\s*(.*)''', status_line.decode('latin-1').strip())
+        if (not m):
+            writer.close()
+            raise IOError("Bad HTTP status line from %s" % (uri))
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+        return(int(m.group(1)), m.group(2), headers, reader, writer)
+
+    async def read_body(self, headers, reader, fh_out):
+        """Read response body from reader to fh_out."""
+        if ('chunked' in headers.get('Transfer-Encoding', '').lower()):
+            while True:
+                size_line = await self.with_timeout(reader.readuntil(b'\r\n'))
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if (size == 0):
+                    break
+                fh_out.write(await self.with_timeout(reader.readexactly(size)))
+                await self.with_timeout(reader.readexactly(2))
+        elif (headers.get('Content-Length') is not None):
+            remaining = int(headers['Content-Length'])
+            while (remaining > 0):
+                chunk = await self.with_timeout(reader.read(min(remaining, self.CHUNK_SIZE)))
+                if (not chunk):
+                    raise ConnectionResetError("Connection closed with %d bytes unread" % (remaining))
+                fh_out.write(chunk)
+                remaining -= len(chunk)
+        else:
+            while True:
+                chunk = await self.with_timeout(reader.read(self.CHUNK_SIZE))
+                if (not chunk):
+                    break
+                fh_out.write(chunk)
+
+    async def with_timeout(self, awaitable):
+        """Await awaitable applying self.timeout, raise IOError types on failure."""
+        try:
+            if (self.timeout is None):
+                return(await awaitable)
+            return(await asyncio.wait_for(awaitable, self.timeout))
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out")
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError("Connection closed with %s bytes unread" % (e.expected))
@@ -0,0 +1,395 @@
+"""Persistent append-only journal of changes.
+
+A ChangeJournal stores changes on disk as they are added, in a directory
+of segment files, so that a source can answer requests for the changes
+in any from/until window without holding or rewriting all changes. It
+may be used as the resources of a ChangeList so that ChangeList.add(...)
+writes to the journal:
+
+       journal = ChangeJournal('/var/lib/resync/journal')
+       cl = ChangeList(resources=journal)
+       cl.add(Resource('http://example.org/a', timestamp=..., change='updated'))
+       ...
+       window = journal.change_list(from_ts, until_ts)
+
+Each segment, NNNNNNNN.log, has one JSON object per change. Changes are
+grouped in blocks of block_records, and when a block is full its byte
+offsets, count and earliest and latest change times are added to the
+time index in NNNNNNNN.idx. A window query uses the index to find the
+first block that may hold changes in the window and reads blocks only
+until no later change can be in the window, so the time taken depends on
+the size of the window and not of the journal. Changes are expected to
+be added roughly in time order, changes out of order are found correctly
+but make the blocks read less selective.
+
+Only the core Resource attributes (those of Resource.from_values) are
+kept, links and other metadata are not.
+"""
+
+import bisect
+import json
+import logging
+import os
+import os.path
+import re
+import threading
+import time
+
+from .archives import ChangeListArchive
+from .change_list import ChangeList
+from .resource import Resource
+from .w3c_datetime import datetime_to_str
+
+# Short names used in journal records for Resource attributes
+RECORD_KEYS = (('u', 'uri'), ('c', 'change'), ('ts', 'timestamp'),
+               ('dt', 'ts_datetime'), ('l', 'length'), ('m', 'mime_type'),
+               ('md5', 'md5'), ('sha1', 'sha1'), ('sha256', 'sha256'), ('p', 'path'))
+SEGMENT_RE = re.compile(r'^(\d{8})\.log$')
+
+
+class JournalBlock(object):
+    """Location and time range of a block of changes in a segment file."""
+
+    __slots__ = ('segment', 'start', 'end', 'count', 'min_time', 'max_time')
+
+    def __init__(self, segment, start, end=None, count=0, min_time=None, max_time=None):
+        """Initialize JournalBlock at byte offset start of segment number segment."""
+        self.segment = segment
+        self.start = start
+        self.end = start if end is None else end
+        self.count = count
+        self.min_time = min_time
+        self.max_time = max_time
+
+    def add(self, change_time, size):
+        """Extend block by one record of size bytes for change_time."""
+        self.count += 1
+        self.end += size
+        if (self.min_time is None or change_time < self.min_time):
+            self.min_time = change_time
+        if (self.max_time is None or change_time > self.max_time):
+            self.max_time = change_time
+
+    def as_line(self):
+        """Line for this block in the segment index file."""
+        return("%d %d %d %r %r\n" % (self.start, self.end, self.count,
+                                     self.min_time, self.max_time))
+
+
+class ChangeJournal(object):
+    """Append-only journal of changes in a directory of segment files.
+
+    directory - where segment and index files are kept, created if needed
+
+    block_records - number of changes in each block of the time index
+
+    segment_records - number of changes in each segment file, old segments
+        may be removed with prune(...)
+
+    sync - set True to fsync the segment after each change is added
+
+    num_writes counts the changes added and prunes, so that a ChangeList
+    using the journal as its resources can tell when it has changed, see
+    ListBaseWithIndex.part_starts_key().
+    """
+
+    def __init__(self, directory, block_records=1000, segment_records=100000,
+                 sync=False):
+        """Open journal in directory, reading the time index."""
+        self.directory = directory
+        self.block_records = block_records
+        self.segment_records = segment_records
+        self.sync = sync
+        self.logger = logging.getLogger('resync.change_journal')
+        self.lock = threading.RLock()
+        self.blocks = []       # JournalBlock for every block, last may be open
+        self.max_before = []   # latest change time in this and all earlier blocks
+        self.min_after = []    # earliest change time in this and all later blocks
+        self.fh = None
+        self.num_writes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # Reading the index
+
+    def segment_file(self, segment, ext='log'):
+        """Path of file for segment number segment."""
+        return(os.path.join(self.directory, '%08d.%s' % (segment, ext)))
+
+    def segments(self):
+        """Sorted list of the numbers of segments on disk."""
+        segments = []
+        for name in os.listdir(self.directory):
+            m = SEGMENT_RE.match(name)
+            if (m):
+                segments.append(int(m.group(1)))
+        return(sorted(segments))
+
+    def _open(self):
+        # Read the time index then index any records after the last
+        # indexed block, discarding a partial record at the very end
+        segments = self.segments()
+        for segment in segments:
+            end = 0
+            idx = self.segment_file(segment, 'idx')
+            if (os.path.exists(idx)):
+                with open(idx, 'r') as fh:
+                    for line in fh:
+                        (start, end, count, min_time, max_time) = line.split()
+                        self.blocks.append(JournalBlock(segment, int(start), int(end), int(count),
+                                                        float(min_time), float(max_time)))
+                        end = int(end)
+            self._index_tail(segment, end, segment == segments[-1])
+        if (not segments):
+            self.blocks.append(JournalBlock(0, 0))
+        self._rebuild_time_ranges()
+        self.fh = open(self.segment_file(self.blocks[-1].segment), 'ab')
+
+    def _index_tail(self, segment, offset, last):
+        # Add records in segment from offset onwards to blocks
+        filename = self.segment_file(segment)
+        block = JournalBlock(segment, offset)
+        with open(filename, 'rb') as fh:
+            fh.seek(offset)
+            for line in fh:
+                if (not line.endswith(b'\n')):
+                    self.logger.warning("Discarding partial record at end of %s" % (filename))
+                    with open(filename, 'r+b') as fhw:
+                        fhw.truncate(block.end)
+                    break
+                block.add(json.loads(line.decode('utf-8'))['t'], len(line))
+                if (block.count >= self.block_records):
+                    self._close_block(block)
+                    self.blocks.append(block)
+                    block = JournalBlock(segment, block.end)
+        if (block.count > 0 or last):
+            self.blocks.append(block)
+
+    def _rebuild_time_ranges(self):
+        self.max_before = []
+        latest = None
+        for block in self.blocks:
+            if (block.max_time is not None and (latest is None or block.max_time > latest)):
+                latest = block.max_time
+            self.max_before.append(latest if latest is not None else float('-inf'))
+        self.min_after = [float('inf')] * len(self.blocks)
+        earliest = float('inf')
+        for j in range(len(self.blocks) - 1, -1, -1):
+            if (self.blocks[j].min_time is not None and self.blocks[j].min_time < earliest):
+                earliest = self.blocks[j].min_time
+            self.min_after[j] = earliest
+
+    # Adding changes
+
+    def append(self, resource):
+        """Add change resource to the end of the journal."""
+        change_time = self.change_time(resource)
+        record = {'t': change_time}
+        for (key, att) in RECORD_KEYS:
+            value = getattr(resource, att)
+            if (value is not None):
+                record[key] = value
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            block = self.blocks[-1]
+            if (block.count >= self.block_records):
+                self._close_block(block)
+                if (self.records_in_segment(block.segment) >= self.segment_records):
+                    self.fh.close()
+                    self.fh = open(self.segment_file(block.segment + 1), 'ab')
+                    block = JournalBlock(block.segment + 1, 0)
+                else:
+                    block = JournalBlock(block.segment, block.end)
+                self.blocks.append(block)
+                self.max_before.append(self.max_before[-1])
+                self.min_after.append(float('inf'))
+            self.fh.write(line)
+            self.fh.flush()
+            if (self.sync):
+                os.fsync(self.fh.fileno())
+            block.add(change_time, len(line))
+            self.num_writes += 1
+            if (change_time > self.max_before[-1]):
+                self.max_before[-1] = change_time
+            j = len(self.blocks) - 1
+            while (j >= 0 and self.min_after[j] > change_time):
+                self.min_after[j] = change_time
+                j -= 1
+
+    def extend(self, resources):
+        """Add each of resources in order."""
+        for resource in resources:
+            self.append(resource)
+
+    def change_time(self, resource):
+        """Time of the change described by resource, used for the time index."""
+        if (resource.ts_datetime is not None):
+            return(resource.ts_datetime)
+        if (resource.timestamp is not None):
+            return(resource.timestamp)
+        return(time.time())
+
+    def records_in_segment(self, segment):
+        """Number of records in segment."""
+        return(sum(b.count for b in self.blocks if b.segment == segment))
+
+    def _close_block(self, block):
+        # Add index line for full block
+        with open(self.segment_file(block.segment, 'idx'), 'a') as fh:
+            fh.write(block.as_line())
+
+    # Reading changes
+
+    def __len__(self):
+        """Number of changes in the journal."""
+        return(sum(b.count for b in self.blocks))
+
+    def __iter__(self):
+        """Iterator over all changes in the order added."""
+        return(self.changes())
+
+    def changes(self, from_ts=None, until_ts=None):
+        """Iterator over changes with from_ts <= change time < until_ts.
+
+        Either limit may be None for no limit. Changes are returned in the
+        order added.
+        """
+        with self.lock:
+            self.fh.flush()
+            if (from_ts is None):
+                j = 0
+            else:
+                j = bisect.bisect_left(self.max_before, from_ts)
+            blocks = []
+            while (j < len(self.blocks)):
+                if (until_ts is not None and self.min_after[j] >= until_ts):
+                    break
+                block = self.blocks[j]
+                if (block.count > 0
+                        and (from_ts is None or block.max_time >= from_ts)
+                        and (until_ts is None or block.min_time < until_ts)):
+                    blocks.append((block.segment, block.start, block.end))
+                j += 1
+        for (segment, start, end) in blocks:
+            for record in self.read_block(segment, start, end):
+                t = record['t']
+                if ((from_ts is None or t >= from_ts) and (until_ts is None or t < until_ts)):
+                    yield(self.record_to_resource(record))
+
+    def read_block(self, segment, start, end):
+        """Yield records from byte start to end of segment."""
+        with open(self.segment_file(segment), 'rb') as fh:
+            fh.seek(start)
+            data = fh.read(end - start)
+        for line in data.splitlines():
+            yield(json.loads(line.decode('utf-8')))
+
+    def record_to_resource(self, record):
+        """Resource for journal record."""
+        return(Resource.from_values(
+            record['u'], timestamp=record.get('ts'), length=record.get('l'),
+            mime_type=record.get('m'), md5=record.get('md5'), sha1=record.get('sha1'),
+            sha256=record.get('sha256'), change=record.get('c'),
+            ts_datetime=record.get('dt'), path=record.get('p')))
+
+    def change_list(self, from_ts=None, until_ts=None, **kwargs):
+        """Return ChangeList of the changes in the window from_ts to until_ts.
+
+        md_from and md_until of the Change List are set from the window,
+        md_from defaults to the time of the first change. kwargs are
+        passed to the ChangeList constructor.
+        """
+        cl = ChangeList(**kwargs)
+        cl.add(self.changes(from_ts, until_ts))
+        if (from_ts is None):
+            from_ts = self.first_time()
+        if (from_ts is not None):
+            cl.md_from = datetime_to_str(from_ts)
+        if (until_ts is not None):
+            cl.md_until = datetime_to_str(until_ts)
+        return(cl)
+
+    def first_time(self):
+        """Earliest change time in the journal, None if empty."""
+        return(self.min_after[0] if self.blocks and self.min_after[0] != float('inf') else None)
+
+    def last_time(self):
+        """Latest change time in the journal, None if empty."""
+        return(self.max_before[-1] if self.max_before and self.max_before[-1] != float('-inf') else None)
+
+    # Archives
+
+    def windows(self, period, start=None, until_ts=None):
+        """Yield (from_ts, until_ts) for complete windows of period seconds.
+
+        Windows start at start, by default the first change time rounded
+        down to a multiple of period, and end no later than until_ts, by
+        default the current time.
+        """
+        first = self.first_time()
+        if (first is None):
+            return
+        if (start is None):
+            start = first - (first % period)
+        if (until_ts is None):
+            until_ts = time.time()
+        while (start + period <= until_ts):
+            yield(start, start + period)
+            start += period
+
+    def window_uri(self, base_uri, from_ts, until_ts):
+        """URI of the Change List for a window, e.g. base_uri + changelist-20200101T000000Z.xml."""
+        return("%schangelist-%s.xml" %
+               (base_uri, datetime_to_str(from_ts, no_fractions=True).replace('-', '').replace(':', '')))
+
+    def change_list_archive(self, base_uri, period, until_ts=None, **kwargs):
+        """Return ChangeListArchive listing a Change List for each complete window.
+
+        Each entry has md_from and md_until of its window and the URI given
+        by window_uri(...). Windows with no changes are not listed. The
+        Change List for an entry is given by change_list(from_ts, until_ts).
+        """
+        cla = ChangeListArchive(**kwargs)
+        for (from_ts, window_until) in self.windows(period, until_ts=until_ts):
+            if (next(self.changes(from_ts, window_until), None) is None):
+                continue
+            cla.add(Resource(uri=self.window_uri(base_uri, from_ts, window_until),
+                             md_from=datetime_to_str(from_ts), md_until=datetime_to_str(window_until)))
+        return(cla)
+
+    # Maintenance
+
+    def prune(self, before_ts):
+        """Remove segments with only changes before before_ts, return number of changes removed.
+
+        The segment being written to is never removed.
+        """
+        with self.lock:
+            current = self.blocks[-1].segment
+            removable = set()
+            for segment in set(b.segment for b in self.blocks):
+                if (segment == current):
+                    continue
+                seg_blocks = [b for b in self.blocks if b.segment == segment]
+                if (all(b.max_time is None or b.max_time < before_ts for b in seg_blocks)):
+                    removable.add(segment)
+            removed = sum(b.count for b in self.blocks if b.segment in removable)
+            for segment in removable:
+                for ext in ('log', 'idx'):
+                    if (os.path.exists(self.segment_file(segment, ext))):
+                        os.unlink(self.segment_file(segment, ext))
+            self.blocks = [b for b in self.blocks if b.segment not in removable]
+            self._rebuild_time_ranges()
+            if (removed):
+                self.num_writes += 1
+        if (removed):
+            self.logger.info("Pruned %d changes before %s from journal" %
+                             (removed, datetime_to_str(before_ts)))
+        return(removed)
+
+    def close(self):
+        """Close the segment being written to."""
+        with self.lock:
+            if (self.fh is not None):
+                self.fh.close()
+                self.fh = None
@@ -15,32 +15,160 @@ ChangeList containing descriptions pertaining to that
 particular resource.
 """
 
+import bisect
+import copy
 import collections.abc
+import itertools
+from collections import OrderedDict
 
 from .list_base_with_index import ListBaseWithIndex
-from .resource import Resource, ChangeTypeError
+from .resource import ChangeTypeError
+from .resource_container import CountedList, ResourceContainer
 from .sitemap import Sitemap
 
 
+class ChangeFolder(object):
+    """Store for a ChangeList that keeps only the latest change for each URI.
+
+    Changes are folded as they are appended, with the same result as
+    ResourceContainer.prune_dupes() on the full list: a later change for
+    a URI replaces any earlier one and takes its position at the end, and
+    a delete of a resource whose first change was a create removes it
+    altogether. Superseded changes are never stored so that reading a long
+    change list needs memory only for the resources changed.
+
+    Use as the resources_class of a ChangeList:
+
+        cl = ChangeList(resources_class=ChangeFolder)
+
+    The delete of a resource removed by a create then delete is kept out of
+    sight so that fold_in() can combine the folders for an earlier and a
+    later list with the same result as folding all the changes in turn.
+    The changes attribute counts the changes folded in, as for CountedList.
+    """
+
+    def __init__(self, resources=None):
+        """Initialize ChangeFolder, folding in any resources given."""
+        self._changes = OrderedDict()  # uri -> latest change
+        self._created_first = set()    # uris whose first change was a create
+        self._cancelled = set()        # uris created then deleted, not listed
+        self.num_added = 0
+        self.changes = 0
+        if (resources is not None):
+            self.extend(resources)
+
+    def append(self, resource):
+        """Fold in resource, a later change than all those already added."""
+        self.num_added += 1
+        self.fold(resource, resource.change == 'created')
+
+    def extend(self, resources):
+        """Fold in each of resources in order."""
+        for resource in resources:
+            self.append(resource)
+
+    def fold_in(self, later):
+        """Fold in the changes in later, all after those already added.
+
+        later is a ChangeFolder, or a sequence of changes that are
+        appended in turn.
+        """
+        if (not isinstance(later, ChangeFolder)):
+            self.extend(later)
+            return
+        self.num_added += later.num_added
+        for (uri, resource) in later._changes.items():
+            self.fold(resource, uri in later._created_first)
+
+    def fold(self, resource, created_first):
+        """Fold in resource, the latest change for its URI.
+
+        created_first is used if this is the first change for the URI, it
+        is True if the first change was a create.
+        """
+        self.changes += 1
+        uri = resource.uri
+        if (uri not in self._changes):
+            if (created_first):
+                self._created_first.add(uri)
+        else:
+            del self._changes[uri]
+            self._cancelled.discard(uri)
+        self._changes[uri] = resource
+        if (resource.change == 'deleted' and uri in self._created_first):
+            # create then delete cancel out, nothing to do for this resource
+            self._cancelled.add(uri)
+
+    @property
+    def num_pruned(self):
+        """Number of changes added that have been folded away."""
+        return(self.num_added - len(self))
+
+    def __iter__(self):
+        """Iterator over latest changes in order of last change."""
+        return(r for (uri, r) in self._changes.items() if uri not in self._cancelled)
+
+    def __len__(self):
+        """Number of resources with a change."""
+        return(len(self._changes) - len(self._cancelled))
+
+    def __getitem__(self, index):
+        """Return the change at position index."""
+        if (index < 0):
+            index += len(self)
+        try:
+            return(next(itertools.islice(iter(self), index, None)))
+        except (StopIteration, ValueError):
+            raise IndexError("ChangeFolder index out of range")
+
+
 class ChangeList(ListBaseWithIndex):
-    """Class representing an Change List."""
+    """Class representing an Change List.
+
+    If from_timestamp is set then changes before that time are skipped as
+    they are added, and so as they are read. When reading a Change List
+    Index, component sitemaps whose md_until is before from_timestamp are
+    not read at all. The number of changes and sitemaps skipped are
+    recorded in num_skipped and num_sitemaps_skipped.
+
+    Changes are kept in a CountedList by default so that the part
+    boundaries of a large Change List are kept between requests for
+    component sitemaps, see ListBaseWithIndex.part_starts_key().
+    """
 
     def __init__(self, resources=None, md=None, ln=None, uri=None,
                  mapper=None, spec_version='1.1', add_lastmod=False,
-                 resources_class=list):
+                 resources_class=CountedList, from_timestamp=None):
         """Initialize ChangeList."""
         super(ChangeList, self).__init__(
             resources=resources, md=md, ln=ln, uri=uri,
             capability_name='changelist', mapper=mapper,
             spec_version=spec_version, add_lastmod=add_lastmod,
             resources_class=resources_class)
+        self.from_timestamp = from_timestamp
+        self.num_skipped = 0
+        self.num_sitemaps_skipped = 0
+
+    def change_timestamp(self, resource):
+        """Timestamp of change for resource, datetime (1.1) or lastmod (1.0)."""
+        if (self.spec_version == '1.0'):
+            return(resource.timestamp)
+        return(resource.ts_datetime)
 
     def add_if_changed(self, resource):
-        """Add resource if change is not None else ChangeTypeError."""
-        if (resource.change is not None):
-            self.resources.append(resource)
-        else:
+        """Add resource if change is not None else ChangeTypeError.
+
+        Changes before self.from_timestamp, if set, are counted in
+        self.num_skipped but not added.
+        """
+        if (resource.change is None):
             raise ChangeTypeError(resource.change)
+        if (self.from_timestamp is not None):
+            ts = self.change_timestamp(resource)
+            if (ts is not None and ts < self.from_timestamp):
+                self.num_skipped += 1
+                return
+        self.resources.append(resource)
 
     def add(self, resource):
         """Add a resource change or an iterable collection of them.
@@ -61,26 +189,80 @@ class ChangeList(ListBaseWithIndex):
         objects created.
         """
         for resource in resources:
-            rc = Resource(resource=resource, change=change)
+            rc = copy.copy(resource)
+            if (change is not None):
+                rc.change = change
             self.add(rc)
 
+    def prune_dupes(self):
+        """Remove all but the last entry for a given resource URI.
+
+        See ResourceContainer.prune_dupes(). If self.resources is a
+        ChangeFolder then this was done as changes were added and the
+        number of entries folded away is returned.
+        """
+        if (isinstance(self.resources, ChangeFolder)):
+            return(self.resources.num_pruned)
+        return(super(ChangeList, self).prune_dupes())
+
+    def parse_sitemap_xml(self, sitemap, fh):
+        """Parse sitemap or sitemapindex from fh into self.
+
+        The entries of a Change List Index describe component sitemaps
+        and have no change attribute, so the document is first parsed into
+        a plain container and the changes then added to self.
+        """
+        container = ResourceContainer()
+        sitemap.parse_xml(fh=fh, resources=container, capability=self.capability_name)
+        self.md = container.md
+        self.ln = container.ln
+        if (sitemap.parsed_index):
+            self.resources = container.resources
+        else:
+            self.add(container.resources)
+
+    def skip_component_sitemap(self, sitemap):
+        """True if all changes in sitemap are before self.from_timestamp.
+
+        Relies on the md_until given for the sitemap in the Change List
+        Index, a sitemap without md_until is always read.
+        """
+        if (self.from_timestamp is None or sitemap.ts_until is None
+                or sitemap.ts_until >= self.from_timestamp):
+            return(False)
+        self.num_sitemaps_skipped += 1
+        return(True)
+
     def prune_updates_before(self, timestamp, spec_version='1.1'):
         """Remove all resource updates earlier than the given timestamp.
 
         Returns the number of entries removed. Will raise an excpetion
         if there are any entries without a datetime (1.1) or
         timestamp (1.0).
+
+        Change lists are normally in time order in which case the entries
+        to remove are found by binary search and removed from the start of
+        the list in place. Otherwise the list is rebuilt without them.
         """
-        n = 0
-        pruned = []
         use_timestamp = (spec_version == '1.0')  # Else use datetime
+        times = []
+        in_order = True
         for r in self.resources:
             ts = r.timestamp if use_timestamp else r.ts_datetime
             if (ts is None):
                 raise Exception("Entry %s has no update datetime/timestamp" % (r.uri))
-            elif (ts >= timestamp):
-                pruned.append(r)
-            else:
-                n += 1
-        self.resources = pruned
+            if (in_order and len(times) > 0 and ts < times[-1]):
+                in_order = False
+            times.append(ts)
+        if (in_order and isinstance(self.resources, list)):
+            n = bisect.bisect_left(times, timestamp)
+            if (n > 0):
+                del self.resources[:n]
+            return(n)
+        pruned = [r for (r, ts) in zip(self.resources, times) if ts >= timestamp]
+        n = len(times) - len(pruned)
+        if (n > 0 and isinstance(self.resources, list)):
+            self.resources[:] = pruned
+        elif (n > 0):
+            self.resources = pruned
         return(n)
@@ -0,0 +1,434 @@
+"""Watch files on disk and write Change Lists as they change.
+
+Client.write_change_list() finds changes by comparing a reference
+Resource List with a new scan of the whole tree. A ChangeWatcher instead
+runs alongside the source, notices changes as they are made and adds them
+to a rolling Change List that is written out within seconds:
+
+       watcher = ChangeWatcher(Mapper(['http://example.org/', '/data']),
+                               basename='/www/changelist.xml',
+                               max_changes=10000, max_age=86400)
+       watcher.run()
+
+On Linux, inotify is used so that only changed files are looked at.
+Elsewhere, or if inotify fails, the tree is scanned every poll_interval
+seconds and compared with the previous scan. When the Change List holds
+max_changes changes or is max_age seconds old it is closed with an until
+time, kept under a numbered name, and listed in a Change List Archive.
+"""
+
+import bisect
+import copy
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+
+from .archives import ChangeListArchive
+from .change_list import ChangeList
+from .mapper import MapperError
+from .resource import Resource
+from .resource_list import ResourceList
+from .resource_list_builder import ResourceListBuilder
+from .w3c_datetime import datetime_to_str
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+              | IN_DONTFOLLOW)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyEvents(object):
+    """Source of changed paths using Linux inotify through ctypes.
+
+    A watch is added for every directory under the start paths, and for
+    new directories as they are created. read(timeout) returns the set of
+    paths that have events, or None if events were lost and everything
+    must be rescanned.
+    """
+
+    def __init__(self, paths, exclude=None):
+        """Initialize and add watches for all directories under paths."""
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if (self.fd < 0):
+            e = ctypes.get_errno()
+            raise OSError(e, "inotify_init1 failed: %s" % (os.strerror(e)))
+        self.exclude = exclude
+        self.watches = {}  # wd -> directory
+        for path in paths:
+            if (os.path.isdir(path)):
+                self.add_watches(path)
+
+    @classmethod
+    def available(cls):
+        """True if inotify can be used on this system."""
+        if (not sys.platform.startswith('linux')):
+            return(False)
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            return(hasattr(libc, 'inotify_init1'))
+        except OSError:
+            return(False)
+
+    def add_watches(self, path):
+        """Add watches for directory path and all directories below it."""
+        for dirpath, dirs, files in os.walk(path, topdown=True):
+            if (self.exclude is not None):
+                dirs[:] = [d for d in dirs if not self.exclude(d)]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if (wd < 0):
+                e = ctypes.get_errno()
+                if (e == errno.ENOSPC):
+                    raise OSError(e, "Too many inotify watches, see fs.inotify.max_user_watches")
+                # Directory may have gone already
+                continue
+            self.watches[wd] = dirpath
+
+    def read(self, timeout=0):
+        """Return set of paths with events in up to timeout seconds, None to rescan."""
+        paths = set()
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        while (readable):
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while (pos + EVENT_HEADER.size <= len(data)):
+                (wd, mask, cookie, name_len) = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + name_len].rstrip(b'\0')
+                pos += name_len
+                if (mask & IN_Q_OVERFLOW):
+                    return(None)
+                dirpath = self.watches.get(wd)
+                if (dirpath is None):
+                    continue
+                if (mask & IN_IGNORED):
+                    del self.watches[wd]
+                    continue
+                if (mask & (IN_DELETE_SELF | IN_MOVE_SELF)):
+                    # Watch path is no longer right, a moved directory
+                    # is watched again from IN_MOVED_TO in its new parent
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    del self.watches[wd]
+                    paths.add(dirpath)
+                    continue
+                path = os.path.join(dirpath, os.fsdecode(name)) if name else dirpath
+                if ((mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO))):
+                    # New directory, files may already be in it
+                    self.add_watches(path)
+                paths.add(path)
+        return(paths)
+
+    def close(self):
+        """Close the inotify file descriptor."""
+        if (self.fd >= 0):
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingEvents(object):
+    """Source of changes that asks for a rescan every poll_interval seconds."""
+
+    def __init__(self, poll_interval=10.0):
+        """Initialize PollingEvents."""
+        self.poll_interval = poll_interval
+        self.last_poll = time.time()
+
+    def read(self, timeout=0):
+        """Wait up to timeout seconds, return None when it is time to rescan."""
+        wait = self.last_poll + self.poll_interval - time.time()
+        if (wait > timeout):
+            time.sleep(timeout)
+            return(set())
+        if (wait > 0):
+            time.sleep(wait)
+        self.last_poll = time.time()
+        return(None)
+
+    def close(self):
+        """Nothing to close."""
+        pass
+
+
+class ChangeWatcher(object):
+    """Watch files on disk and keep a Change List up to date.
+
+    mapper - Mapper between URIs and the files to watch, also used to
+        work out the URIs of the Change Lists written
+
+    basename - file name of the current Change List, archived Change Lists
+        are written alongside with numbered names (see archive_name()) and
+        are listed in the Change List Archive archive_basename
+
+    builder - ResourceListBuilder used to describe files, and to scan the
+        tree when polling; set_hashes, set_length and exclude patterns apply
+
+    max_changes, max_age - the current Change List is archived and a new
+        one started when it holds max_changes changes or when max_age
+        seconds have passed since it was started, if set
+
+    use_inotify - True to use inotify, False to poll every poll_interval
+        seconds, None (default) to use inotify if available
+
+    publish_interval - minimum number of seconds between writes of the
+        current Change List while changes are coming in
+    """
+
+    def __init__(self, mapper, basename='changelist.xml', archive_basename=None,
+                 builder=None, max_changes=None, max_age=None, use_inotify=None,
+                 poll_interval=10.0, publish_interval=1.0):
+        """Initialize ChangeWatcher, does not start watching."""
+        self.mapper = mapper
+        self.basename = basename
+        if (archive_basename is None):
+            archive_basename = os.path.join(os.path.dirname(basename), 'changelist-archive.xml')
+        self.archive_basename = archive_basename
+        self.builder = builder if builder is not None else ResourceListBuilder(mapper=mapper)
+        if (self.builder.mapper is None):
+            self.builder.mapper = mapper
+        self.max_changes = max_changes
+        self.max_age = max_age
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.publish_interval = publish_interval
+        self.logger = logging.getLogger('resync.change_watcher')
+        self.paths = [m.dst_path for m in mapper.mappings]
+        self.events = None
+        self.current = None          # ResourceList of files as last seen
+        self.change_list = None      # ChangeList being added to
+        self.started = None          # time current Change List started
+        self.archive = None
+        self.dirty = False           # changes not yet written
+        self.last_publish = 0
+        self.stopped = False
+
+    def start(self):
+        """Scan the files, set up change notification and write empty Change List."""
+        if (self.use_inotify is None):
+            self.use_inotify = InotifyEvents.available()
+        if (self.use_inotify):
+            try:
+                self.events = InotifyEvents(self.paths, exclude=self.builder.is_excluded)
+            except OSError as e:
+                self.logger.warning("Cannot use inotify (%s), polling instead" % (str(e)))
+                self.use_inotify = False
+        if (not self.use_inotify):
+            self.events = PollingEvents(self.poll_interval)
+        # Initial scan after watches are set so no change is missed
+        self.current = self.scan()
+        self.archive = ChangeListArchive()
+        self.archive.replace_files = True
+        if (os.path.exists(self.archive_basename)):
+            self.archive.read(uri=self.archive_basename)
+        self.new_change_list()
+        self.publish()
+        self.logger.info("Watching %d files with %s" %
+                         (len(self.current), 'inotify' if self.use_inotify else 'polling'))
+
+    def run(self, duration=None, timeout=1.0):
+        """Watch for changes until stop() is called, or for duration seconds."""
+        if (self.events is None):
+            self.start()
+        end = None if duration is None else time.time() + duration
+        try:
+            while (not self.stopped and (end is None or time.time() < end)):
+                self.check(timeout)
+        finally:
+            self.publish()
+            self.events.close()
+
+    def stop(self):
+        """Ask run() to stop, may be called from a signal handler or another thread."""
+        self.stopped = True
+
+    def check(self, timeout=0):
+        """Wait up to timeout seconds for changes and add any to the Change List.
+
+        Returns the number of changes added.
+        """
+        paths = self.events.read(timeout)
+        before = len(self.change_list)
+        if (paths is None):
+            self.rescan()
+        else:
+            for path in sorted(paths):
+                self.check_path(path)
+        num = len(self.change_list) - before
+        if (num > 0):
+            self.dirty = True
+        if (self.dirty and time.time() - self.last_publish >= self.publish_interval):
+            self.publish()
+        self.rotate_if_needed()
+        return(num)
+
+    # Finding changes
+
+    def scan(self):
+        """Return ResourceList from a scan of all files."""
+        rl = ResourceList()
+        for path in self.paths:
+            if (os.path.exists(path)):
+                self.builder.from_disk_add_path(path=path, resource_list=rl)
+        return(rl)
+
+    def rescan(self):
+        """Scan all files and add changes since the last scan."""
+        new = self.scan()
+        (same, updated, deleted, created) = self.current.compare(new)
+        self.change_list.add_changed_resources(updated, change='updated')
+        for r in deleted:
+            self.add_deleted(r)
+        self.change_list.add_changed_resources(created, change='created')
+        self.current = new
+
+    def check_path(self, path):
+        """Add changes for file or directory path, which may have been deleted."""
+        if (self.is_output(path)):
+            return
+        if (os.path.isdir(path)):
+            rl = ResourceList()
+            self.builder.from_disk_add_path(path=path, resource_list=rl)
+            for r in rl:
+                self.add_if_changed(r)
+            return
+        rl = ResourceList()
+        if (os.path.exists(path)):
+            self.builder.add_file(resource_list=rl, file=path)
+            for r in rl:
+                self.add_if_changed(r)
+        if (len(rl) == 0):
+            # Gone, either a file or a whole directory
+            try:
+                uri = self.mapper.dst_to_src(path)
+            except MapperError:
+                return
+            for uri in self.current_uris_for(uri):
+                self.add_deleted(self.current.resources[uri])
+
+    def current_uris_for(self, uri):
+        """List of URIs for uri and for everything below uri/ in self.current."""
+        uris = self.current.resources.uri_index()
+        found = [uri] if uri in self.current.resources else []
+        prefix = uri.rstrip('/') + '/'
+        j = bisect.bisect_left(uris, prefix)
+        while (j < len(uris) and uris[j].startswith(prefix)):
+            found.append(uris[j])
+            j += 1
+        return(found)
+
+    def add_if_changed(self, resource):
+        """Add resource as created or updated if different to self.current."""
+        old = self.current.resources.get(resource.uri)
+        if (old is not None and old == resource):
+            return
+        self.current.add(resource, replace=True)
+        rc = copy.copy(resource)
+        rc.change = ('created' if old is None else 'updated')
+        self.change_list.add(rc)
+
+    def add_deleted(self, resource):
+        """Add deletion of resource, with the current time."""
+        self.current.resources.pop(resource.uri, None)
+        self.change_list.add(Resource.from_values(resource.uri, timestamp=time.time(),
+                                                  change='deleted'))
+
+    def is_output(self, path):
+        """True if path is one of the files written by this watcher.
+
+        Includes the temporary files that are written and then renamed,
+        see ListBaseWithIndex.output_file().
+        """
+        name = os.path.basename(path)
+        prefix = os.path.basename(self.basename)
+        if (prefix.endswith('.xml')):
+            prefix = prefix[:-4]
+        dirname = os.path.dirname(os.path.abspath(path))
+        if (name.startswith('.tmp-') and name.endswith('.xml')
+                and dirname in (os.path.dirname(os.path.abspath(self.basename)),
+                                os.path.dirname(os.path.abspath(self.archive_basename)))):
+            return(True)
+        return(os.path.abspath(path) == os.path.abspath(self.archive_basename)
+               or (name.startswith(prefix) and name.endswith('.xml')
+                   and dirname == os.path.dirname(os.path.abspath(self.basename))))
+
+    # Writing Change Lists
+
+    def new_change_list(self, md_from=None):
+        """Start a new, empty, Change List from md_from or now."""
+        self.change_list = ChangeList(mapper=self.mapper)
+        self.change_list.replace_files = True
+        self.change_list.md_from = md_from or datetime_to_str()
+        self.started = time.time()
+
+    def publish(self):
+        """Write the current Change List to self.basename.
+
+        The file is replaced, not rewritten in place, so that a client
+        reading it at the same time sees either the old or new version.
+        """
+        self.change_list.write(basename=self.basename)
+        self.dirty = False
+        self.last_publish = time.time()
+
+    def rotate_if_needed(self):
+        """Archive the current Change List if it is full or too old."""
+        num = len(self.change_list)
+        if (num == 0):
+            return(False)
+        if ((self.max_changes is not None and num >= self.max_changes)
+                or (self.max_age is not None and time.time() - self.started >= self.max_age)):
+            self.rotate()
+            return(True)
+        return(False)
+
+    def rotate(self):
+        """Close the current Change List, add it to the archive and start a new one."""
+        until = datetime_to_str()
+        self.change_list.md_until = until
+        filename = self.archive_name(len(self.archive))
+        self.change_list.write(basename=filename)
+        self.archive.add(Resource(uri=self.output_uri(filename),
+                                  md_from=self.change_list.md_from, md_until=until))
+        self.archive.write(basename=self.archive_basename)
+        self.logger.info("Archived Change List of %d changes as %s" %
+                         (len(self.change_list), filename))
+        self.new_change_list(md_from=until)
+        self.publish()
+
+    def archive_name(self, number):
+        """File name for archived Change List number, e.g. changelist-00001.xml."""
+        prefix = self.basename[:-4] if self.basename.endswith('.xml') else self.basename
+        return("%s-%05d.xml" % (prefix, number))
+
+    def output_uri(self, filename):
+        """URI of a file written, from self.mapper or else relative."""
+        try:
+            return(self.mapper.dst_to_src(filename))
+        except MapperError:
+            return(os.path.basename(filename))
@@ -1,34 +1,47 @@
 """ResourceSync client implementation."""
 
 import sys
+import concurrent.futures
 try:  # python3
+    from urllib.error import HTTPError
     from urllib.parse import urlsplit, urlunsplit, urljoin
 except ImportError:  # pragma: no cover  python2
+    from urllib2 import HTTPError  # pragma: no cover
     from urlparse import urlsplit, urlunsplit, urljoin  # pragma: no cover
 import os.path
 import datetime
 import distutils.dir_util
+import collections
+import itertools
 import re
+import tempfile
+import threading
 import time
 import logging
 import shutil
-import socket
 
 from .resource_list_builder import ResourceListBuilder
 from .resource_list import ResourceList
-from .change_list import ChangeList
+from .change_list import ChangeList, ChangeFolder
+from .archives import ChangeListArchive
 from .capability_list import CapabilityList
 from .source_description import SourceDescription
-from .mapper import Mapper
+from .mapper import Mapper, MapperError
 from .sitemap import Sitemap
-from .dump import Dump
+from .dump import Dump, DumpError
+from .change_dump_manifest import ChangeDumpManifest
+from .dump_reader import DumpReader, DumpReaderError
+from .resource_dump import ResourceDump
+from .change_dump import ChangeDump
 from .resource import Resource
 from .url_authority import UrlAuthority
 from .hashes import Hashes
+from .uri_table import UriTable
 from .client_state import ClientState
 from .client_utils import ClientFatalError, ClientError
+from .retry_policy import RetryPolicy
 from .list_base_with_index import ListBaseIndexError
-from .url_or_file_open import url_or_file_open
+from .url_or_file_open import url_or_file_open, RATE_LIMITER
 from .w3c_datetime import str_to_datetime, datetime_to_str
 
 
@@ -53,6 +66,9 @@ class Client(object):
         self.resource_list_name = 'resourcelist.xml'
         self.change_list_name = 'changelist.xml'
         self.dump_format = None
+        self.dump_workers = 1
+        self.use_dumps = False  # copy content from source dumps where possible
+        self.discovered = None  # result of discovery for the last sync
         self.exclude_patterns = []
         self.sitemap_name = None
         self.capability_list_uri = None
@@ -60,19 +76,36 @@ class Client(object):
         self.noauth = False
         self.strictauth = False
         self.max_sitemap_entries = None
+        self.max_sitemap_bytes = None
+        self.gzip_sitemaps = False
+        self.sitemap_workers = 1
+        self.archive_workers = 4  # archived change lists read in parallel
+        self.checkpoint_interval = 60  # seconds between checkpoints of a sync, None to disable
         self.ignore_failures = False
         self.pretty_xml = True
         self.fake_input = None
-        self.tries = 20
+        self.retry_policy = RetryPolicy()
+        self.uri_table = UriTable()  # shared by source and destination lists
         self.timeout = None
         # Default file names
         self.status_file = '.resync-client-status.cfg'
+        self.discovery_ttl = 0  # seconds to reuse discovery results, 0 to disable
         self.default_resource_dump = 'resourcedump.zip'
-        self.default_change_dump = 'changedump.zip'
+        self.default_change_dump = 'changedump.xml'
+
+    @property
+    def tries(self):
+        """Get/set maximum number of tries for a download, see self.retry_policy."""
+        return(self.retry_policy.tries)
+
+    @tries.setter
+    def tries(self, tries):
+        self.retry_policy.tries = tries
 
     def set_mappings(self, mappings):
         """Build and set Mapper object based on input mappings."""
         self.mapper = Mapper(mappings, use_default_path=True)
+        self.mapper.uri_table = self.uri_table
 
     def sitemap_uri(self, basename):
         """Get full URI (filepath) for sitemap based on basename."""
@@ -93,22 +126,143 @@ class Client(object):
             return(self.sitemap_name)
         return(self.sitemap_uri(self.resource_list_name))
 
+    def read_list(self, list_obj, uri):
+        """Read list_obj (ResourceList, ChangeList etc.) from uri.
+
+        All reads of ResourceSync documents from the source go through
+        this method so that a subclass may change how they are fetched.
+        """
+        list_obj.read(uri=uri)
+
     def read_resource_list(self, uri):
         """Read resource list from specified URI else raise exception."""
         self.logger.info("Reading resource list %s" % (uri))
         try:
             resource_list = ResourceList(allow_multifile=self.allow_multifile,
                                          mapper=self.mapper)
-            resource_list.read(uri=uri)
+            resource_list.uri_table = self.uri_table
+            self.read_list(resource_list, uri)
         except Exception as e:
             raise ClientError("Can't read source resource list from %s (%s)" %
                               (uri, str(e)))
         self.logger.debug("Finished reading resource list")
         return(resource_list)
 
+    def read_change_list(self, uri, from_timestamp=None):
+        """Read change list from specified URI else raise ClientFatalError.
+
+        If from_timestamp is given then changes before that time, and any
+        component sitemaps of a Change List Index entirely before that
+        time, are skipped while reading. Since all the changes kept are
+        then to be acted on, they are also folded as they are read so
+        that only the last change for each resource is kept.
+        """
+        try:
+            self.logger.info("Reading change list %s" % (uri))
+            resources_class = list if from_timestamp is None else ChangeFolder
+            change_list = ChangeList(mapper=self.mapper, spec_version=self.spec_version,
+                                     from_timestamp=from_timestamp,
+                                     resources_class=resources_class)
+            change_list.uri_table = self.uri_table
+            self.read_list(change_list, uri)
+            self.logger.debug("Finished reading change list")
+        except Exception as e:
+            raise ClientFatalError(
+                "Can't read source change list from %s (%s)" %
+                (uri, str(e)))
+        return(change_list)
+
+    def read_change_list_archive(self, uri):
+        """Read change list archive from specified URI else raise ClientError."""
+        self.logger.info("Reading change list archive %s" % (uri))
+        try:
+            archive = ChangeListArchive()
+            self.read_list(archive, uri)
+        except Exception as e:
+            raise ClientError(
+                "Can't read source change list archive from %s (%s)" %
+                (uri, str(e)))
+        return(archive)
+
+    def add_archived_changes(self, change_list, from_timestamp, archive_uri=None):
+        """Add changes from archived change lists before those in change_list.
+
+        If change_list starts (md_from) after from_timestamp then the
+        changes in between are in archived change lists. Only those listed
+        in the change list archive at archive_uri (else any discovered)
+        that overlap the time from from_timestamp to the start of
+        change_list are read, self.archive_workers at a time. The changes
+        are folded together in time order with those in change_list using
+        ChangeFolder.fold_in(), so that only the last change for each
+        resource is kept as with prune_dupes() on all the changes. A warning
+        is logged if the archive does not cover all of the gap. Returns
+        the number of archived change lists read.
+        """
+        if (change_list.md_from is None):
+            return(0)
+        change_list_from = str_to_datetime(change_list.md_from)
+        if (from_timestamp >= change_list_from):
+            return(0)
+        if (archive_uri is None and self.discovered is None
+                and self.capability_list_uri is not None):
+            try:
+                self.discovered = self.discover_from_capability_list(self.capability_list_uri)
+            except ClientError as e:
+                self.logger.warning(str(e))
+        if (archive_uri is None):
+            archive_uri = (self.discovered or {}).get('changelist-archive')
+        if (archive_uri is None):
+            self.logger.warning(
+                "Change list starts at %s, after %s, and there is no change list archive; changes may be missed" %
+                (change_list.md_from, datetime_to_str(from_timestamp)))
+            return(0)
+        try:
+            archive = self.read_change_list_archive(archive_uri)
+        except ClientError as e:
+            raise ClientFatalError(str(e))
+        entries = archive.overlapping(from_timestamp, change_list_from)
+        covered_until = from_timestamp
+        for entry in entries:
+            if (archive.entry_from(entry) > covered_until):
+                break
+            covered_until = max(covered_until, archive.entry_until(entry))
+        if (covered_until < change_list_from):
+            self.logger.warning(
+                "Change list archive %s has no change list for %s, changes may be missed" %
+                (archive_uri, datetime_to_str(covered_until)))
+        self.logger.info("Reading %d of %d archived change lists" % (len(entries), len(archive)))
+        uris = [urljoin(archive_uri, entry.uri) for entry in entries]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.archive_workers)) as executor:
+            archived_lists = list(executor.map(
+                lambda uri: self.read_change_list(uri, from_timestamp=from_timestamp), uris))
+        folder = ChangeFolder()
+        for archived in archived_lists:
+            change_list.num_skipped += archived.num_skipped
+            change_list.num_sitemaps_skipped += archived.num_sitemaps_skipped
+            folder.fold_in(archived.resources)
+        folder.fold_in(change_list.resources)
+        change_list.resources = folder
+        return(len(entries))
+
     def find_resource_list_from_source_description(self, uri):
+        """Read source description to find resource list URI.
+
+        See discover_from_source_description().
+        """
+        return(self.discover_from_source_description(uri)['resourcelist'])
+
+    def find_resource_list_from_capability_list(self, uri):
+        """Read capability list to find resource list URI.
+
+        See discover_from_capability_list().
+        """
+        return(self.discover_from_capability_list(uri)['resourcelist'])
+
+    def discover_from_source_description(self, uri):
         """Read source description to find resource list.
 
+        Returns a dict as for discover_from_capability_list().
+
         Raises a ClientError in cases where the client might look for a
         source description in another location, but a ClientFatalError if
         a source description is found but there is some problem using it.
@@ -116,7 +270,7 @@ class Client(object):
         self.logger.info("Reading source description %s" % (uri))
         try:
             sd = SourceDescription()
-            sd.read(uri=uri)
+            self.read_list(sd, uri)
         except Exception as e:
             raise ClientError(
                 "Can't read source description from %s (%s)" %
@@ -131,11 +285,16 @@ class Client(object):
         self.logger.info("Finished reading source description")
         cluri = sd.resources.first().uri
         uri = urljoin(uri, cluri)  # FIXME - Should relative URI handling be elsewhere?
-        return(self.find_resource_list_from_capability_list(uri))
+        return(self.discover_from_capability_list(uri))
 
-    def find_resource_list_from_capability_list(self, uri):
+    def discover_from_capability_list(self, uri):
         """Read capability list to find resource list.
 
+        Returns a dict with the resource list URI in 'resourcelist', and
+        any change list, resource dump, change dump and change list archive
+        URIs in 'changelist', 'resourcedump', 'changedump' and
+        'changelist-archive'.
+
         Raises a ClientError in cases where the client might look for a
         capability list in another location, but a ClientFatalError if
         a capability list is found but there is some problem using it.
@@ -143,7 +302,7 @@ class Client(object):
         self.logger.info("Reading capability list %s" % (uri))
         try:
             cl = CapabilityList()
-            cl.read(uri=uri)
+            self.read_list(cl, uri)
         except Exception as e:
             raise ClientError(
                 "Can't read capability list from %s (%s)" %
@@ -151,8 +310,12 @@ class Client(object):
         if (not cl.has_capability('resourcelist')):
             raise ClientFatalError(
                 "Capability list %s does not describe a resource list" % (uri))
-        rluri = cl.capability_info('resourcelist').uri
-        return(urljoin(uri, rluri))
+        found = {'resourcelist': urljoin(uri, cl.capability_info('resourcelist').uri)}
+        for capability in ('changelist', 'resourcedump', 'changedump', 'changelist-archive'):
+            found[capability] = None
+            if (cl.has_capability(capability)):
+                found[capability] = urljoin(uri, cl.capability_info(capability).uri)
+        return(found)
 
     def find_resource_list(self):
         """Finf resource list by hueristics, returns ResourceList object.
@@ -168,38 +331,112 @@ class Client(object):
         5. Look for base_url/resourcelist.xml
         6. Look for base_url/sitemap.xml
         7. Look for host/sitemap.xml
+
+        The locations in 3 to 7 are probed at the same time, each in a
+        daemon thread, and the first in the order above that works is
+        used. Probes still running then are given up on: they cannot be
+        stopped, and finish or time out in the background without
+        holding up the exit of the program.
         """
         # 1 & 2
+        self.discovered = None
         if (self.sitemap_name is not None):
             return(self.read_resource_list(self.sitemap_name))
         if (self.capability_list_uri is not None):
-            rluri = self.find_resource_list_from_capability_list(self.capability_list_uri)
-            return(self.read_resource_list(rluri))
-        # 3 & 4
+            self.discovered = self.discover_from_capability_list(self.capability_list_uri)
+            return(self.read_resource_list(self.discovered['resourcelist']))
+        # Use any recently cached result of discovery for this source
+        cached = self.cached_discovery()
+        if (cached is not None):
+            try:
+                resource_list = self.read_resource_list(cached['resourcelist'])
+                self.discovered = cached
+                return(resource_list)
+            except ClientError as e:
+                self.logger.info("Cached resource list failed (%s), starting discovery" % (str(e)))
+        # 3 & 4, then 5, 6 & 7
         parts = urlsplit(self.sitemap)
         uri_host = urlunsplit([parts[0], parts[1], '', '', ''])
-        errors = []
+        candidates = []
         for uri in [urljoin(self.sitemap, '.well-known/resourcesync'),
                     urljoin(uri_host, '.well-known/resourcesync')]:
             uri = uri.lstrip('file:///')  # urljoin adds this for local files
-            try:
-                rluri = self.find_resource_list_from_source_description(uri)
-                return(self.read_resource_list(rluri))
-            except ClientError as e:
-                errors.append(str(e))
-        # 5, 6 & 7
+            candidates.append((self.discover_from_source_description, uri))
         for uri in [urljoin(self.sitemap, 'resourcelist.xml'),
                     urljoin(self.sitemap, 'sitemap.xml'),
                     urljoin(uri_host, 'sitemap.xml')]:
             uri = uri.lstrip('file:///')  # urljoin adds this for local files
+            candidates.append((self.discover_resource_list, uri))
+        errors = []
+        # Probes run concurrently but results are taken in priority order
+        futures = [self.start_probe(probe, uri) for (probe, uri) in candidates]
+        for future in futures:
             try:
-                return(self.read_resource_list(uri))
+                found = future.result()
+                resource_list = self.read_resource_list(found['resourcelist'])
             except ClientError as e:
                 errors.append(str(e))
+                continue
+            self.set_cached_discovery(found)
+            self.discovered = found
+            return(resource_list)
         raise ClientFatalError(
             "Failed to find source resource list from common patterns (%s)" %
             ". ".join(errors))
 
+    def start_probe(self, probe, uri):
+        """Start probe(uri) in a daemon thread, return a Future for its result.
+
+        A daemon thread is used so that a slow probe that is no longer
+        wanted does not stop the program exiting.
+        """
+        future = concurrent.futures.Future()
+
+        def run():
+            if (not future.set_running_or_notify_cancel()):
+                return
+            try:
+                future.set_result(probe(uri))
+            except BaseException as e:
+                future.set_exception(e)
+        threading.Thread(target=run, name='probe %s' % (uri), daemon=True).start()
+        return(future)
+
+    def discover_resource_list(self, uri):
+        """Check that a resource list may exist at uri without reading it.
+
+        Makes a HEAD request for web URIs (opens local files) and raises a
+        ClientError if that fails. Returns discovery dict as for
+        discover_from_capability_list().
+        """
+        try:
+            with url_or_file_open(uri, method='HEAD', timeout=self.timeout):
+                pass
+        except HTTPError as e:
+            # Some servers do not support HEAD, a GET will tell
+            if (e.code not in (405, 501)):
+                raise ClientError("Can't read source resource list from %s (%s)" %
+                                  (uri, str(e)))
+        except (IOError, ValueError) as e:
+            raise ClientError("Can't read source resource list from %s (%s)" %
+                              (uri, str(e)))
+        return({'resourcelist': uri, 'changelist': None})
+
+    def cached_discovery(self):
+        """Return dict of cached discovery results for self.sitemap, else None."""
+        if (not self.discovery_ttl):
+            return(None)
+        found = ClientState(self.status_file).get_discovery(
+            self.sitemap, max_age=self.discovery_ttl)
+        if (found is not None):
+            self.logger.info("Using cached discovery of resource list %s" % (found['resourcelist']))
+        return(found)
+
+    def set_cached_discovery(self, found):
+        """Cache discovery results in found for self.sitemap."""
+        if (self.discovery_ttl and not self.dryrun):
+            ClientState(self.status_file).set_discovery(self.sitemap, found)
+
     def build_resource_list(self, paths=None, set_path=False):
         """Return a resource list for files on local disk.
 
@@ -235,6 +472,10 @@ class Client(object):
         rl.mapper = self.mapper
         if (self.max_sitemap_entries is not None):
             rl.max_sitemap_entries = self.max_sitemap_entries
+        if (self.max_sitemap_bytes is not None):
+            rl.max_sitemap_bytes = self.max_sitemap_bytes
+        rl.gzip_components = self.gzip_sitemaps
+        rl.write_workers = self.sitemap_workers
         return(rl)
 
     def log_event(self, change):
@@ -250,6 +491,7 @@ class Client(object):
         """
         action = ('audit' if (audit_only) else 'baseline sync')
         self.logger.debug("Starting " + action)
+        self.uri_table.clear()
         # 0. Sanity checks
         if (len(self.mapper) < 1):
             raise ClientFatalError(
@@ -274,11 +516,25 @@ class Client(object):
         dst_resource_list = rlb.from_disk()
         # 2. Compare these resource lists respecting any comparison options
         (same, updated, deleted, created) = dst_resource_list.compare(src_resource_list)
+        # A checkpoint means that an earlier baseline sync was interrupted, the
+        # resources it copied are now the same so carry over its last timestamp
+        checkpoint = None
+        if (not audit_only):
+            checkpoint = ClientState(self.status_file).get_checkpoint(self.sitemap)
+        if (checkpoint is not None):
+            self.logger.warning(
+                "Resuming baseline sync interrupted after %s, %d resources had been copied" %
+                (datetime_to_str(checkpoint['time']), checkpoint['done']))
+        self.logger.debug("URI table: %(uris)d URIs, %(hits)d shared, %(bytes_saved)d bytes saved" %
+                          self.uri_table.stats())
         # 3. Report status and planned actions
         self.log_status(in_sync=(len(updated) + len(deleted) + len(created) == 0),
                         audit=True, same=len(same), created=len(created),
                         updated=len(updated), deleted=len(deleted))
         if (audit_only or len(created) + len(updated) + len(deleted) == 0):
+            if (checkpoint is not None):
+                self.last_timestamp = checkpoint['last_timestamp']
+                self.save_state()
             self.logger.debug("Completed " + action)
             return
         # 4. Check that sitemap has authority over URIs listed
@@ -296,45 +552,50 @@ class Client(object):
         self.logger.warning(
             "Will GET %d resources%s" %
             (len(created) + len(updated), delete_msg))
-        self.last_timestamp = 0
-        num_created = 0
-        num_updated = 0
-        num_deleted = 0
-        for resource in created:
-            uri = resource.uri
-            filename = self.mapper.src_to_dst(uri)
-            self.logger.info("created: %s -> %s" % (uri, filename))
-            num_created += self.update_resource(resource, filename, 'created')
-        for resource in updated:
-            uri = resource.uri
-            filename = self.mapper.src_to_dst(uri)
-            self.logger.info("updated: %s -> %s" % (uri, filename))
-            num_updated += self.update_resource(resource, filename, 'updated')
-        for resource in deleted:
-            uri = resource.uri
-            filename = self.mapper.src_to_dst(uri)
-            num_deleted += self.delete_resource(resource,
-                                                filename, allow_deletion)
+        self.last_timestamp = 0 if checkpoint is None else checkpoint['last_timestamp']
+        from_dumps = {'created': 0, 'updated': 0}
+        if (self.use_dumps):
+            wanted = collections.OrderedDict()
+            for resource in created:
+                wanted[resource.uri] = (resource, 'created')
+            for resource in updated:
+                wanted[resource.uri] = (resource, 'updated')
+            from_dumps = self.apply_dumps(
+                wanted, (self.discovered or {}).get('resourcedump'), ResourceDump)
+            created = [r for r in created if r.uri in wanted]
+            updated = [r for r in updated if r.uri in wanted]
+        changes = itertools.chain(((resource, 'created') for resource in created),
+                                  ((resource, 'updated') for resource in updated),
+                                  ((resource, 'deleted') for resource in deleted))
+
+        def baseline_checkpoint(num_done):
+            ClientState(self.status_file).set_checkpoint(
+                self.sitemap, {'done': num_done + (0 if checkpoint is None else checkpoint['done']),
+                               'last_timestamp': self.last_timestamp})
+        (num_created, num_updated, num_deleted) = self.apply_changes(
+            changes, allow_deletion=allow_deletion, checkpoint=baseline_checkpoint)
+        num_created += from_dumps['created']
+        num_updated += from_dumps['updated']
         # 6. Store last timestamp to allow incremental sync
-        if (not audit_only and self.last_timestamp > 0):
-            ClientState().set_state(self.sitemap, self.last_timestamp)
-            self.logger.info(
-                "Written last timestamp %s for incremental sync" %
-                (datetime_to_str(
-                    self.last_timestamp)))
+        self.save_state()
         # 7. Done
+        self.log_rate_limiter_stats()
         self.log_status(in_sync=(len(updated) + len(deleted) + len(created) == 0),
                         same=len(same), created=num_created,
                         updated=num_updated, deleted=num_deleted, to_delete=len(deleted))
         self.logger.debug("Completed %s" % (action))
 
     def incremental(self, allow_deletion=False,
-                    change_list_uri=None, from_datetime=None):
+                    change_list_uri=None, from_datetime=None,
+                    change_list_archive_uri=None):
         """Incremental synchronization.
 
-        Use Change List to do incremental sync
+        Use Change List to do incremental sync. If the Change List starts
+        after the time to sync from then earlier changes are read from the
+        archived Change Lists that cover the gap, see add_archived_changes().
         """
         self.logger.debug("Starting incremental sync")
+        self.uri_table.clear()
         # 0. Sanity checks
         if (len(self.mapper) < 1):
             raise ClientFatalError(
@@ -353,7 +614,7 @@ class Client(object):
                     from_datetime)
         # 1. Work out where to start from
         if (from_timestamp is None):
-            from_timestamp = ClientState().get_state(self.sitemap)
+            from_timestamp = ClientState(self.status_file).get_state(self.sitemap)
             if (from_timestamp is None):
                 raise ClientFatalError(
                     "Cannot do incremental sync. No stored timestamp for this site, and no explicit --from.")
@@ -362,18 +623,17 @@ class Client(object):
             # Translate as necessary using maps
             change_list = self.sitemap_uri(change_list_uri)
         else:
-            # Try default name
-            change_list = self.sitemap_uri(self.change_list_name)
+            # Use change list from cached discovery else try default name
+            cached = self.cached_discovery()
+            self.discovered = cached
+            if (cached is not None and cached.get('changelist')):
+                change_list = cached['changelist']
+            else:
+                change_list = self.sitemap_uri(self.change_list_name)
         # 3. Read change list from source
-        try:
-            self.logger.info("Reading change list %s" % (change_list))
-            src_change_list = ChangeList()
-            src_change_list.read(uri=change_list)
-            self.logger.debug("Finished reading change list")
-        except Exception as e:
-            raise ClientFatalError(
-                "Can't read source change list from %s (%s)" %
-                (change_list, str(e)))
+        src_change_list = self.read_change_list(change_list, from_timestamp=from_timestamp)
+        self.add_archived_changes(src_change_list, from_timestamp,
+                                  change_list_archive_uri)
         self.logger.info(
             "Read source change list, %d changes listed" %
             (len(src_change_list)))
@@ -407,7 +667,12 @@ class Client(object):
                             (change_list, resource.uri))
         # 5. Prune entries before starting timestamp and dupe changes for a
         # resource
-        num_skipped = src_change_list.prune_updates_before(from_timestamp, spec_version=self.spec_version)
+        num_skipped = src_change_list.num_skipped + \
+            src_change_list.prune_updates_before(from_timestamp, spec_version=self.spec_version)
+        if (src_change_list.num_sitemaps_skipped > 0):
+            self.logger.info(
+                "Skipped %d change list sitemaps before %s" %
+                (src_change_list.num_sitemaps_skipped, datetime_to_str(from_timestamp)))
         if (num_skipped > 0):
             self.logger.info(
                 "Skipped %d changes before %s" %
@@ -446,37 +711,202 @@ class Client(object):
         self.logger.warning(
             "Will apply %d changes%s" %
             (len(src_change_list), delete_msg))
-        num_updated = 0
-        num_deleted = 0
-        num_created = 0
-        for resource in src_change_list:
-            uri = resource.uri
-            filename = self.mapper.src_to_dst(uri)
-            if (resource.change == 'updated'):
-                self.logger.info("updated: %s -> %s" % (uri, filename))
-                self.update_resource(resource, filename, 'updated')
-                num_updated += 1
-            elif (resource.change == 'created'):
-                self.logger.info("created: %s -> %s" % (uri, filename))
-                self.update_resource(resource, filename, 'created')
-                num_created += 1
-            elif (resource.change == 'deleted'):
-                num_deleted += self.delete_resource(
-                    resource, filename, allow_deletion)
-            else:
-                raise ClientError("Unknown change type %s" % (resource.change))
+        from_dumps = {'created': 0, 'updated': 0}
+        wanted = None
+        if (self.use_dumps):
+            wanted = collections.OrderedDict()
+            for resource in src_change_list:
+                if (resource.change in ('created', 'updated')):
+                    wanted[resource.uri] = (resource, resource.change)
+            num_wanted = len(wanted)
+            from_dumps = self.apply_dumps(
+                wanted, (self.discovered or {}).get('changedump'), ChangeDump,
+                from_timestamp=from_timestamp)
+            if (len(wanted) == num_wanted):
+                wanted = None
+
+        def changes():
+            return((resource, resource.change) for resource in src_change_list
+                   if wanted is None or resource.change == 'deleted' or resource.uri in wanted)
+        # Once the first n changes are applied the next sync may start from
+        # the earliest time of the changes left
+        resume = ResumeTimes(changes, self.last_timestamp)
+
+        def incremental_checkpoint(num_done):
+            ClientState(self.status_file).set_state(self.sitemap, resume.resume_from(num_done))
+        (num_created, num_updated, num_deleted) = self.apply_changes(
+            resume, allow_deletion=allow_deletion, checkpoint=incremental_checkpoint)
+        num_created += from_dumps['created']
+        num_updated += from_dumps['updated']
         # 7. Report status and planned actions
         self.log_status(incremental=True, created=num_created, updated=num_updated,
                         deleted=num_deleted, to_delete=to_delete)
         # 8. Record last timestamp we have seen
+        self.save_state()
+        # 9. Done
+        self.log_rate_limiter_stats()
+        self.logger.debug("Completed incremental sync")
+
+    def apply_dumps(self, wanted, dump_uri, dump_class=ResourceDump, from_timestamp=None):
+        """Copy resources in wanted from the packages of a source dump.
+
+        wanted is an OrderedDict of (resource, change) for each URI to be
+        created or updated. The Resource Dump or Change Dump at dump_uri is
+        read and each content package listed is downloaded, checked against
+        its manifest and the wanted resources in it extracted. For a Change
+        Dump, packages with changes only before from_timestamp are skipped.
+        URIs copied are removed from wanted so that the remaining resources
+        can be fetched individually.
+
+        Returns a dict with the numbers 'created' and 'updated'.
+        """
+        num = {'created': 0, 'updated': 0}
+        if (dump_uri is None):
+            self.logger.warning("No %s found for source, will GET resources individually" %
+                                (dump_class().capability_name))
+            return(num)
+        self.logger.info("Reading %s %s" % (dump_class().capability_name, dump_uri))
+        try:
+            dump = dump_class()
+            self.read_list(dump, dump_uri)
+        except Exception as e:
+            self.logger.warning("Can't read dump from %s (%s), will GET resources individually" %
+                                (dump_uri, str(e)))
+            return(num)
+        reader = DumpReader(mapper=self.mapper, workers=self.dump_workers)
+        for package in dump:
+            if (len(wanted) == 0):
+                break
+            package_uri = urljoin(dump_uri, package.uri)
+            if (from_timestamp is not None and package.ts_until is not None
+                    and package.ts_until < from_timestamp):
+                self.logger.debug("Skipping dump package %s before %s" %
+                                  (package_uri, datetime_to_str(from_timestamp)))
+                continue
+            if (self.dryrun):
+                self.logger.info("dryrun: would GET dump package %s" % (package_uri))
+                continue
+            try:
+                extracted = self.extract_dump_package(
+                    reader, package_uri, dict((uri, w[0]) for (uri, w) in wanted.items()))
+            except (ClientError, DumpReaderError) as e:
+                self.logger.warning("Skipping dump package %s (%s)" % (package_uri, str(e)))
+                continue
+            for entry in extracted:
+                (resource, change) = wanted.pop(entry.uri)
+                self.record_update(resource, self.mapper.src_to_dst(resource.uri), change)
+                num[change] += 1
+        self.logger.warning("Copied %d resources from dump, %d left to GET" %
+                            (num['created'] + num['updated'], len(wanted)))
+        return(num)
+
+    def extract_dump_package(self, reader, uri, wanted):
+        """Extract resources in wanted from dump package at uri with DumpReader reader.
+
+        With self.dump_workers of 1 the package is extracted as it is read.
+        Otherwise it is downloaded to a temporary file first so that members
+        can be extracted in parallel. Returns list of resources extracted.
+        """
+        if (self.dump_workers <= 1):
+            self.logger.info("Reading dump package %s" % (uri))
+            self.retry_policy.wait_before_request(uri)
+            try:
+                with url_or_file_open(uri, timeout=self.timeout) as fh:
+                    extracted = reader.extract_stream(fh, wanted, name=uri)
+            except IOError as e:
+                self.retry_policy.record_failure(uri, e)
+                raise ClientError("Failed to GET %s -- %s" % (uri, str(e)))
+            self.retry_policy.record_success(uri)
+            return(extracted)
+        (fd, dumpfile) = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        try:
+            self.download_dump_package(uri, dumpfile)
+            return(reader.extract(dumpfile, wanted))
+        finally:
+            os.unlink(dumpfile)
+
+    def download_dump_package(self, uri, filename):
+        """Download dump package at uri to filename, raise ClientError on failure."""
+        self.logger.info("Downloading dump package %s" % (uri))
+        self.retry_policy.wait_before_request(uri)
+        try:
+            with url_or_file_open(uri, timeout=self.timeout) as fh_in:
+                with open(filename, 'wb') as fh_out:
+                    shutil.copyfileobj(fh_in, fh_out)
+        except IOError as e:
+            self.retry_policy.record_failure(uri, e)
+            raise ClientError("Failed to GET %s -- %s" % (uri, str(e)))
+        self.retry_policy.record_success(uri)
+
+    def apply_changes(self, changes, allow_deletion=False, checkpoint=None):
+        """Apply a sequence of changes from the source to the destination.
+
+        changes is an iterable of (resource, change) pairs where change is
+        one of 'created', 'updated' or 'deleted'. Resources are fetched or
+        deleted in turn. If checkpoint is given it is called as
+        checkpoint(n), at most every self.checkpoint_interval seconds, once
+        the first n changes have been applied, and also if applying the
+        changes is stopped by an exception.
+
+        Returns a tuple of the numbers of resources (created, updated, deleted).
+        """
+        num = {'created': 0, 'updated': 0, 'deleted': 0}
+        self.last_checkpoint = time.time()
+        num_done = 0
+        try:
+            for (resource, change) in changes:
+                num[change] += self.apply_change(resource, change, allow_deletion)
+                num_done += 1
+                self.maybe_checkpoint(checkpoint, num_done)
+        except BaseException:
+            self.maybe_checkpoint(checkpoint, num_done, force=True)
+            raise
+        return(num['created'], num['updated'], num['deleted'])
+
+    def maybe_checkpoint(self, checkpoint, num_done, force=False):
+        """Call checkpoint(num_done) if self.checkpoint_interval has passed.
+
+        The interval is from the start of apply_changes() or the last
+        checkpoint, with force set the checkpoint is made if any changes
+        have been applied. There are no checkpoints in dryrun mode.
+        """
+        if (checkpoint is None or self.checkpoint_interval is None or self.dryrun):
+            return
+        now = time.time()
+        if ((force and num_done > 0) or now - self.last_checkpoint >= self.checkpoint_interval):
+            checkpoint(num_done)
+            self.last_checkpoint = now
+
+    def save_state(self):
+        """Store self.last_timestamp as the time to sync from and remove any checkpoint.
+
+        Both are changed in one update of the status file. Nothing is
+        stored if there is no last timestamp.
+        """
+        state = ClientState(self.status_file)
+        if (self.last_timestamp <= 0 and state.get_checkpoint(self.sitemap) is None):
+            return
+        with state.update():
+            if (self.last_timestamp > 0):
+                state.set_state(self.sitemap, self.last_timestamp)
+            state.set_checkpoint(self.sitemap)
         if (self.last_timestamp > 0):
-            ClientState().set_state(self.sitemap, self.last_timestamp)
             self.logger.info(
                 "Written last timestamp %s for incremental sync" %
                 (datetime_to_str(
                     self.last_timestamp)))
-        # 9. Done
-        self.logger.debug("Completed incremental sync")
+
+    def apply_change(self, resource, change, allow_deletion=False):
+        """Apply one change, return the number of resources changed (0 or 1)."""
+        uri = resource.uri
+        filename = self.mapper.src_to_dst(uri)
+        if (change == 'created' or change == 'updated'):
+            self.logger.info("%s: %s -> %s" % (change, uri, filename))
+            return(self.update_resource(resource, filename, change))
+        elif (change == 'deleted'):
+            return(self.delete_resource(resource, filename, allow_deletion))
+        raise ClientError("Unknown change type %s" % (change))
 
     def update_resource(self, resource, filename, change=None):
         """Update resource from uri to filename on local system.
@@ -502,51 +932,61 @@ class Client(object):
                 "dryrun: would GET %s --> %s" %
                 (resource.uri, filename))
         else:
-            # 1. GET
-            for try_i in range(1, self.tries + 1):
+            # 1. GET, retrying according to self.retry_policy
+            policy = self.retry_policy
+            for try_i in range(1, policy.tries + 1):
+                policy.wait_before_request(resource.uri)
                 try:
                     with url_or_file_open(resource.uri, timeout=self.timeout) as fh_in:
                         with open(filename, 'wb') as fh_out:
                             shutil.copyfileobj(fh_in, fh_out)
+                    policy.record_success(resource.uri)
                     num_updated += 1
                     break
-                except socket.timeout as e:
-                    if try_i < self.tries:
-                        msg = 'Download timed out, retrying...'
-                        self.logger.info(msg)
-                        # Continue loop
+                except IOError as e:
+                    policy.record_failure(resource.uri, e)
+                    if (not policy.is_retryable(e)):
+                        msg = "Failed to GET %s -- %s" % (resource.uri, str(e))
+                    elif (try_i < policy.tries_for(e)):
+                        wait = policy.backoff(try_i, e)
+                        self.logger.info("Download failed (%s), retrying in %.1fs..." %
+                                         (str(e), wait))
+                        policy.sleep(wait)
+                        continue
                     else:
                         # No more tries left, so fail
-                        msg = "Failed to GET %s after %s tries -- %s" % (resource.uri, self.tries, str(e))
-                        if (self.ignore_failures):
-                            self.logger.warning(msg)
-                            return(num_updated)
-                        else:
-                            raise ClientFatalError(msg)
-                except IOError as e:
-                    msg = "Failed to GET %s -- %s" % (resource.uri, str(e))
+                        msg = "Failed to GET %s after %s tries -- %s" % (resource.uri, try_i, str(e))
                     if (self.ignore_failures):
                         self.logger.warning(msg)
                         return(num_updated)
                     else:
                         raise ClientFatalError(msg)
-            # 2. set timestamp if we have one
-            if (resource.timestamp is not None):
-                unixtime = int(resource.timestamp)  # no fractional
-                os.utime(filename, (unixtime, unixtime))
-                if (resource.timestamp > self.last_timestamp):
-                    self.last_timestamp = resource.timestamp
-            self.log_event(Resource(resource=resource, change=change))
-            # 3. sanity check
-            length = os.stat(filename).st_size
-            if (resource.length is not None and resource.length != length):
-                self.logger.info(
-                    "Downloaded size for %s of %d bytes does not match expected %d bytes" %
-                    (resource.uri, length, resource.length))
-            if (len(self.hashes) > 0):
-                self.check_hashes(filename, resource)
+            self.record_update(resource, filename, change)
         return(num_updated)
 
+    def record_update(self, resource, filename, change=None):
+        """Record a resource just downloaded to filename.
+
+        Sets the file mtime to the resource timestamp, updates
+        self.last_timestamp, logs the event and checks that the length
+        and any hashes match those expected.
+        """
+        # 2. set timestamp if we have one
+        if (resource.timestamp is not None):
+            unixtime = int(resource.timestamp)  # no fractional
+            os.utime(filename, (unixtime, unixtime))
+            if (resource.timestamp > self.last_timestamp):
+                self.last_timestamp = resource.timestamp
+        self.log_event(Resource(resource=resource, change=change))
+        # 3. sanity check
+        length = os.stat(filename).st_size
+        if (resource.length is not None and resource.length != length):
+            self.logger.info(
+                "Downloaded size for %s of %d bytes does not match expected %d bytes" %
+                (resource.uri, length, resource.length))
+        if (len(self.hashes) > 0):
+            self.check_hashes(filename, resource)
+
     def check_hashes(self, filename, resource):
         """Check all hashes present in self.hashes _and_ resource object.
 
@@ -628,7 +1068,7 @@ class Client(object):
         s = Sitemap()
         self.logger.info("Reading sitemap(s) from %s ..." % (self.sitemap))
         try:
-            list = s.parse_xml(url_or_file_open(self.sitemap))
+            list = s.parse_xml(url_or_file_open(self.sitemap, gunzip=True))
         except IOError as e:
             raise ClientFatalError("Cannot read document (%s)" % str(e))
         num_entries = len(list.resources)
@@ -671,7 +1111,8 @@ class Client(object):
             if (outfile is None):
                 outfile = self.default_resource_dump
             self.logger.info("Writing resource dump to %s..." % (dump))
-            d = Dump(resources=rl, format=self.dump_format)
+            d = Dump(resources=rl, format=self.dump_format,
+                     workers=self.dump_workers)
             d.write(basename=outfile)
         else:
             if (outfile is None):
@@ -692,6 +1133,10 @@ class Client(object):
         List is calculated between the reference an the current state of files on
         disk. The files on disk are scanned based either on the paths setting or
         else on the mappings.
+
+        If dump is true then a Change Dump is written instead of a Change List,
+        see write_dump_if_requested(). If outfile is not set then
+        self.default_change_dump will be used.
         """
         cl = ChangeList(ln=links)
         if (not empty):
@@ -715,11 +1160,16 @@ class Client(object):
         cl.pretty_xml = self.pretty_xml
         if (self.max_sitemap_entries is not None):
             cl.max_sitemap_entries = self.max_sitemap_entries
-        if (outfile is None):
+        if (self.max_sitemap_bytes is not None):
+            cl.max_sitemap_bytes = self.max_sitemap_bytes
+        cl.gzip_components = self.gzip_sitemaps
+        cl.write_workers = self.sitemap_workers
+        if (dump):
+            self.write_dump_if_requested(cl, outfile or self.default_change_dump)
+        elif (outfile is None):
             print(cl.as_xml())
         else:
             cl.write(basename=outfile)
-        self.write_dump_if_requested(cl, dump)
 
     def write_capability_list(self, capabilities=None,
                               outfile=None, links=None):
@@ -747,12 +1197,50 @@ class Client(object):
         else:
             rsd.write(basename=outfile)
 
-    def write_dump_if_requested(self, resource_list, dump):
-        """Write a dump to the file dump."""
-        if (dump is None):
-            return
-        print("OOPS - FIXME - Wrinting dump to %s not yet implemented" % (dump))
-        return(1)
+    def write_dump_if_requested(self, change_list, dump):
+        """Write a Change Dump for change_list to the file dump.
+
+        The content of created and updated resources, which must have path
+        set, is packaged in ZIP files with Change Dump Manifests, written
+        alongside dump with names from dump and a sequence number, using
+        self.dump_workers processes. The Change Dump document listing the
+        packages is then written to dump. Does nothing if dump is None.
+
+        Returns the number of packages written.
+        """
+        if (not dump):
+            return(0)
+        basename = re.sub(r'\.(xml|zip)$', '', dump) + '_'
+        d = Dump(resources=change_list, format=self.dump_format,
+                 workers=self.dump_workers)
+        d.manifest_class = ChangeDumpManifest
+        self.logger.info("Writing change dump packages to %s*..." % (basename))
+        try:
+            d.write(basename=basename)
+        except DumpError as e:
+            raise ClientFatalError("Failed to write change dump (%s)" % (str(e)))
+        cd = ChangeDump(ln=change_list.ln)
+        cd.pretty_xml = self.pretty_xml
+        for package in d.packages:
+            package.uri = self.dump_package_uri(package.path)
+            package.path = None
+            if (package.ln):
+                package.ln[0]['href'] = self.dump_package_uri(package.ln[0]['href'])
+            cd.add(package)
+        cd.write(basename=dump)
+        self.logger.info("Wrote change dump %s with %d packages" % (dump, len(d.packages)))
+        return(len(d.packages))
+
+    def dump_package_uri(self, filename):
+        """URI for dump package or manifest filename using the mappings.
+
+        Falls back to the filename relative to the Change Dump if it is not
+        within a mapped path.
+        """
+        try:
+            return(self.mapper.dst_to_src(filename))
+        except MapperError:
+            return(os.path.basename(filename))
 
     def read_reference_resource_list(self, ref_sitemap, name='reference'):
         """Read reference resource list and return the ResourceList object.
@@ -798,6 +1286,17 @@ class Client(object):
         self.logger.info("Not calculating %s hash(es) on destination as not present "
                          "in source %s list" % (', '.join(sorted(discarded)), list_type))
 
+    def log_rate_limiter_stats(self):
+        """Log per-host request and wait statistics from the rate limiter.
+
+        Useful to tune the --delay and --burst settings.
+        """
+        stats = RATE_LIMITER.stats()
+        for host in sorted(stats):
+            st = stats[host]
+            self.logger.info("Rate limit for %s: %d requests, %d waited total %.2fs (max %.2fs)" %
+                             (host, st['requests'], st['waits'], st['wait_time'], st['max_wait']))
+
     def log_status(self, in_sync=True, incremental=False, audit=False,
                    same=None, created=0, updated=0, deleted=0, to_delete=0):
         """Write log message regarding status in standard form.
@@ -830,3 +1329,70 @@ class Client(object):
         self.logger.warning("Status: %15s (%s%s=%d, %s=%d, %s=%d)" %
                             (status, same, words['created'], created,
                              words['updated'], updated, words['deleted'], deleted))
+
+
+class ResumeTimes(object):
+    """Changes to apply that keep track of the earliest time of those left.
+
+    changes is a callable that returns a new iterator over the same
+    (resource, change) pairs each time it is called. Iterating over a
+    ResumeTimes gives these pairs, and once the first n have been applied
+    resume_from(n) gives the earliest time of the changes not applied,
+    from which the next incremental sync may start. default, the time of
+    the latest change, is used when none are left.
+
+    Neither the changes nor their times are held. A first pass over the
+    changes records only those earlier than a change before them, which
+    are rare as Change Lists are usually in time order. Then the earliest
+    time of the changes left is the least of those recorded that are not
+    yet reached, the time of the change after the last one handed out,
+    and the times of changes handed out but not yet counted as applied.
+    """
+
+    def __init__(self, changes, default):
+        """Initialize ResumeTimes, making a first pass over changes()."""
+        self.changes = changes
+        self.default = default
+        self.late = collections.deque()     # (n, time) of changes earlier than one before
+        self.fetched = collections.deque()  # (n, time) of changes read but maybe not applied
+        self.num_fetched = 0
+        latest = None
+        for (n, (resource, change)) in enumerate(changes()):
+            ts = self.change_time(resource)
+            if (latest is not None and ts < latest):
+                self.late.append((n, ts))
+            else:
+                latest = ts
+
+    def change_time(self, resource):
+        """Time of change, datetime (1.1) if given else lastmod (1.0)."""
+        return(resource.ts_datetime if resource.ts_datetime is not None else resource.timestamp)
+
+    def __iter__(self):
+        """Iterator over the changes, each read one ahead of being handed out."""
+        it = iter(self.changes())
+        item = self.fetch(it)
+        while (item is not None):
+            following = self.fetch(it)
+            yield(item)
+            item = following
+
+    def fetch(self, it):
+        """Return next change from it, or None, recording its time."""
+        item = next(it, None)
+        if (item is not None):
+            self.fetched.append((self.num_fetched, self.change_time(item[0])))
+            self.num_fetched += 1
+        return(item)
+
+    def resume_from(self, num_done):
+        """Earliest time of the changes after the first num_done.
+
+        num_done must not be less than in any earlier call.
+        """
+        while (self.fetched and self.fetched[0][0] < num_done):
+            self.fetched.popleft()
+        while (self.late and self.late[0][0] < self.num_fetched):
+            self.late.popleft()
+        times = [ts for (n, ts) in itertools.chain(self.fetched, self.late)]
+        return(min(times) if times else self.default)
@@ -3,56 +3,173 @@
 The client requires memory of state to support incremental
 synchronization. At minimum it must store the source timestamp
 of the last change seen.
+
+State is kept in a small ConfigParser file. Each change is a
+read-modify-write made while holding an exclusive lock on a companion
+.lock file, and the new file is written to a temporary file that is
+then renamed over the old one. Several clients sharing a status file,
+in threads or separate processes, therefore never lose each other's
+updates and a crash never leaves a partly written file.
 """
 
+import contextlib
 import sys
+import os
 import os.path
 import datetime
 import distutils.dir_util
+import json
 import re
+import tempfile
+import threading
 import time
 import logging
 try:  # python3
     from configparser import ConfigParser, NoSectionError, NoOptionError
 except ImportError:  # pragma: no cover python2
     from ConfigParser import SafeConfigParser as ConfigParser, NoSectionError, NoOptionError  # pragma: no cover
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows, only threads are excluded
+    fcntl = None
+
+# Used only without fcntl, when threads of this process can be excluded
+# but other processes cannot
+THREAD_LOCK = threading.Lock()
 
 
 class ClientState(object):
     """Read and store client state on disk."""
 
-    def __init__(self):
+    def __init__(self, status_file=None):
         """Initialize ClientState object with default status file name."""
-        self.status_file = '.resync-client-status.cfg'
+        self.status_file = '.resync-client-status.cfg' if status_file is None else status_file
+        self.local = threading.local()  # parser being updated by each thread
 
-    def set_state(self, site, timestamp=None):
-        """Write status dict to client status file.
+    @property
+    def parser(self):
+        """ConfigParser being updated by update() in the current thread, else None.
 
-        FIXME - should have some file lock to avoid race
+        Kept per thread so that only nested calls in the thread that holds
+        the lock join its update, other threads using the same object wait
+        for the lock.
         """
-        parser = ConfigParser()
+        return(getattr(self.local, 'parser', None))
+
+    @parser.setter
+    def parser(self, parser):
+        self.local.parser = parser
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Context manager holding an exclusive lock on the status file.
+
+        The lock is taken with flock() on status_file + '.lock' so that the
+        status file itself may be replaced while it is held. Each call opens
+        the lock file again, so threads as well as processes are excluded.
+        The lock file is removed before the lock is released; a waiter that
+        then gets the lock on the removed file tries again. Locks should not
+        be nested for different ClientState objects as that would deadlock.
+        """
+        if (fcntl is None):  # pragma: no cover
+            with THREAD_LOCK:
+                yield
+            return
+        lock_file = self.status_file + '.lock'
+        while True:
+            fh = open(lock_file, 'a')
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                if (os.path.samestat(os.fstat(fh.fileno()), os.stat(lock_file))):
+                    break
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                fh.close()
+                raise
+            fh.close()
+        try:
+            yield
+        finally:
+            os.remove(lock_file)
+            fh.close()
+
+    @contextlib.contextmanager
+    def update(self):
+        """Context manager for a transactional update of the status file.
+
+        Yields the ConfigParser read from the status file while holding
+        the lock. Unless the block raises an exception, the parser is then
+        written back atomically. Calls to set_state(), set_discovery() and
+        set_checkpoint() within the block are part of the same update, so
+        several values may be changed together:
+
+            with state.update():
+                state.set_state(site, timestamp)
+                state.set_checkpoint(site)
+
+        A nested update() in the same thread joins the outer one, in
+        another thread it waits for the outer one to finish.
+        """
+        if (self.parser is not None):
+            yield self.parser
+            return
+        with self.lock():
+            self.parser = self.read()
+            try:
+                yield self.parser
+                self.write(self.parser)
+            finally:
+                self.parser = None
+
+    def read(self):
+        """Return ConfigParser with the current contents of the status file.
+
+        Within update() this is the parser being updated. Otherwise no lock
+        is needed because the file is only ever replaced whole.
+        """
+        if (self.parser is not None):
+            return(self.parser)
+        parser = ConfigParser(interpolation=None)
         parser.read(self.status_file)
-        status_section = 'incremental'
-        if (not parser.has_section(status_section)):
-            parser.add_section(status_section)
-        if (timestamp is None):
-            parser.remove_option(
-                status_section,
-                self.config_site_to_name(site))
-        else:
-            parser.set(
-                status_section,
-                self.config_site_to_name(site),
-                str(timestamp))
-        with open(self.status_file, 'w') as configfile:
-            parser.write(configfile)
-            configfile.close()
+        return(parser)
+
+    def write(self, parser):
+        """Write parser to the status file atomically.
+
+        Writes a temporary file in the same directory, syncs it to disk
+        and renames it over the status file.
+        """
+        dirname = os.path.dirname(self.status_file) or '.'
+        (fd, tmpname) = tempfile.mkstemp(dir=dirname, prefix='.tmp-',
+                                         suffix=os.path.basename(self.status_file))
+        try:
+            with os.fdopen(fd, 'w') as configfile:
+                parser.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            try:
+                mode = os.stat(self.status_file).st_mode & 0o777
+            except OSError:
+                mode = 0o644
+            os.chmod(tmpname, mode)
+            os.replace(tmpname, self.status_file)
+        except BaseException:
+            if (os.path.exists(tmpname)):
+                os.remove(tmpname)
+            raise
+
+    def set_state(self, site, timestamp=None):
+        """Write timestamp of the last change seen for site to the status file.
+
+        If timestamp is None then any stored timestamp is removed.
+        """
+        self.set_value('incremental', site, None if timestamp is None else str(timestamp))
 
     def get_state(self, site):
-        """Read client status file and return dict."""
-        parser = ConfigParser()
+        """Read client status file and return timestamp for site, or None."""
+        parser = self.read()
         status_section = 'incremental'
-        parser.read(self.status_file)
         timestamp = None
         try:
             timestamp = float(
@@ -65,6 +182,74 @@ class ClientState(object):
             pass
         return(timestamp)
 
+    def set_discovery(self, site, found=None):
+        """Write results of resource list discovery for site to status file.
+
+        found is a dict with at least the resource list URI in 'resourcelist',
+        it is stored with the current time. If found is None then any
+        stored results are removed.
+        """
+        self.set_json('discovery', site, found)
+
+    def get_discovery(self, site, max_age=None):
+        """Read results of resource list discovery for site from status file.
+
+        Returns the dict stored by set_discovery(), or None if there is
+        none or it is older than max_age seconds.
+        """
+        found = self.get_json('discovery', site)
+        if (found is None or (max_age is not None and time.time() - found.get('time', 0) > max_age)):
+            return(None)
+        return(found)
+
+    def set_checkpoint(self, site, checkpoint=None):
+        """Write checkpoint dict for a sync of site in progress to status file.
+
+        The checkpoint is stored with the current time and records enough
+        for a sync that is interrupted to be resumed, see
+        Client.baseline_or_audit(). If checkpoint is None then any stored
+        checkpoint is removed.
+        """
+        self.set_json('checkpoint', site, checkpoint)
+
+    def get_checkpoint(self, site):
+        """Read checkpoint for site from status file, or None if there is none."""
+        return(self.get_json('checkpoint', site))
+
+    def set_json(self, section, site, data=None):
+        """Write dict data for site as JSON with the current time in section."""
+        if (data is not None):
+            data = dict(data)
+            data['time'] = time.time()
+            data = json.dumps(data, sort_keys=True)
+        self.set_value(section, site, data)
+
+    def get_json(self, section, site):
+        """Read dict for site from JSON in section, or None if there is none."""
+        try:
+            return(json.loads(self.read().get(section, self.config_site_to_name(site))))
+        except (NoSectionError, NoOptionError, ValueError):
+            return(None)
+
+    def set_value(self, section, site, value=None):
+        """Set value for site in section of the status file, remove if value is None.
+
+        Nothing is locked or written to remove a value that is not there,
+        and a section is removed with its last value.
+        """
+        name = self.config_site_to_name(site)
+        if (value is None and not self.read().has_option(section, name)):
+            return
+        with self.update() as parser:
+            if (value is None):
+                parser.remove_option(section, name)
+                if (len(parser.options(section)) == 0):
+                    parser.remove_section(section)
+                return
+            if (not parser.has_section(section)):
+                parser.add_section(section)
+            parser.set(section, name, value)
+
     def config_site_to_name(self, name):
         """Convert site name to safe string for config.
 
@@ -190,7 +190,11 @@ def add_shared_misc_options(opt, default_logfile, include_remote=False):
         opt.add_argument('--access-token', type=str, default=None,
                          help="include this access token (a bearer token) in web requests")
         opt.add_argument('--delay', type=float, default=None,
-                         help="add a delay between web requests (default is None)")
+                         help="add a delay between web requests to the same host, applied as "
+                              "the average interval of a per-host rate limit (default is None)")
+        opt.add_argument('--burst', type=int, default=None,
+                         help="with --delay, allow up to this many back-to-back requests to a "
+                              "host after a quiet period (default is 1)")
     # Want these to show at the end
     opt.add_argument('--logger', '-l', action='store_true',
                      help="create detailed log of client actions (will write "
@@ -220,3 +224,7 @@ def process_shared_misc_options(args, include_remote=False):
             if args.delay < 0.0:
                 raise argparse.ArgumentTypeError("--delay must be non-negative!")
             set_url_or_file_open_config('delay', args.delay)
+        if args.burst:
+            if args.burst < 1:
+                raise argparse.ArgumentTypeError("--burst must be at least 1!")
+            set_url_or_file_open_config('burst', args.burst)
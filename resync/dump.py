@@ -1,9 +1,124 @@
-"""Dump handler for ResourceSync."""
+"""Dump handler for ResourceSync.
 
+Dump files are written as ZIP files (the ResourceSync format) or, for
+experimentation, as WARC/1.1 files. The WARC writer and reader here need
+no other library: payloads are copied in chunks with their digests
+computed as they are copied, each record may be gzipped separately so
+that it can be read from its offset, and a CDX index giving the offset
+of the record for each URI is written alongside:
+
+       wr = WarcReader(open('/tmp/rd_00000.warc.gz', 'rb'))
+       for entry in read_cdx('/tmp/rd_00000.cdx'):
+           if (entry['uri'] == uri):
+               data = wr.record_at(entry['offset']).read()
+"""
+
+import base64
+import collections
+import copy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import gzip
+import hashlib
+import io
+import itertools
 import logging
+import math
+import mimetypes
+import os
 import os.path
-from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import re
+import threading
+import time
+import uuid
+import zlib
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP64_LIMIT
+from resync import __version__
+from resync.resource import Resource
 from resync.resource_dump_manifest import ResourceDumpManifest
+from resync.w3c_datetime import datetime_to_str
+
+# Time used by the current thread if available (Python >= 3.7)
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+# Content types that are already compressed and are stored without
+# further compression, matched against the start of the MIME type
+COMPRESSED_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp',
+                    'image/jp2', 'audio/', 'video/', 'application/zip',
+                    'application/gzip', 'application/x-gzip',
+                    'application/x-bzip2', 'application/x-xz',
+                    'application/x-7z-compressed', 'application/x-rar',
+                    'application/vnd.openxmlformats-',
+                    'application/vnd.oasis.opendocument.',
+                    'application/epub+zip', 'font/woff')
+
+# Content types that always compress well and need not be sampled
+COMPRESSIBLE_TYPES = ('text/', 'application/xml', 'application/json',
+                      'application/javascript', 'application/ld+json',
+                      'image/svg+xml', 'image/bmp', 'image/tiff')
+
+WARC_VERSION = b'WARC/1.1'
+
+# Fields of CDX index written with WARC dumps, see
+# https://iipc.github.io/warc-specifications/specifications/cdx-format/cdx-2015/
+CDX_FIELDS = (('a', 'uri'), ('b', 'timestamp'), ('m', 'mime_type'),
+              ('k', 'digest'), ('S', 'length'), ('V', 'offset'),
+              ('g', 'filename'))
+
+
+def byte_entropy(data):
+    """Shannon entropy of bytes data in bits per byte, from 0.0 to 8.0."""
+    if (not data):
+        return(0.0)
+    n = float(len(data))
+    return(-sum((c / n) * math.log(c / n, 2)
+                for c in collections.Counter(data).values()))
+
+
+def deflate_file(path, level=zlib.Z_DEFAULT_COMPRESSION, chunk_size=1024 * 1024):
+    """Compress file at path to a raw deflate stream as used in ZIP files.
+
+    Returns (crc, size, data, cpu) where crc is the CRC-32 and size the
+    length of the uncompressed file, data is the compressed bytes and cpu
+    is the CPU time taken in seconds. This is a module level function so
+    that it can be run in a process pool.
+    """
+    t0 = thread_time()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    parts = []
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if (not chunk):
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return(crc, size, b''.join(parts), thread_time() - t0)
+
+
+def raw_members_supported(zf):
+    """True if members compressed elsewhere can be added to ZipFile zf.
+
+    ZipFile has no public way to add data that is already deflated, so
+    Dump.write_deflated_member() writes the local file header and data
+    itself and updates the ZipFile internals (fp, filelist, NameToInfo,
+    start_dir) as ZipFile.write() does. Check that these exist and that
+    zf is open for writing with no member being written, so that a
+    different ZipFile implementation falls back to ZipFile.write().
+    """
+    if (not callable(getattr(ZipInfo, 'FileHeader', None))):
+        return(False)
+    if (getattr(zf, 'mode', None) != 'w' or getattr(zf, '_writing', False)):
+        return(False)
+    if (not isinstance(getattr(zf, 'filelist', None), list)
+            or not isinstance(getattr(zf, 'NameToInfo', None), dict)
+            or not isinstance(getattr(zf, 'start_dir', None), int)):
+        return(False)
+    fp = getattr(zf, 'fp', None)
+    return(fp is not None and hasattr(fp, 'tell') and hasattr(fp, 'write'))
 
 
 class Dump(object):
@@ -19,49 +134,169 @@ class Dump(object):
        d = Dump(resources=rl)
        d.write(basename="/tmp/rd_")
        # will create dump files /tmp/rd_00000.zip etc.
+
+    For a Change Dump, the resources are the entries of a ChangeList and
+    manifest_class is set to ChangeDumpManifest. Deleted resources are
+    listed in the manifests but have no content.
+
+    After write(), packages has a Resource describing each dump file, for
+    use in a Resource Dump or Change Dump.
+
+    With workers greater than 1, files are compressed in a pool of that
+    many processes and the separate dump files are written concurrently.
+    The ZIP files written are standard, members are deflated in the same
+    way as by ZipFile.
+
+    WARC dump files have one resource record for each file, gzipped
+    separately when compress is set, and a CDX index dumpbase.cdx unless
+    write_cdx is unset.
+
+    When compress is set, files that are already compressed are stored in
+    ZIP files without further compression. These are recognized from the
+    MIME type, or else from a sample of the start of the file with entropy
+    above entropy_threshold bits/byte. Results for each type are collected
+    in compression_stats and logged by compression_report().
     """
 
-    def __init__(self, resources=None, format=None, compress=True):
+    def __init__(self, resources=None, format=None, compress=True, workers=1):
         """Initialize Dump object and set defaults."""
         self.resources = resources
         self.format = ('zip' if (format is None) else format)
         self.compress = compress
+        self.workers = workers
+        self.parallel_min_size = 64 * 1024  # smaller files compressed in-process
+        self.pool = None
+        self.stat_workers = 8
+        self.stat_batch_size = 1000
+        self.total_size = 0
+        self.store_incompressible = True
+        self.entropy_sample_size = 16 * 1024
+        self.entropy_threshold = 7.5
+        self.compression_stats = {}
+        self._stats_lock = threading.Lock()
         self.manifest_class = ResourceDumpManifest  # FIXME
         self.max_size = 100 * 1024 * 1024  # 100MB
         self.max_files = 50000
         self.path_prefix = None
+        self.write_cdx = True
+        self.packages = []
         self.logger = logging.getLogger('resync.dump')
 
     def write(self, basename=None, write_separate_manifests=True):
         """Write one or more dump files to complete this dump.
 
+        Makes one pass through self.resources, checking files as in
+        check_files(), partitioning and writing each dump file as soon as
+        its resources are known, so memory use does not depend on the total
+        number of resources. Unless self.path_prefix is set, paths in each
+        dump file are relative to the longest common path of its files.
+
         Returns the number of dump/archive files written.
         """
-        self.check_files()
+        self.compression_stats = {}
+        self.packages = []
+        if (self.format not in ('zip', 'warc')):
+            raise DumpError(
+                "Unknown dump format requested (%s)" %
+                (self.format))
         n = 0
-        for manifest in self.partition_dumps():
-            dumpbase = "%s%05d" % (basename, n)
-            dumpfile = "%s.%s" % (dumpbase, self.format)
-            if (write_separate_manifests):
-                manifest.write(basename=dumpbase + '.xml')
-            if (self.format == 'zip'):
-                self.write_zip(manifest.resources, dumpfile)
-            elif (self.format == 'warc'):
-                self.write_warc(manifest.resources, dumpfile)
-            else:
-                raise DumpError(
-                    "Unknown dump format requested (%s)" %
-                    (self.format))
-            n += 1
+        parts = self.partition_dumps(self.stat_resources())
+        if (self.workers <= 1):
+            for manifest in parts:
+                self.packages.append(self.write_part(
+                    manifest, "%s%05d" % (basename, n), write_separate_manifests))
+                n += 1
+        else:
+            # Compress in a shared process pool and write up to self.workers
+            # dump files at a time, each from its own thread
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as threads:
+                    pending = collections.deque()
+                    for manifest in parts:
+                        if (len(pending) >= self.workers):
+                            self.packages.append(pending.popleft().result())
+                        pending.append(threads.submit(
+                            self.write_part, manifest, "%s%05d" % (basename, n),
+                            write_separate_manifests))
+                        n += 1
+                    while (pending):
+                        self.packages.append(pending.popleft().result())
+            finally:
+                self.pool.shutdown()
+                self.pool = None
         self.logger.info("Wrote %d dump files" % (n))
+        for line in self.compression_report():
+            self.logger.info(line)
         return(n)
 
-    def write_zip(self, resources=None, dumpfile=None):
+    def write_part(self, manifest, dumpbase, write_separate_manifest=True):
+        """Write one dump file dumpbase.format with the resources in manifest.
+
+        If write_separate_manifest is set then the manifest, with paths as
+        in the dump file, is also written to dumpbase.xml.
+
+        Returns a Resource describing the dump file, with the path, length,
+        type, the range of change times of the resources and any link to
+        the separate manifest.
+        """
+        dumpfile = "%s.%s" % (dumpbase, self.format)
+        path_prefix = self.path_prefix
+        if (path_prefix is None):
+            path_prefix = self.common_path_prefix(manifest)
+        if (self.format == 'zip'):
+            archive_manifest = self.write_zip(manifest.resources, dumpfile,
+                                              path_prefix=path_prefix)
+        else:
+            if (self.compress):
+                dumpfile += '.gz'
+            archive_manifest = self.write_warc(
+                manifest.resources, dumpfile, path_prefix=path_prefix,
+                cdxfile=(dumpbase + '.cdx' if self.write_cdx else None))
+        package = Resource(uri=dumpfile, path=dumpfile,
+                           length=os.path.getsize(dumpfile),
+                           mime_type=('application/zip' if self.format == 'zip'
+                                      else 'application/warc'))
+        times = [t for t in (r.ts_datetime if r.ts_datetime is not None else r.timestamp
+                             for r in archive_manifest) if t is not None]
+        if (times):
+            package.ts_from = min(times)
+            package.ts_until = max(times)
+        if (write_separate_manifest):
+            archive_manifest.write(basename=dumpbase + '.xml')
+            package.ln = [{'rel': 'contents', 'href': dumpbase + '.xml',
+                           'type': 'application/xml'}]
+        return(package)
+
+    def archive_manifest(self, resources, path_prefix=None):
+        """Return (manifest, members) for the files of resources in a dump file.
+
+        The manifest has copies of the resources with paths in the dump
+        file. members is a list of (copy, real path) for each resource.
+        The resources themselves are not changed.
+        """
+        manifest = self.manifest_class()
+        members = []
+        for resource in resources:
+            entry = copy.copy(resource)
+            if (resource.change == 'deleted'):
+                entry.path = None
+            else:
+                entry.path = self.archive_path(resource.path, path_prefix)
+                members.append((entry, resource.path))
+            manifest.add(entry)
+        return(manifest, members)
+
+    def write_zip(self, resources=None, dumpfile=None, path_prefix=None):
         """Write a ZIP format dump file.
 
         Writes a ZIP file containing the resources in the iterable resources along with
         a manifest file manifest.xml (written first). No checks on the size of files
         or total size are performed, this is expected to have been done beforehand.
+        Paths in the ZIP file are relative to path_prefix if given, else to
+        self.path_prefix.
+
+        Returns the manifest written.
         """
         compression = (ZIP_DEFLATED if self.compress else ZIP_STORED)
         zf = ZipFile(
@@ -69,52 +304,209 @@ class Dump(object):
             mode="w",
             compression=compression,
             allowZip64=True)
-        # Write resources first
-        rdm = ResourceDumpManifest(resources=resources)
-        real_path = {}
-        for resource in resources:
-            archive_path = self.archive_path(resource.path)
-            real_path[archive_path] = resource.path
-            resource.path = archive_path
+        # Write manifest first
+        (rdm, members) = self.archive_manifest(resources, path_prefix)
         zf.writestr('manifest.xml', rdm.as_xml())
         # Add all files in the resources
-        for resource in resources:
-            zf.write(real_path[resource.path], arcname=resource.path)
+        parallel = (compression == ZIP_DEFLATED and (self.pool is not None or self.workers > 1))
+        if (parallel and not raw_members_supported(zf)):
+            self.logger.info("Cannot add deflated data to ZIP file with this Python, compressing in-process")
+            parallel = False
+        if (parallel):
+            self.write_zip_members_parallel(zf, members)
+        else:
+            for (resource, path) in members:
+                compress_type = self.compression_for(resource, path)
+                t0 = thread_time()
+                zf.write(path, arcname=resource.path, compress_type=compress_type)
+                self.record_compression(resource, path, zf.filelist[-1],
+                                        thread_time() - t0)
         zf.close()
         zipsize = os.path.getsize(dumpfile)
         self.logger.info(
             "Wrote ZIP file dump %s with size %d bytes" %
             (dumpfile, zipsize))
+        return(rdm)
+
+    def write_zip_members_parallel(self, zf, members):
+        """Compress files in a process pool and add them to ZipFile zf.
+
+        members is a list of (resource, real path) where resource.path is
+        the path in the ZIP file.
+
+        Members are written in order as their compressed data becomes
+        available, with at most 2 * self.workers files held in memory.
+        Uses self.pool if set, else a pool for just this ZIP file.
+        """
+        pool = self.pool
+        own_pool = (pool is None)
+        if (own_pool):
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            window = collections.deque()
+            for (resource, path) in members:
+                future = None
+                if (self.compression_for(resource, path) == ZIP_STORED):
+                    future = ZIP_STORED
+                elif (os.path.getsize(path) >= self.parallel_min_size):
+                    future = pool.submit(deflate_file, path)
+                window.append((resource, path, future))
+                if (len(window) >= 2 * self.workers):
+                    self.write_deflated_member(zf, *window.popleft())
+            while (window):
+                self.write_deflated_member(zf, *window.popleft())
+        finally:
+            if (own_pool):
+                pool.shutdown()
+
+    def write_deflated_member(self, zf, resource, path, future=None):
+        """Add file at path to ZipFile zf as resource.path, already deflated.
 
-    def write_warc(self, resources=None, dumpfile=None):
+        The compressed data is taken from future if given, else the file is
+        compressed now. The local file header is written with the CRC and
+        sizes known so no data descriptor is needed. If future is ZIP_STORED
+        then the file is instead added without compression. If
+        raw_members_supported(zf) is False then the file is compressed again
+        by ZipFile.write() and any data from future is discarded.
+        """
+        if (future == ZIP_STORED):
+            zf.write(path, arcname=resource.path, compress_type=ZIP_STORED)
+            self.record_compression(resource, path, zf.filelist[-1], 0.0)
+            return
+        if (not raw_members_supported(zf)):
+            if (future is not None):
+                future.cancel()
+            t0 = thread_time()
+            zf.write(path, arcname=resource.path, compress_type=ZIP_DEFLATED)
+            self.record_compression(resource, path, zf.filelist[-1],
+                                    thread_time() - t0)
+            return
+        (crc, size, data, cpu) = (future.result() if future is not None else deflate_file(path))
+        st = os.stat(path)
+        zinfo = ZipInfo(resource.path, time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.CRC = crc
+        zinfo.file_size = size
+        zinfo.compress_size = len(data)
+        zinfo.header_offset = zf.fp.tell()
+        zip64 = (size > ZIP64_LIMIT or len(data) > ZIP64_LIMIT)
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.write(data)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+        self.record_compression(resource, path, zinfo, cpu)
+
+    def content_type(self, resource, path):
+        """MIME type of resource, guessed from path if not set."""
+        if (resource.mime_type):
+            return(resource.mime_type.split(';')[0].strip().lower())
+        return(mimetypes.guess_type(path)[0] or 'application/octet-stream')
+
+    def compression_for(self, resource, path):
+        """Return ZIP_STORED or ZIP_DEFLATED as the compression for file path.
+
+        Already compressed content is stored if self.store_incompressible
+        is set, everything is stored if self.compress is not set.
+        """
+        if (not self.compress):
+            return(ZIP_STORED)
+        if (not self.store_incompressible):
+            return(ZIP_DEFLATED)
+        content_type = self.content_type(resource, path)
+        if (content_type.startswith(COMPRESSED_TYPES)):
+            return(ZIP_STORED)
+        if (content_type.startswith(COMPRESSIBLE_TYPES)):
+            return(ZIP_DEFLATED)
+        with open(path, 'rb') as fh:
+            sample = fh.read(self.entropy_sample_size)
+        if (byte_entropy(sample) > self.entropy_threshold):
+            return(ZIP_STORED)
+        return(ZIP_DEFLATED)
+
+    def record_compression(self, resource, path, zinfo, cpu):
+        """Add result of writing ZIP member zinfo to self.compression_stats."""
+        content_type = self.content_type(resource, path)
+        with self._stats_lock:
+            stats = self.compression_stats.setdefault(
+                content_type, {'files': 0, 'stored': 0, 'bytes_in': 0,
+                               'bytes_out': 0, 'bytes_stored': 0, 'cpu': 0.0})
+            stats['files'] += 1
+            stats['bytes_in'] += zinfo.file_size
+            stats['bytes_out'] += zinfo.compress_size
+            if (zinfo.compress_type == ZIP_STORED):
+                stats['stored'] += 1
+                stats['bytes_stored'] += zinfo.file_size
+            else:
+                stats['cpu'] += cpu
+
+    def compression_report(self):
+        """Return list of lines reporting compression by content type.
+
+        The CPU time saved by storing content is estimated from the rate
+        at which the deflated content was compressed.
+        """
+        lines = []
+        deflated_bytes = 0
+        stored_bytes = 0
+        cpu = 0.0
+        for content_type in sorted(self.compression_stats):
+            stats = self.compression_stats[content_type]
+            ratio = (stats['bytes_out'] / float(stats['bytes_in'])
+                     if stats['bytes_in'] else 1.0)
+            lines.append("Compression %s: %d files (%d stored), %d -> %d bytes, "
+                         "ratio %.3f, %.3fs CPU" %
+                         (content_type, stats['files'], stats['stored'],
+                          stats['bytes_in'], stats['bytes_out'], ratio,
+                          stats['cpu']))
+            stored_bytes += stats['bytes_stored']
+            deflated_bytes += stats['bytes_in'] - stats['bytes_stored']
+            cpu += stats['cpu']
+        if (stored_bytes > 0 and deflated_bytes > 0):
+            lines.append("Estimated %.3fs CPU saved by storing %d bytes of "
+                         "compressed content" %
+                         (cpu * stored_bytes / deflated_bytes, stored_bytes))
+        return(lines)
+
+    def write_warc(self, resources=None, dumpfile=None, path_prefix=None, cdxfile=None):
         """Write a WARC dump file.
 
         WARC support is not part of ResourceSync v1.0 (Z39.99 2014) but is left
         in this library for experimentation.
+
+        Writes a warcinfo record followed by a resource record for each
+        resource except deletions, each gzipped separately if self.compress
+        is set. If cdxfile is given then a CDX index of the records, sorted
+        by URI, is written to it.
+
+        Returns the manifest of the resources with paths relative to
+        path_prefix, as for a ZIP file.
         """
-        # Load library late as we want to be able to run rest of code
-        # without this installed
-        try:
-            from warc import WARCFile, WARCHeader, WARCRecord
-        except ImportError:
-            raise DumpError("Failed to load WARC library")
-        wf = WARCFile(dumpfile, mode="w", compress=self.compress)
-        # Add all files in the resources
-        for resource in resources:
-            wh = WARCHeader({})
-            wh.url = resource.uri
-            wh.ip_address = None
-            wh.date = resource.lastmod
-            wh.content_type = 'text/plain'
-            wh.result_code = 200
-            wh.checksum = 'aabbcc'
-            wh.location = self.archive_path(resource.path)
-            wf.write_record(WARCRecord(header=wh, payload=resource.path))
-        wf.close()
+        (manifest, members) = self.archive_manifest(resources, path_prefix)
+        index = []
+        with open(dumpfile, 'wb') as fh:
+            ww = WarcWriter(fh, compress=self.compress)
+            ww.write_warcinfo(os.path.basename(dumpfile))
+            for (resource, path) in members:
+                content_type = self.content_type(resource, path)
+                date = resource.lastmod or datetime_to_str()
+                (offset, size, digest) = ww.write_resource(
+                    resource.uri, path, date=date, content_type=content_type,
+                    sha1=resource.sha1)
+                index.append((resource.uri, re.sub(r'[^0-9]', '', date)[0:14],
+                              content_type, digest.split(':', 1)[1], str(size),
+                              str(offset), os.path.basename(dumpfile)))
+        if (cdxfile is not None):
+            with open(cdxfile, 'w') as fh:
+                fh.write(' CDX %s\n' % (' '.join(f[0] for f in CDX_FIELDS)))
+                for entry in sorted(index):
+                    fh.write(' '.join(entry) + '\n')
         warcsize = os.path.getsize(dumpfile)
-        self.logging.info(
+        self.logger.info(
             "Wrote WARC file dump %s with size %d bytes" %
             (dumpfile, warcsize))
+        return(manifest)
 
     def check_files(self, set_length=True, check_length=True):
         """Check all files in self.resources, find longest common prefix.
@@ -128,52 +520,99 @@ class Dump(object):
         length specified should be checked. By default both are True. In any event, the
         total size calculated is the size of files on disk.
         """
-        total_size = 0  # total size of all files in bytes
-        path_prefix = None
-        for resource in self.resources:
-            if (resource.path is None):
-                # explicit test because exception raised by getsize otherwise
-                # confusing
-                raise DumpError(
-                    "No file path defined for resource %s" %
-                    resource.uri)
-            if (path_prefix is None):
-                path_prefix = os.path.dirname(resource.path)
-            else:
-                path_prefix = os.path.commonprefix(
-                    [path_prefix, os.path.dirname(resource.path)])
-            size = os.path.getsize(resource.path)
-            if (resource.length is not None):
-                if (check_length and resource.length != size):
-                    raise DumpError("Size of resource %s is %d on disk, not %d as specified" %
-                                    (resource.uri, size, resource.length))
-            elif (set_length):
-                resource.length = size
-            if (size > self.max_size):
-                raise DumpError(
-                    "Size of file (%s, %d) exceeds maximum (%d) dump size" %
-                    (resource.path, size, self.max_size))
-            total_size += size
-        self.path_prefix = path_prefix
-        self.total_size = total_size
+        resources = self.stat_resources(set_length=set_length, check_length=check_length)
+        self.path_prefix = self.common_path_prefix(resources)
+        return True
+
+    def stat_resources(self, resources=None, set_length=True, check_length=True):
+        """Yield each resource in resources after checking its file.
+
+        Checks are as described for check_files(), resources defaults to
+        self.resources and the total size is accumulated in self.total_size.
+        Files are stat'ed by self.stat_workers threads in batches of
+        self.stat_batch_size, the next batch while the current one is
+        yielded, so memory use does not depend on the number of resources.
+        """
+        if (resources is None):
+            resources = self.resources
+        resources = iter(resources)
+        self.total_size = 0
+        with ThreadPoolExecutor(max_workers=self.stat_workers) as executor:
+            batch = list(itertools.islice(resources, self.stat_batch_size))
+            sizes = executor.map(self.file_size, batch)
+            while (batch):
+                next_batch = list(itertools.islice(resources, self.stat_batch_size))
+                next_sizes = executor.map(self.file_size, next_batch)
+                for (resource, size) in zip(batch, sizes):
+                    self.check_file(resource, size, set_length, check_length)
+                    self.total_size += size
+                    yield(resource)
+                (batch, sizes) = (next_batch, next_sizes)
         self.logger.info(
             "Total size of files to include in dump %d bytes" %
-            (total_size))
-        return True
+            (self.total_size))
+
+    def file_size(self, resource):
+        """Size of file for resource, None if no path set, 0 if deleted."""
+        if (resource.change == 'deleted'):
+            return(0)
+        if (resource.path is None):
+            return(None)
+        return(os.path.getsize(resource.path))
+
+    def check_file(self, resource, size, set_length=True, check_length=True):
+        """Check size of file for resource, see check_files()."""
+        if (resource.change == 'deleted'):
+            return
+        if (resource.path is None):
+            # explicit test because exception raised by getsize otherwise
+            # confusing
+            raise DumpError(
+                "No file path defined for resource %s" %
+                resource.uri)
+        if (resource.length is not None):
+            if (check_length and resource.length != size):
+                raise DumpError("Size of resource %s is %d on disk, not %d as specified" %
+                                (resource.uri, size, resource.length))
+        elif (set_length):
+            resource.length = size
+        if (size > self.max_size):
+            raise DumpError(
+                "Size of file (%s, %d) exceeds maximum (%d) dump size" %
+                (resource.path, size, self.max_size))
+
+    def common_path_prefix(self, resources):
+        """Longest common directory path of the files for resources, None if none."""
+        path_prefix = None
+        for resource in resources:
+            if (resource.change == 'deleted'):
+                continue
+            dirname = os.path.dirname(resource.path)
+            if (path_prefix is None):
+                path_prefix = dirname
+            elif (path_prefix != dirname):
+                try:
+                    path_prefix = os.path.commonpath([path_prefix, dirname])
+                except ValueError:
+                    # mix of absolute and relative paths
+                    path_prefix = ''
+        return(path_prefix)
 
-    def partition_dumps(self):
+    def partition_dumps(self, resources=None):
         """Yeild a set of manifest object that parition the dumps.
 
         Simply adds resources/files to a manifest until their are either the
         the correct number of files or the size limit is exceeded, then yields
-        that manifest.
+        that manifest. Uses self.resources unless resources is given.
         """
+        if (resources is None):
+            resources = self.resources
         manifest = self.manifest_class()
         manifest_size = 0
         manifest_files = 0
-        for resource in self.resources:
+        for resource in resources:
             manifest.add(resource)
-            manifest_size += resource.length
+            manifest_size += (resource.length or 0)
             manifest_files += 1
             if (manifest_size >= self.max_size or manifest_files >= self.max_files):
                 yield(manifest)
@@ -184,16 +623,309 @@ class Dump(object):
         if (manifest_files > 0):
             yield(manifest)
 
-    def archive_path(self, real_path):
+    def archive_path(self, real_path, path_prefix=None):
         """Return the archive path for file with real_path.
 
-        Mapping is based on removal of self.path_prefix which is determined
-        by self.check_files().
+        Mapping is based on removal of path_prefix if given, else
+        self.path_prefix which is determined by self.check_files().
         """
-        if (not self.path_prefix):
+        if (path_prefix is None):
+            path_prefix = self.path_prefix
+        if (not path_prefix):
             return(real_path)
         else:
-            return(os.path.relpath(real_path, self.path_prefix))
+            return(os.path.relpath(real_path, path_prefix))
+
+
+class WarcWriter(object):
+    """Write WARC/1.1 records to the file-like object fh.
+
+    If compress is set then each record is written as a separate gzip
+    member, so that it can be read starting from its offset. Payloads are
+    copied in chunks of chunk_size bytes and digested as they are copied.
+    """
+
+    def __init__(self, fh, compress=True, chunk_size=1024 * 1024):
+        """Initialize WarcWriter writing to fh."""
+        self.fh = fh
+        self.compress = compress
+        self.chunk_size = chunk_size
+
+    def write_warcinfo(self, filename):
+        """Write a warcinfo record describing this file."""
+        fields = ('software: resync/%s\r\nformat: WARC File Format 1.1\r\n' %
+                  (__version__)).encode('utf-8')
+        headers = [('WARC-Type', 'warcinfo'),
+                   ('WARC-Record-ID', '<%s>' % (uuid.uuid4().urn)),
+                   ('WARC-Date', datetime_to_str(no_fractions=True)),
+                   ('WARC-Filename', filename),
+                   ('Content-Type', 'application/warc-fields')]
+        return(self.write_record(headers, io.BytesIO(fields), len(fields),
+                                 warc_digest('sha1', hashlib.sha1(fields).digest())))
+
+    def write_resource(self, uri, path, date=None, content_type=None, sha1=None):
+        """Write a resource record for uri with content from the file path.
+
+        sha1 is the hex SHA-1 digest of the file if known. Returns
+        (offset, size, digest) as for write_record().
+        """
+        headers = [('WARC-Type', 'resource'),
+                   ('WARC-Record-ID', '<%s>' % (uuid.uuid4().urn)),
+                   ('WARC-Target-URI', uri),
+                   ('WARC-Date', date or datetime_to_str()),
+                   ('Content-Type', content_type or 'application/octet-stream')]
+        digest = None
+        if (sha1 is not None):
+            digest = warc_digest('sha1', bytes.fromhex(sha1))
+        elif (self.compress):
+            # Digest must be in the header, which is compressed with the
+            # payload, so read the file once for it first
+            digest = file_digest(path, self.chunk_size)
+        with open(path, 'rb') as fh:
+            return(self.write_record(headers, fh, os.fstat(fh.fileno()).st_size, digest))
+
+    def write_record(self, headers, payload, length, digest=None):
+        """Write a record with headers and length bytes read from payload.
+
+        headers is a list of (name, value) and must not include
+        Content-Length or WARC-Block-Digest, which are added. If digest
+        (as "sha1:BASE32") is not given then it is computed as the payload
+        is written and patched into the header, which requires that fh is
+        seekable and that the record is not compressed. Raises DumpError
+        if the payload is not length bytes or does not match digest.
+
+        Returns (offset, size, digest) where offset and size are the
+        position and size of the record in fh.
+        """
+        offset = self.fh.tell()
+        placeholder = warc_digest('sha1', bytes(20))
+        lines = [WARC_VERSION]
+        for (name, value) in headers:
+            lines.append(('%s: %s' % (name, value)).encode('utf-8'))
+        lines.append(b'WARC-Block-Digest: ' + (digest or placeholder).encode('ascii'))
+        lines.append(b'Content-Length: %d' % (length))
+        header = b'\r\n'.join(lines) + b'\r\n\r\n'
+        if (self.compress):
+            if (digest is None):
+                raise DumpError("Digest required to write compressed WARC record")
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 31)
+            write = (lambda data: self.fh.write(compressor.compress(data)))
+        else:
+            write = self.fh.write
+        write(header)
+        hasher = hashlib.sha1()
+        size = 0
+        while True:
+            chunk = payload.read(self.chunk_size)
+            if (not chunk):
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+            write(chunk)
+        write(b'\r\n\r\n')
+        if (self.compress):
+            self.fh.write(compressor.flush())
+        if (size != length):
+            raise DumpError("WARC record payload is %d bytes, expected %d" % (size, length))
+        computed = warc_digest('sha1', hasher.digest())
+        if (digest is None):
+            end = self.fh.tell()
+            self.fh.seek(offset + header.index(placeholder.encode('ascii')))
+            self.fh.write(computed.encode('ascii'))
+            self.fh.seek(end)
+        elif (computed != digest):
+            raise DumpError("WARC record payload digest is %s, expected %s" % (computed, digest))
+        return(offset, self.fh.tell() - offset, computed)
+
+
+class WarcRecord(object):
+    """One record of a WARC file being read.
+
+    headers is a dict of the WARC headers. The payload is read with
+    read(), which checks the length and any WARC-Block-Digest once all
+    of the payload has been read.
+    """
+
+    def __init__(self, fh, headers, chunk_size=1024 * 1024):
+        """Initialize WarcRecord with payload to be read from fh."""
+        self.fh = fh
+        self.headers = headers
+        self.chunk_size = chunk_size
+        try:
+            self.length = int(headers['Content-Length'])
+        except (KeyError, ValueError):
+            raise DumpError("Bad or missing Content-Length in WARC record")
+        self.remaining = self.length
+        self.hasher = None
+        digest = headers.get('WARC-Block-Digest')
+        if (digest):
+            (self.digest_algorithm, self.digest_value) = digest.split(':', 1)
+            try:
+                self.hasher = hashlib.new(self.digest_algorithm.lower())
+            except ValueError:
+                pass  # unknown algorithm, not checked
+
+    @property
+    def type(self):
+        """WARC-Type of record."""
+        return(self.headers.get('WARC-Type'))
+
+    @property
+    def uri(self):
+        """WARC-Target-URI of record, None if not given."""
+        return(self.headers.get('WARC-Target-URI'))
+
+    @property
+    def content_type(self):
+        """Content-Type of record, None if not given."""
+        return(self.headers.get('Content-Type'))
+
+    def read(self, size=-1):
+        """Read up to size bytes of payload, all if size < 0, b'' at end."""
+        if (size is None or size < 0):
+            parts = []
+            while True:
+                data = self.read(self.chunk_size)
+                if (not data):
+                    return(b''.join(parts))
+                parts.append(data)
+        if (self.remaining == 0):
+            return(b'')
+        data = self.fh.read(min(size, self.remaining))
+        if (not data):
+            raise DumpError("Unexpected end of WARC file in record for %s" % (self.uri))
+        self.remaining -= len(data)
+        if (self.hasher is not None):
+            self.hasher.update(data)
+        if (self.remaining == 0):
+            self._finish()
+        return(data)
+
+    def _finish(self):
+        # End of payload, check digest and read record separator
+        if (self.fh.read(4) != b'\r\n\r\n'):
+            raise DumpError("Missing record separator after WARC record for %s" % (self.uri))
+        if (self.hasher is not None):
+            digest = self.hasher.digest()
+            value = self.digest_value.strip()
+            if (value.upper() != base64.b32encode(digest).decode('ascii')
+                    and value.lower() != self.hasher.hexdigest()):
+                raise DumpError("Bad %s digest for WARC record for %s" %
+                                (self.digest_algorithm, self.uri))
+
+    def skip(self):
+        """Skip over any unread payload."""
+        while (self.remaining > 0):
+            self.read(self.chunk_size)
+
+
+class WarcReader(object):
+    """Read records from a WARC file, plain or gzipped, from fh.
+
+    Iterating gives each record in turn, each must be read before moving
+    on to the next or the rest of its payload is skipped. If fh is
+    seekable then record_at() reads just the record at a given offset,
+    as found from a CDX index.
+    """
+
+    def __init__(self, fh, compressed=None):
+        """Initialize WarcReader, gzip compression detected if compressed is None."""
+        self.fh = fh
+        if (compressed is None):
+            if (hasattr(fh, 'peek')):
+                magic = fh.peek(2)[0:2]
+            else:
+                magic = fh.read(2)
+                fh.seek(-len(magic), 1)
+            compressed = (magic == b'\x1f\x8b')
+        self.compressed = compressed
+        self.stream = (gzip.GzipFile(fileobj=fh, mode='rb') if compressed else fh)
+        self.record = None
+
+    def __iter__(self):
+        """Yield WarcRecord objects in file order."""
+        while True:
+            if (self.record is not None):
+                self.record.skip()
+                self.record = None
+            record = self.read_record(self.stream)
+            if (record is None):
+                return
+            self.record = record
+            yield record
+
+    def record_at(self, offset):
+        """Return the WarcRecord at offset in the WARC file."""
+        self.fh.seek(offset)
+        self.record = None
+        stream = (gzip.GzipFile(fileobj=self.fh, mode='rb') if self.compressed else self.fh)
+        record = self.read_record(stream)
+        if (record is None):
+            raise DumpError("No WARC record at offset %d" % (offset))
+        return(record)
+
+    def read_record(self, stream):
+        """Read headers of next record from stream, None at end of file."""
+        try:
+            line = stream.readline()
+        except (OSError, EOFError, zlib.error) as e:
+            raise DumpError("Cannot read WARC file (%s)" % (str(e)))
+        if (not line):
+            return(None)
+        if (not line.startswith(b'WARC/')):
+            raise DumpError("Bad WARC record version line %r" % (line[0:20]))
+        headers = {}
+        while True:
+            line = stream.readline()
+            if (not line):
+                raise DumpError("Unexpected end of WARC file in record header")
+            if (line in (b'\r\n', b'\n')):
+                break
+            (name, sep, value) = line.decode('utf-8').partition(':')
+            if (not sep):
+                raise DumpError("Bad WARC header line %r" % (line[0:50]))
+            headers[name.strip()] = value.strip()
+        return(WarcRecord(stream, headers))
+
+
+def warc_digest(algorithm, digest):
+    """WARC digest string "algorithm:BASE32" for digest bytes."""
+    return('%s:%s' % (algorithm, base64.b32encode(digest).decode('ascii')))
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """WARC SHA-1 digest string for the file at path."""
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if (not chunk):
+                break
+            hasher.update(chunk)
+    return(warc_digest('sha1', hasher.digest()))
+
+
+def read_cdx(cdxfile):
+    """Yield a dict for each entry in CDX index file cdxfile.
+
+    Keys are uri, timestamp, mime_type, digest, length, offset and
+    filename for the fields that are present, with length and offset as
+    integers.
+    """
+    names = dict(CDX_FIELDS)
+    with open(cdxfile, 'r') as fh:
+        legend = fh.readline().split()
+        if (legend[0:1] != ['CDX']):
+            raise DumpError("Bad CDX index %s, no CDX header line" % (cdxfile))
+        fields = [names.get(f) for f in legend[1:]]
+        for line in fh:
+            entry = {}
+            for (name, value) in zip(fields, line.split()):
+                if (name in ('length', 'offset')):
+                    entry[name] = int(value)
+                elif (name is not None):
+                    entry[name] = value
+            yield(entry)
 
 
 class DumpError(Exception):
@@ -0,0 +1,333 @@
+"""Reader for ResourceSync dump packages.
+
+A Resource Dump or Change Dump lists a set of content packages, each
+a ZIP file that contains a manifest.xml (a Resource Dump Manifest or
+Change Dump Manifest) and the resource content at the paths given in
+the manifest. The DumpReader checks a package against its manifest and
+extracts the content to files given by a Mapper, so that a client can
+copy many resources with one download.
+
+       reader = DumpReader(mapper=Mapper(['http://example.org/', '/tmp/dst']))
+       extracted = reader.extract('/tmp/rd_00000.zip')
+
+A package may instead be extracted as it is downloaded, without a
+temporary copy, using extract_stream(). This relies on manifest.xml
+being the first member, as written by Dump.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import os.path
+import queue
+import threading
+from zipfile import ZipFile, BadZipFile
+
+from .change_dump_manifest import ChangeDumpManifest
+from .hashes import Hashes
+from .resource_dump_manifest import ResourceDumpManifest
+from .sitemap import SitemapParseError
+from .streaming_zip import StreamingZipReader, StreamingZipError
+
+
+class ReadAhead(object):
+    """File-like object that reads ahead from fh in a background thread.
+
+    Lets reading from the network overlap with writing to disk. Chunks of
+    up to chunk_size bytes are read until the end of fh, with at most
+    max_chunks held. read() returns data from at most one chunk.
+    """
+
+    def __init__(self, fh, chunk_size=1024 * 1024, max_chunks=8):
+        """Initialize and start reading from fh."""
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.done = False
+        self.stopped = False
+        self.leftover = b''
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while (not self.stopped):
+                data = self.fh.read(self.chunk_size)
+                self.chunks.put(data)
+                if (not data):
+                    return
+        except Exception as e:
+            self.chunks.put(e)
+
+    def read(self, size=-1):
+        """Return up to size bytes from the next chunk of data, b'' at end."""
+        if (not self.leftover):
+            self.leftover = self._next_chunk()
+        if (size is None or size < 0):
+            size = len(self.leftover)
+        data = self.leftover[:size]
+        self.leftover = self.leftover[size:]
+        return(data)
+
+    def _next_chunk(self):
+        # Wait for next chunk from the reading thread
+        if (self.done):
+            return(b'')
+        data = self.chunks.get()
+        if (isinstance(data, Exception)):
+            self.done = True
+            raise data
+        if (not data):
+            self.done = True
+            self.thread.join()
+        return(data)
+
+    def close(self):
+        """Stop reading ahead, discarding any data read."""
+        self.stopped = True
+        while (self.thread.is_alive()):
+            try:
+                self.chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class DumpReader(object):
+    """Read, check and extract content packages from a dump.
+
+    mapper - Mapper used to map resource URIs to local filenames
+
+    workers - number of threads used to extract members in parallel, each
+        thread reads the ZIP file through its own file handle
+    """
+
+    def __init__(self, mapper=None, workers=1):
+        """Initialize DumpReader."""
+        self.mapper = mapper
+        self.workers = workers
+        self.chunk_size = 1024 * 1024
+        self.logger = logging.getLogger('resync.dump_reader')
+
+    def read_manifest(self, zf):
+        """Read manifest.xml from ZipFile zf.
+
+        Returns a ResourceDumpManifest or ChangeDumpManifest depending on the
+        capability of the manifest. Raises DumpReaderError if there is no
+        manifest or it cannot be parsed.
+        """
+        try:
+            data = zf.read('manifest.xml')
+        except KeyError:
+            raise DumpReaderError("No manifest.xml in dump package %s" % (zf.filename))
+        return(self.parse_manifest(data, zf.filename))
+
+    def parse_manifest(self, data, name):
+        """Parse manifest.xml bytes data from dump package name."""
+        error = None
+        for manifest_class in (ResourceDumpManifest, ChangeDumpManifest):
+            manifest = manifest_class()
+            try:
+                manifest.parse(str_data=data.decode('utf-8'))
+                return(manifest)
+            except (SitemapParseError, UnicodeDecodeError) as e:
+                error = e
+        raise DumpReaderError("Bad manifest.xml in dump package %s (%s)" %
+                              (name, str(error)))
+
+    def verify(self, zf, manifest):
+        """Check that the members of ZipFile zf match manifest.
+
+        Every resource in the manifest except deletions must have a path
+        that is a member of zf, and the size of that member must match any
+        length given in the manifest. Raises DumpReaderError listing all
+        problems if not.
+        """
+        problems = []
+        for resource in manifest:
+            if (resource.change == 'deleted'):
+                continue
+            if (not resource.path):
+                problems.append("no path for %s" % (resource.uri))
+                continue
+            try:
+                info = zf.getinfo(self.member_name(resource))
+            except KeyError:
+                problems.append("missing %s for %s" % (resource.path, resource.uri))
+                continue
+            if (resource.length is not None and resource.length != info.file_size):
+                problems.append("size of %s is %d, not %d as in manifest" %
+                                (resource.path, info.file_size, resource.length))
+        if (problems):
+            raise DumpReaderError("Dump package %s does not match manifest: %s" %
+                                  (zf.filename, '; '.join(problems)))
+        return(True)
+
+    def member_name(self, resource):
+        """Name of ZIP member for resource in a manifest.
+
+        Paths in manifests are given relative to the root of the package,
+        with or without a leading slash.
+        """
+        return(resource.path.lstrip('/'))
+
+    def select(self, manifest, wanted=None):
+        """Return list of resources in manifest to extract.
+
+        If wanted is None then all resources except deletions are selected.
+        Otherwise wanted is a dict of the Resource objects expected for each
+        URI and a resource in the manifest is selected only if its URI is
+        in wanted and it is equal to the expected Resource, so that an old
+        copy in a dump is not used.
+        """
+        selected = []
+        for resource in manifest:
+            if (resource.change == 'deleted'):
+                continue
+            if (wanted is not None):
+                expected = wanted.get(resource.uri)
+                if (expected is None):
+                    continue
+                if (resource != expected):
+                    self.logger.debug("Dump has different version of %s, ignoring" %
+                                      (resource.uri))
+                    continue
+            selected.append(resource)
+        return(selected)
+
+    def extract(self, dumpfile, wanted=None):
+        """Check and extract content from the ZIP file dumpfile.
+
+        See select() for the use of wanted. Returns the list of manifest
+        resources that were extracted, in manifest order. Members that do
+        not match the digests in the manifest are not written and not
+        returned. Raises DumpReaderError if the package cannot be read or
+        does not match its manifest.
+        """
+        try:
+            with ZipFile(dumpfile, 'r') as zf:
+                manifest = self.read_manifest(zf)
+                self.verify(zf, manifest)
+        except (BadZipFile, IOError) as e:
+            raise DumpReaderError("Cannot read dump package %s (%s)" % (dumpfile, str(e)))
+        selected = self.select(manifest, wanted)
+        if (self.workers <= 1 or len(selected) <= 1):
+            ok = self.extract_members(dumpfile, selected)
+        else:
+            # Give each thread an interleaved share of the members
+            shares = [selected[j::self.workers] for j in range(self.workers)]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(
+                    lambda share: self.extract_members(dumpfile, share), shares))
+            ok = [False] * len(selected)
+            for (j, result) in enumerate(results):
+                ok[j::self.workers] = result
+        extracted = [r for (r, good) in zip(selected, ok) if good]
+        self.logger.info("Extracted %d of %d resources from dump package %s" %
+                         (len(extracted), len(manifest), dumpfile))
+        return(extracted)
+
+    def extract_stream(self, fh, wanted=None, name='stream', read_ahead=True):
+        """Check and extract content from a dump package read from fh.
+
+        Members are extracted as the data arrives, without needing the
+        whole ZIP file. manifest.xml must be the first member. With
+        read_ahead set, fh is read in a separate thread so that reading
+        and writing files overlap. See extract() for wanted and the
+        return value. Raises DumpReaderError if the package cannot be read,
+        in which case members before the error may have been extracted.
+        """
+        if (read_ahead):
+            fh = ReadAhead(fh, self.chunk_size)
+        zr = StreamingZipReader(fh)
+        extracted = []
+        try:
+            members = iter(zr)
+            member = next(members, None)
+            if (member is None or member.filename != 'manifest.xml'):
+                raise DumpReaderError("Dump package %s does not start with manifest.xml" % (name))
+            manifest = self.parse_manifest(member.read(), name)
+            selected = dict((self.member_name(r), r) for r in self.select(manifest, wanted))
+            seen = set()
+            for member in members:
+                seen.add(member.filename)
+                resource = selected.get(member.filename)
+                if (resource is None):
+                    continue
+                if (resource.length is not None and member.file_size is not None
+                        and resource.length != member.file_size):
+                    self.logger.warning("Size of %s in dump package %s is %d, not %d as in manifest" %
+                                        (member.filename, name, member.file_size, resource.length))
+                    continue
+                if (self.write_member(member, resource, self.mapper.src_to_dst(resource.uri))):
+                    extracted.append(resource)
+        except StreamingZipError as e:
+            raise DumpReaderError("Cannot read dump package %s (%s)" % (name, str(e)))
+        finally:
+            if (read_ahead):
+                fh.close()
+        missing = [r.path for r in manifest
+                   if r.change != 'deleted' and r.path and self.member_name(r) not in seen]
+        if (missing):
+            self.logger.warning("Dump package %s does not match manifest: missing %s" %
+                                (name, ', '.join(missing)))
+        self.logger.info("Extracted %d of %d resources from dump package %s (%d bytes)" %
+                         (len(extracted), len(manifest), name, zr.bytes_read))
+        return(extracted)
+
+    def extract_members(self, dumpfile, resources):
+        """Extract members for resources from dumpfile, return list of bools for success."""
+        with ZipFile(dumpfile, 'r') as zf:
+            return([self.extract_member(zf, resource) for resource in resources])
+
+    def extract_member(self, zf, resource):
+        """Extract member for resource in ZipFile zf to mapped filename.
+
+        The content is written to a temporary file alongside the final
+        filename and is moved into place only if all digests given in the
+        manifest match. Returns True on success, else False.
+        """
+        filename = self.mapper.src_to_dst(resource.uri)
+        with zf.open(self.member_name(resource)) as fh:
+            return(self.write_member(fh, resource, filename))
+
+    def write_member(self, fh, resource, filename):
+        """Copy member content from fh to filename checking digests from resource.
+
+        Returns True if written, False if a digest did not match.
+        """
+        hashes = [name for (name, att) in sorted(Hashes.NAME_TO_ATTRIBUTE.items())
+                  if getattr(resource, att) is not None]
+        hasher = Hashes(hashes)
+        hasher.initialize_hashes()
+        dirname = os.path.dirname(filename)
+        if (dirname and not os.path.isdir(dirname)):
+            os.makedirs(dirname, exist_ok=True)
+        tmpfile = filename + '.resync-part'
+        try:
+            with open(tmpfile, 'wb') as fh_out:
+                while True:
+                    data = fh.read(self.chunk_size)
+                    if (not data):
+                        break
+                    hasher.update(data)
+                    fh_out.write(data)
+        except Exception:
+            os.unlink(tmpfile)
+            raise
+        for hash in hashes:
+            att = Hashes.NAME_TO_ATTRIBUTE[hash]
+            if (getattr(hasher, att) != getattr(resource, att)):
+                self.logger.warning("%s mismatch for %s in dump, got %s but expected %s" %
+                                    (hash, resource.uri, getattr(hasher, att),
+                                     getattr(resource, att)))
+                os.unlink(tmpfile)
+                return(False)
+        os.replace(tmpfile, filename)
+        return(True)
+
+
+class DumpReaderError(Exception):
+    """Error class used by DumpReader objects."""
+
+    pass
@@ -128,7 +128,7 @@ class Explorer(Client):
                 self.explore_show_head(uri, check_headers=checks)
             else:
                 s = Sitemap()
-                list = s.parse_xml(url_or_file_open(uri))
+                list = s.parse_xml(url_or_file_open(uri, gunzip=True))
                 (options, capability) = self.explore_show_summary(
                     list, s.parsed_index, caps, context=uri)
         except IOError as e:
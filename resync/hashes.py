@@ -76,14 +76,22 @@ class Hashes(object):
             data = f.read(block_size)
             if not data:
                 break
-            if self.md5_calc is not None:
-                self.md5_calc.update(data)
-            if self.sha1_calc is not None:
-                self.sha1_calc.update(data)
-            if self.sha256_calc is not None:
-                self.sha256_calc.update(data)
+            self.update(data)
         f.close()
 
+    def update(self, data):
+        """Add data to the hash calculations.
+
+        Used to calculate hashes for data read incrementally, call
+        initialize_hashes() first.
+        """
+        if self.md5_calc is not None:
+            self.md5_calc.update(data)
+        if self.sha1_calc is not None:
+            self.sha1_calc.update(data)
+        if self.sha256_calc is not None:
+            self.sha256_calc.update(data)
+
     def set(self, resource):
         """Set hash values for resource from current file.
 
@@ -54,8 +54,10 @@ class ListBase(ResourceContainer):
         self.pretty_xml = False
         #
         self.logger = logging.getLogger('resync.list_base')
-        self.bytes_read = 0
+        self.bytes_read = 0           # Bytes read, compressed if gzipped
+        self.bytes_uncompressed = 0   # Bytes of XML read
         self.parsed_index = None
+        self.uri_table = None  # UriTable to share URIs of resources read
 
     def __iter__(self):
         """Default to iterator provided by resources object."""
@@ -98,7 +100,7 @@ class ListBase(ResourceContainer):
         """
         if (uri is not None):
             try:
-                fh = url_or_file_open(uri)
+                fh = url_or_file_open(uri, gunzip=True)
             except IOError as e:
                 raise Exception(
                     "Failed to load sitemap/sitemapindex from %s (%s)" %
@@ -121,6 +123,18 @@ class ListBase(ResourceContainer):
             capability=self.capability_name,
             sitemapindex=False)
         self.parsed_index = s.parsed_index
+        if (uri is not None):
+            self.record_bytes_read(fh)
+
+    def record_bytes_read(self, fh):
+        """Add the sizes read from response fh to the totals for this list.
+
+        bytes_read counts the bytes transferred, which are compressed if
+        the sitemap was gzipped or sent with a content encoding, and
+        bytes_uncompressed the bytes of XML.
+        """
+        self.bytes_read += getattr(fh, 'bytes_read', 0)
+        self.bytes_uncompressed += getattr(fh, 'bytes_decoded', 0)
 
     # OUTPUT
 
@@ -151,4 +165,5 @@ class ListBase(ResourceContainer):
         """Create new Sitemap object with default settings."""
         return Sitemap(pretty_xml=self.pretty_xml,
                        spec_version=self.spec_version,
-                       add_lastmod=self.add_lastmod)
+                       add_lastmod=self.add_lastmod,
+                       uri_table=self.uri_table)
@@ -5,10 +5,14 @@ sitemapindexes. Extends ListBase to add the support for sitemapindexes.
 """
 
 import collections
-import math
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import gzip
 import os
 from datetime import datetime
 import re
+import tempfile
+import zlib
 import sys
 import itertools
 
@@ -21,14 +25,41 @@ from .url_authority import UrlAuthority
 from .url_or_file_open import url_or_file_open
 
 
+def entries_as_xml(resources, pretty_xml=False, spec_version='1.1', add_lastmod=False):
+    """Return list of sitemap <url> entry XML strings for resources.
+
+    A module level function so that it can be run in a process pool.
+    """
+    s = Sitemap(pretty_xml=pretty_xml, spec_version=spec_version,
+                add_lastmod=add_lastmod)
+    return([s.resource_as_xml(r) for r in resources])
+
+
 class ListBaseWithIndex(ListBase):
     """Class that add handling of sitemapindexes to ListBase.
 
-    Splitting of a list into multiple sitemaps with a sitemapindex is currently
-    handled based solely on the number of entries in the list. The configurable
-    self.max_sitemap_entries controls the number of entries that will be written
-    in a single sitemap or a component sitemap that has a sitemapindex. Support
-    for sitemapindexes can be disabled by setting allow_multifile False.
+    Splitting of a list into multiple sitemaps with a sitemapindex is handled
+    based on the number of entries in the list and the size of the XML. The
+    configurable self.max_sitemap_entries controls the number of entries that
+    will be written in a single sitemap or a component sitemap that has a
+    sitemapindex, and self.max_sitemap_bytes the size in bytes of each
+    sitemap. Either may be None for no limit. max_sitemap_bytes is None by
+    default because the whole list must be serialized to find where to
+    split it, set it to 50MB (52428800) to apply the limit of the sitemap
+    protocol. Support for sitemapindexes can be disabled by setting
+    allow_multifile False.
+
+    With write_workers greater than 1, entries are serialized in a pool of
+    that many processes and component sitemaps written by that many threads.
+
+    If replace_files is set then each file is written as a temporary file
+    in the same directory and renamed over the old file when complete, so
+    that a client reading the file while it is rewritten never sees a
+    partly written document.
+
+    If gzip_components is set then component sitemaps are written gzipped
+    with names ending .xml.gz. Sitemaps and sitemapindexes are read
+    transparently whether gzipped or not, see url_or_file_open(...).
 
     resources - an iterable of resources
 
@@ -65,6 +96,11 @@ class ListBaseWithIndex(ListBase):
             add_lastmod=add_lastmod)
         # specific to lists with indexes
         self.max_sitemap_entries = 50000
+        self.max_sitemap_bytes = None
+        self.gzip_components = False
+        self.replace_files = False
+        self.write_workers = 1
+        self.write_batch_size = 5000
         self.mapper = mapper
         self.allow_multifile = (
             True if (
@@ -72,7 +108,9 @@ class ListBaseWithIndex(ListBase):
         self.check_url_authority = False
         self.content_length = 0
         self.num_files = 0            # Number of files read
-        self.bytes_read = 0           # Aggregate of content_length values
+        self.bytes_read = 0           # Bytes read, compressed if gzipped
+        self.bytes_uncompressed = 0   # Bytes of XML read
+        self._part_starts = None      # (key, starts) from part_starts()
 
     # INPUT
 
@@ -88,7 +126,7 @@ class ListBaseWithIndex(ListBase):
         are mapped to the filesystem also.
         """
         try:
-            fh = url_or_file_open(uri)
+            fh = url_or_file_open(uri, gunzip=True)
             self.num_files += 1
         except IOError as e:
             raise IOError(
@@ -97,7 +135,6 @@ class ListBaseWithIndex(ListBase):
         # Get the Content-Length if we can (works fine for local files)
         try:
             self.content_length = int(fh.info()['Content-Length'])
-            self.bytes_read += self.content_length
             self.logger.debug(
                 "Read %d bytes from %s" %
                 (self.content_length, uri))
@@ -107,7 +144,8 @@ class ListBaseWithIndex(ListBase):
             pass
         self.logger.info("Read sitemap/sitemapindex from %s" % (uri))
         s = self.new_sitemap()
-        s.parse_xml(fh=fh, resources=self, capability=self.capability_name)
+        self.parse_sitemap_xml(s, fh)
+        self.record_bytes_read(fh)
         # what did we read? sitemap or sitemapindex?
         if (s.parsed_index):
             # sitemapindex
@@ -126,22 +164,56 @@ class ListBaseWithIndex(ListBase):
                 return
             # now loop over all entries to read each sitemap and add to
             # resources
-            sitemaps = self.resources
+            sitemaps = self.component_sitemaps(self.resources)
             self.resources = self.resources_class()
-            self.logger.info("Now reading %d sitemaps" % len(sitemaps.uris()))
-            for sitemap_uri in sorted(sitemaps.uris()):
+            self.logger.info("Now reading %d sitemaps" % len(sitemaps))
+            for sitemap in sitemaps:
                 self.read_component_sitemap(
-                    uri, sitemap_uri, s, sitemapindex_is_file)
+                    uri, sitemap.uri, s, sitemapindex_is_file)
         else:
             # sitemap
             self.logger.info("Parsed as sitemap, %d resources" %
                              (len(self.resources)))
 
-    def read_component_sitemap(
-            self, sitemapindex_uri, sitemap_uri, sitemap, sitemapindex_is_file):
-        """Read a component sitemap of a Resource List with index.
+    def parse_sitemap_xml(self, sitemap, fh):
+        """Parse sitemap or sitemapindex from fh into self using Sitemap object sitemap.
 
-        Each component must be a sitemap with the
+        After parsing, sitemap.parsed_index says which was read. In the
+        case of a sitemapindex, self.resources holds the entries for the
+        component sitemaps.
+        """
+        sitemap.parse_xml(fh=fh, resources=self, capability=self.capability_name)
+
+    def component_sitemaps(self, sitemaps):
+        """Return list of the component sitemap entries to read, in URI order.
+
+        sitemaps is the set of entries read from a sitemapindex. Entries
+        for which skip_component_sitemap(...) is True are omitted.
+        """
+        components = []
+        for sitemap in sorted(sitemaps, key=lambda r: r.uri):
+            if (self.skip_component_sitemap(sitemap)):
+                self.logger.info("Skipping sitemap %s" % (sitemap.uri))
+            else:
+                components.append(sitemap)
+        return(components)
+
+    def skip_component_sitemap(self, sitemap):
+        """Return True if the component sitemap need not be read.
+
+        Always False here, may be overridden in derived classes that can
+        tell from the metadata of the sitemapindex entry.
+        """
+        return(False)
+
+    def component_sitemap_uri(
+            self, sitemapindex_uri, sitemap_uri, sitemapindex_is_file):
+        """Return the URI to read a component sitemap listed in a sitemapindex from.
+
+        If the sitemapindex was read from a local file then the component
+        URI is mapped to a local file also. Raises ListBaseIndexError if
+        self.check_url_authority is set and the sitemapindex does not have
+        authority over the component.
         """
         if (sitemapindex_is_file):
             if (not self.is_file_uri(sitemap_uri)):
@@ -159,8 +231,18 @@ class ListBaseWithIndex(ListBase):
                     raise ListBaseIndexError(
                         "The sitemapindex (%s) refers to sitemap at a location it does not have authority over (%s)" %
                         (sitemapindex_uri, sitemap_uri))
+        return(sitemap_uri)
+
+    def read_component_sitemap(
+            self, sitemapindex_uri, sitemap_uri, sitemap, sitemapindex_is_file):
+        """Read a component sitemap of a Resource List with index.
+
+        Each component must be a sitemap with the
+        """
+        sitemap_uri = self.component_sitemap_uri(
+            sitemapindex_uri, sitemap_uri, sitemapindex_is_file)
         try:
-            fh = url_or_file_open(sitemap_uri)
+            fh = url_or_file_open(sitemap_uri, gunzip=True)
             self.num_files += 1
         except IOError as e:
             raise ListBaseIndexError(
@@ -169,7 +251,6 @@ class ListBaseWithIndex(ListBase):
         # Get the Content-Length if we can (works fine for local files)
         try:
             self.content_length = int(fh.info()['Content-Length'])
-            self.bytes_read += self.content_length
         except (KeyError, TypeError):
             # If we don't get a length then c'est la vie
             pass
@@ -177,9 +258,10 @@ class ListBaseWithIndex(ListBase):
             "Reading sitemap from %s (%d bytes)" %
             (sitemap_uri, self.content_length))
         component = sitemap.parse_xml(fh=fh, sitemapindex=False)
+        self.record_bytes_read(fh)
         # Copy resources into self, check any metadata
         for r in component:
-            self.resources.add(r)
+            self.add(r)
         # FIXME - if rel="up" check it goes to correct place
         # FIXME - check capability
 
@@ -191,10 +273,75 @@ class ListBaseWithIndex(ListBase):
         In the case that no len() is available for self.resources then
         then self.count must be set beforehand to avoid an exception.
         """
-        if (self.max_sitemap_entries is None
-                or len(self) <= self.max_sitemap_entries):
-            return(False)
-        return(int(math.ceil(len(self) / float(self.max_sitemap_entries))))
+        num_parts = len(self.part_starts())
+        return(False if num_parts <= 1 else num_parts)
+
+    def part_starts(self):
+        """Return list of the index of the first resource in each component sitemap.
+
+        If self.max_sitemap_bytes is set then the resources are serialized
+        to find where to split them. The result is kept so that
+        as_xml_part(...) can be called for each part in turn, see
+        part_starts_key(). Only self.max_sitemap_entries is used if
+        self.resources is an iterator which can be read only once, or a
+        container without a count of changes so that the result could not
+        be kept and the resources would be serialized for every part.
+        """
+        key = self.part_starts_key()
+        if (self.max_sitemap_bytes is None or key is None):
+            if (self.max_sitemap_entries is None):
+                return([0])
+            return(list(range(0, max(len(self), 1), self.max_sitemap_entries)))
+        if (self._part_starts is not None and self._part_starts[0] == key):
+            return(list(self._part_starts[1]))
+        starts = [0]
+        for part in self.partition_entries(self.serialize_entries(iter(self.resources))):
+            starts.append(starts[-1] + len(part))
+        starts = starts[0:-1] or [0]
+        self._part_starts = (key, starts)
+        return(list(starts))
+
+    def resources_changes(self):
+        """Return the count of changes to self.resources, or None if not counted.
+
+        ResourceListDict, ResourceListOrdered, CountedList (the default for
+        a ChangeList) and ChangeFolder count changes in their changes
+        attribute, a ChangeJournal in num_writes.
+        """
+        changes = getattr(self.resources, 'changes', None)
+        if (isinstance(changes, int)):
+            return(changes)
+        return(getattr(self.resources, 'num_writes', None))
+
+    def part_starts_key(self):
+        """Return value that changes whenever part_starts() might change.
+
+        The part boundaries found by serializing the resources are kept
+        and reused until the resources, the limits or the settings that
+        affect the XML are changed. Changes to resources are detected with
+        resources_changes(). Returns None for other containers, such as a
+        plain list where an entry may be replaced without changing the
+        length, and for an iterator that can be read only once.
+        """
+        changes = self.resources_changes()
+        if (changes is None or iter(self.resources) is self.resources):
+            return(None)
+        return((id(self.resources), changes, len(self),
+                self.max_sitemap_entries, self.max_sitemap_bytes, self.pretty_xml,
+                self.spec_version, self.add_lastmod, self.capability_name,
+                repr(self.md), repr(self.ln)))
+
+    def resources_slice(self, start, stop):
+        """Return list of the resources from position start up to stop.
+
+        Uses resource_slice(...) of the resources if available, or slicing
+        for a list, to avoid iterating from the start each time.
+        """
+        if (hasattr(self.resources, 'resource_slice')):
+            return(self.resources.resource_slice(start, stop))
+        if (isinstance(self.resources, (list, tuple))):
+            return(list(self.resources[start:stop]))
+        return(list(itertools.islice(self.resources, start, stop)))
 
     def as_xml(self, allow_multifile=False, basename="/tmp/sitemap.xml"):
         """Return XML serialization of this list.
@@ -208,14 +355,21 @@ class ListBaseWithIndex(ListBase):
         If allow_multifile is set True then will return the sitemapindex
         for the set of component sitemaps.
         """
-        if (not self.requires_multifile()):
-            return super(ListBaseWithIndex, self).as_xml()
-        elif (allow_multifile):
-            return self.as_xml_index(basename)
-        else:
+        if (self.max_sitemap_entries is None
+                or len(self) <= self.max_sitemap_entries):
+            xml = super(ListBaseWithIndex, self).as_xml()
+            if (self.max_sitemap_bytes is None
+                    or len(xml.encode('utf-8')) <= self.max_sitemap_bytes):
+                return xml
+            if (not allow_multifile):
+                raise ListBaseIndexError(
+                    "Attempt to write single XML string for list of %d bytes when max_sitemap_bytes is set to %d" %
+                    (len(xml.encode('utf-8')), self.max_sitemap_bytes))
+        elif (not allow_multifile):
             raise ListBaseIndexError(
                 "Attempt to write single XML string for list with %d entries when max_sitemap_entries is set to %d" %
                 (len(self), self.max_sitemap_entries))
+        return self.as_xml_index(basename)
 
     def as_xml_index(self, basename="/tmp/sitemap.xml"):
         """Return a string of the index for a large list that is split.
@@ -253,22 +407,19 @@ class ListBaseWithIndex(ListBase):
 
         Q - what timestamp should be used?
         """
-        if (not self.requires_multifile()):
+        starts = self.part_starts()
+        if (len(starts) <= 1):
             raise ListBaseIndexError(
                 "Request for component sitemap for list with only %d entries when max_sitemap_entries is set to %s" %
                 (len(self), str(
                     self.max_sitemap_entries)))
-        start = part_number * self.max_sitemap_entries
-        if (start > len(self)):
+        if (part_number >= len(starts)):
             raise ListBaseIndexError(
-                "Request for component sitemap with part_number too high, would start at entry %d yet the list has only %d entries" %
-                (start, len(self)))
-        stop = start + self.max_sitemap_entries
-        if (stop > len(self)):
-            stop = len(self)
-        part = ListBase(itertools.islice(self.resources, start, stop))
-        part.capability_name = self.capability_name
-        part.default_capability()
+                "Request for component sitemap with part_number too high, there are only %d component sitemaps for the %d entries" %
+                (len(starts), len(self)))
+        start = starts[part_number]
+        stop = (starts[part_number + 1] if part_number + 1 < len(starts) else len(self))
+        part = self.new_chunk(self.resources_slice(start, stop))
         part.index = basename
         s = self.new_sitemap()
         return(s.resources_as_xml(part))
@@ -283,75 +434,145 @@ class ListBaseWithIndex(ListBase):
         basename is used as the name of the single sitemap file or the
         sitemapindex for a set of sitemap files.
 
-        Uses self.max_sitemap_entries to determine whether the resource_list can
-        be written as one sitemap. If there are more entries and
-        self.allow_multifile is set True then a set of sitemap files,
-        with an sitemapindex, will be written.
+        Uses self.max_sitemap_entries and self.max_sitemap_bytes to determine
+        whether the resource_list can be written as one sitemap. If there are
+        more entries and self.allow_multifile is set True then a set of sitemap
+        files, with an sitemapindex, will be written. Each resource is
+        serialized once, see serialize_entries(...), and the sitemaps are
+        written with write_component(...) as they are filled, in parallel
+        with self.write_workers.
         """
-        # Access resources through iterator only
-        resources_iter = iter(self.resources)
-        (chunk, nxt) = self.get_resources_chunk(resources_iter)
         s = self.new_sitemap()
-        if (nxt is not None):
-            # Have more than self.max_sitemap_entries => sitemapindex
-            if (not self.allow_multifile):
-                raise ListBaseIndexError(
-                    "Too many entries for a single sitemap but multifile disabled")
-            # Work out URI of sitemapindex so that we can link up to
-            # it from the individual sitemap files
-            try:
-                index_uri = self.mapper.dst_to_src(basename)
-            except MapperError as e:
-                raise ListBaseIndexError(
-                    "Cannot map sitemapindex filename to URI (%s)" %
-                    str(e))
-            # Use iterator over all resources and count off sets of
-            # max_sitemap_entries to go into each sitemap, store the
-            # names of the sitemaps as we go. Copy md from self into
-            # the index and use this for all chunks also
-            index = ListBase(md=self.md.copy(), ln=list(self.ln))
-            index.capability_name = self.capability_name
-            index.default_capability()
-            while (len(chunk) > 0):
-                file = self.part_name(basename, len(index))
-                # Check that we can map the filename of this sitemap into
-                # URI space for the sitemapindex
+        if (self.sitemapindex):
+            self.default_capability()
+            self.logger.info("Writing sitemapindex %s..." % (basename))
+            with self.output_file(basename) as name:
+                f = self.open_sitemap_file(name)
+                s.resources_as_xml(self, sitemapindex=True, fh=f)
+                f.close()
+            self.logger.info("Wrote sitemapindex %s" % (basename))
+            return
+        # Access resources through iterator only
+        (head, tail) = s.xml_head_and_tail(self.new_chunk())
+        parts = self.partition_entries(self.serialize_entries(iter(self.resources)))
+        part = next(parts, [])
+        nxt = next(parts, None)
+        if (nxt is None):
+            self.logger.info("Writing sitemap %s..." % (basename))
+            self.write_component(basename, head, part, tail)
+            self.logger.info("Wrote sitemap %s" % (basename))
+            return
+        # Have more than one sitemap worth => sitemapindex
+        if (not self.allow_multifile):
+            raise ListBaseIndexError(
+                "Too many entries for a single sitemap but multifile disabled")
+        # Check that we can map the filename of the sitemapindex and of
+        # each sitemap into URI space for the sitemapindex
+        try:
+            self.mapper.dst_to_src(basename)
+        except MapperError as e:
+            raise ListBaseIndexError(
+                "Cannot map sitemapindex filename to URI (%s)" %
+                str(e))
+        # Copy md from self into the index. Parts are written by
+        # self.write_workers threads, at most that many waiting
+        index = ListBase(md=self.md.copy(), ln=list(self.ln))
+        index.capability_name = self.capability_name
+        index.default_capability()
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.write_workers) as executor:
+            for part in itertools.chain([part, nxt], parts):
+                file = self.part_name(basename, len(index) + len(pending))
                 try:
                     uri = self.mapper.dst_to_src(file)
                 except MapperError as e:
                     raise ListBaseIndexError(
                         "Cannot map sitemap filename to URI (%s)" % str(e))
+                if (len(pending) >= self.write_workers):
+                    index.add(self.component_resource(*pending.popleft()))
                 self.logger.info("Writing sitemap %s..." % (file))
-                f = open(file, 'w')
-                chunk.index = index_uri
-                chunk.md = index.md
-                s.resources_as_xml(chunk, fh=f)
-                f.close()
-                # Record information about this sitemap for index
-                r = Resource(uri=uri,
-                             timestamp=os.stat(file).st_mtime,
-                             md5=Hashes(['md5'], file).md5)
-                index.add(r)
-                # Get next chunk
-                (chunk, nxt) = self.get_resources_chunk(resources_iter, nxt)
-            self.logger.info("Wrote %d sitemaps" % (len(index)))
-            f = open(basename, 'w')
-            self.logger.info("Writing sitemapindex %s..." % (basename))
+                pending.append((uri, file, executor.submit(
+                    self.write_component, file, head, part, tail)))
+            while (pending):
+                index.add(self.component_resource(*pending.popleft()))
+        self.logger.info("Wrote %d sitemaps" % (len(index)))
+        self.logger.info("Writing sitemapindex %s..." % (basename))
+        with self.output_file(basename) as name:
+            f = self.open_sitemap_file(name)
             s.resources_as_xml(index, sitemapindex=True, fh=f)
             f.close()
-            self.logger.info("Wrote sitemapindex %s" % (basename))
-        elif self.sitemapindex:
-            f = open(basename, 'w')
-            self.logger.info("Writing sitemapindex %s..." % (basename))
-            s.resources_as_xml(chunk, sitemapindex=True, fh=f)
-            f.close()
-            self.logger.info("Wrote sitemapindex %s" % (basename))
-        else:
-            f = open(basename, 'w')
-            self.logger.info("Writing sitemap %s..." % (basename))
-            s.resources_as_xml(chunk, fh=f)
-            f.close()
-            self.logger.info("Wrote sitemap %s" % (basename))
+        self.logger.info("Wrote sitemapindex %s" % (basename))
+
+    def component_resource(self, uri, file, future):
+        """Resource for the sitemapindex entry of component sitemap file at uri.
+
+        future is for write_component(...) and gives the md5.
+        """
+        md5 = future.result()
+        return(Resource(uri=uri, timestamp=os.stat(file).st_mtime, md5=md5))
+
+    def write_component(self, file, head, entries, tail):
+        """Write sitemap file with XML head, entries and tail, return its md5.
+
+        The file is gzipped if its name ends .gz. The md5 of the file
+        written is calculated as it is written.
+        """
+        hasher = Hashes(['md5'])
+        hasher.initialize_hashes()
+        compressor = None
+        if (file.endswith('.gz')):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with self.output_file(file) as name, open(name, 'wb') as fh:
+
+            def write(data):
+                if (compressor is not None):
+                    data = compressor.compress(data)
+                hasher.update(data)
+                fh.write(data)
+
+            write(head.encode('utf-8'))
+            for j in range(0, len(entries), 1000):
+                write(''.join(entries[j:j + 1000]).encode('utf-8'))
+            write(tail.encode('utf-8'))
+            if (compressor is not None):
+                data = compressor.flush()
+                hasher.update(data)
+                fh.write(data)
+        return(hasher.md5)
+
+    @contextlib.contextmanager
+    def output_file(self, file):
+        """Context manager giving the name of the file to write as file.
+
+        This is file itself unless self.replace_files is set, in which case
+        it is a temporary file in the same directory that is renamed to
+        file, keeping the permissions of any old file, at the end.
+        """
+        if (not self.replace_files):
+            yield file
+            return
+        dirname = os.path.dirname(file) or '.'
+        (fd, tmpname) = tempfile.mkstemp(dir=dirname, prefix='.tmp-',
+                                         suffix=os.path.basename(file))
+        os.close(fd)
+        try:
+            yield tmpname
+            try:
+                mode = os.stat(file).st_mode & 0o777
+            except OSError:
+                mode = 0o644
+            os.chmod(tmpname, mode)
+            os.replace(tmpname, file)
+        except BaseException:
+            if (os.path.exists(tmpname)):
+                os.remove(tmpname)
+            raise
+
+    def open_sitemap_file(self, file):
+        """Open file to write a sitemap or sitemapindex, gzipped if file ends .gz."""
+        if (file.endswith('.gz')):
+            return(gzip.open(file, 'wt', encoding='utf-8'))
+        return(open(file, 'w'))
 
     def index_as_xml(self):
         """XML serialization of this list taken to be sitemapindex entries."""
@@ -361,32 +582,73 @@ class ListBaseWithIndex(ListBase):
 
     # Utility
 
-    def get_resources_chunk(self, resource_iter, first=None):
-        """Return next chunk of resources from resource_iter, and next item.
+    def new_chunk(self, resources=None):
+        """Return ListBase for one component sitemap with md and ln of this list."""
+        chunk = ListBase(resources, md=self.md.copy(), ln=list(self.ln))
+        chunk.capability_name = self.capability_name
+        chunk.default_capability()
+        return(chunk)
 
-        If first parameter is specified then this will be prepended to
-        the list.
+    def serialize_entries(self, resource_iter):
+        """Yield the XML string of the sitemap entry for each resource from resource_iter.
 
-        The chunk will contain self.max_sitemap_entries if the iterator
-        returns that many. next will have the value of the next value from
-        the iterator, providing indication of whether more is available.
-        Use this as first when asking for the following chunk.
+        With self.write_workers greater than 1, batches of
+        self.write_batch_size resources are serialized in a process pool,
+        with up to twice as many batches as workers in progress.
         """
-        chunk = ListBase(md=self.md.copy(), ln=list(self.ln))
-        chunk.capability_name = self.capability_name
-        chunk.default_capability()
-        if (first is not None):
-            chunk.add(first)
-        for r in resource_iter:
-            chunk.add(r)
-            if (len(chunk) >= self.max_sitemap_entries):
-                break
-        # Get next to see whether there are more resources
-        try:
-            nxt = next(resource_iter)
-        except StopIteration:
-            nxt = None
-        return(chunk, nxt)
+        s = self.new_sitemap()
+        if (self.write_workers <= 1):
+            for r in resource_iter:
+                yield(s.resource_as_xml(r))
+            return
+        settings = (self.pretty_xml, self.spec_version, self.add_lastmod)
+        with ProcessPoolExecutor(max_workers=self.write_workers) as pool:
+            pending = collections.deque()
+            while True:
+                batch = list(itertools.islice(resource_iter, self.write_batch_size))
+                if (batch):
+                    pending.append(pool.submit(entries_as_xml, batch, *settings))
+                if (not pending):
+                    return
+                if (not batch or len(pending) >= 2 * self.write_workers):
+                    for entry in pending.popleft().result():
+                        yield(entry)
+
+    def partition_entries(self, entries):
+        """Yield lists of the XML strings from entries for each component sitemap.
+
+        Each list has at most self.max_sitemap_entries entries, and the
+        sitemap written with them at most self.max_sitemap_bytes, if set.
+        There is always at least one list, which may be empty.
+        """
+        budget = None
+        if (self.max_sitemap_bytes is not None):
+            (head, tail) = self.new_sitemap().xml_head_and_tail(self.new_chunk())
+            budget = self.max_sitemap_bytes - len((head + tail).encode('utf-8'))
+        part = []
+        size = 0
+        num_parts = 0
+        for entry in entries:
+            if (budget is not None):
+                entry_size = len(entry.encode('utf-8'))
+                if (part and size + entry_size > budget):
+                    yield(part)
+                    num_parts += 1
+                    part = []
+                    size = 0
+                if (entry_size > budget):
+                    self.logger.warning("Sitemap entry alone exceeds max_sitemap_bytes: %s" %
+                                        (entry[0:200]))
+                size += entry_size
+            part.append(entry)
+            if (self.max_sitemap_entries is not None
+                    and len(part) >= self.max_sitemap_entries):
+                yield(part)
+                num_parts += 1
+                part = []
+                size = 0
+        if (part or num_parts == 0):
+            yield(part)
 
     def part_name(self, basename='/tmp/sitemap.xml', part_number=0):
         """Name (file or URI) for one component sitemap.
@@ -402,9 +664,11 @@ class ListBaseWithIndex(ListBase):
         # Work out how to name the sitemaps, attempt to add %05d before
         # ".xml$", else append
         sitemap_prefix = basename
-        sitemap_suffix = '.xml'
+        sitemap_suffix = ('.xml.gz' if self.gzip_components else '.xml')
         if (basename[-4:] == '.xml'):
             sitemap_prefix = basename[:-4]
+        elif (basename[-7:] == '.xml.gz'):
+            sitemap_prefix = basename[:-7]
         return(sitemap_prefix + ("%05d" % (part_number)) + sitemap_suffix)
 
     def is_file_uri(self, uri):
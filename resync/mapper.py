@@ -13,13 +13,15 @@ import logging
 class Mapper():
     """Mapper object to map between source URIs and destination paths.
 
-    Implemented as a list of Map objects.
+    Implemented as a list of Map objects. If uri_table is set to a UriTable
+    then the source URIs returned by dst_to_src(...) are taken from it.
     """
 
     def __init__(self, mappings=None, use_default_path=False):
         """Initialize Mapper."""
         self.logger = logging.getLogger('resync.mapper')
         self.mappings = []
+        self.uri_table = None
         if (mappings):
             self.parse(mappings, use_default_path)
 
@@ -102,6 +104,8 @@ class Mapper():
         for map in self.mappings:
             src_uri = map.dst_to_src(dst_file)
             if (src_uri is not None):
+                if (self.uri_table is not None):
+                    src_uri = self.uri_table.intern(src_uri)
                 return(src_uri)
         # Must have failed if loop exited
         raise MapperError(
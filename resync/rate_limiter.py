@@ -0,0 +1,157 @@
+"""Per-host token bucket rate limiting for web requests.
+
+A RateLimiter keeps one TokenBucket for each host so that a delay set
+for one source does not slow requests to another. Each bucket refills
+at rate tokens per second up to burst tokens, and each request takes
+one token. A request that finds the bucket empty reserves the next
+token and waits for it, so concurrent callers are spaced out rather
+than all waking at once.
+
+The state of each bucket is updated under a lock but waiting happens
+outside it, so the same limiter can be shared by threads (acquire) and
+by coroutines (acquire_async) without blocking an event loop for longer
+than the wait itself.
+"""
+
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket(object):
+    """Token bucket for one host.
+
+    rate - tokens added per second, None for no limit
+
+    burst - maximum number of tokens held, and so the number of requests
+        that may be made back-to-back after a quiet period
+
+    Statistics on the waits imposed are kept in requests, waits,
+    wait_time and max_wait.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        """Initialize TokenBucket as full."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, burst=1):
+        """Change rate and burst, starting again from an empty bucket.
+
+        The bucket is emptied so that the first request after a change
+        is spaced from the previous one, rather than being let through
+        on the basis of tokens accumulated under the old settings.
+        """
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+            self.tokens = 0.0
+            self.last = time.monotonic()
+
+    def reserve(self):
+        """Take a token, return the number of seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests += 1
+            if (self.rate is None):
+                self.tokens = 0.0
+                self.last = now
+                return(0.0)
+            self.tokens = min(float(self.burst),
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1.0
+            if (self.tokens >= 0.0):
+                return(0.0)
+            # Negative tokens are reservations by earlier callers still waiting
+            wait = -self.tokens / self.rate
+            self.waits += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+            return(wait)
+
+    def acquire(self):
+        """Take a token, sleeping until it is available."""
+        wait = self.reserve()
+        if (wait > 0.0):
+            time.sleep(wait)
+        return(wait)
+
+    async def acquire_async(self):
+        """Take a token, awaiting asyncio.sleep until it is available."""
+        wait = self.reserve()
+        if (wait > 0.0):
+            await asyncio.sleep(wait)
+        return(wait)
+
+    def stats(self):
+        """Return dict of statistics for this bucket."""
+        with self._lock:
+            return({'requests': self.requests,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time,
+                    'max_wait': self.max_wait})
+
+
+class RateLimiter(object):
+    """Set of token buckets, one per host.
+
+    delay - minimum average interval in seconds between requests to any
+        one host, None for no limit
+
+    burst - number of requests that may be made to a host without delay
+        after a quiet period
+    """
+
+    def __init__(self, delay=None, burst=1):
+        """Initialize RateLimiter with no buckets."""
+        self.delay = delay
+        self.burst = burst
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """Tokens per second corresponding to self.delay, None for no limit."""
+        if (not self.delay):
+            return(None)
+        return(1.0 / self.delay)
+
+    def configure(self, delay=None, burst=1):
+        """Change delay and burst for all current and future buckets."""
+        with self._lock:
+            self.delay = delay
+            self.burst = burst
+            buckets = list(self.buckets.values())
+        for bucket in buckets:
+            bucket.configure(rate=self.rate, burst=burst)
+
+    def bucket(self, uri):
+        """Return the TokenBucket for the host of uri, creating if necessary."""
+        host = urlsplit(uri).netloc
+        with self._lock:
+            if (host not in self.buckets):
+                self.buckets[host] = TokenBucket(rate=self.rate, burst=self.burst)
+            return(self.buckets[host])
+
+    def acquire(self, uri):
+        """Wait as necessary before a request to uri."""
+        return(self.bucket(uri).acquire())
+
+    async def acquire_async(self, uri):
+        """Wait as necessary before a request to uri, asyncio version."""
+        return(await self.bucket(uri).acquire_async())
+
+    def stats(self):
+        """Return dict of host to statistics for that host."""
+        with self._lock:
+            buckets = dict(self.buckets)
+        return(dict((host, bucket.stats()) for host, bucket in buckets.items()))
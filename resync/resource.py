@@ -59,6 +59,11 @@ class Resource(object):
 
     CHANGE_TYPES = ['created', 'updated', 'deleted']
 
+    # Core attributes with plain slots, _extra is handled separately
+    CORE_ATTS = ('uri', 'timestamp', 'length', 'mime_type',
+                 'md5', 'sha1', 'sha256', 'change', 'ts_datetime',
+                 'path', 'ln')
+
     def __init__(self, uri=None, timestamp=None, length=None,
                  mime_type=None, md5=None, sha1=None, sha256=None,
                  change=None, ts_datetime=None, path=None, ln=None,
@@ -76,22 +81,15 @@ class Resource(object):
         Resource object. If explicit parameters are specified then they
         will override values copied from a Resource object supplied.
         """
-        # Initialize core attributes
-        self.uri = None
-        self.timestamp = None
-        self.length = None
-        self.mime_type = None
-        self.md5 = None
-        self.sha1 = None
-        self.sha256 = None
-        self.change = None
-        self.ts_datetime = None  # Added in ResourceSync v1.1
-        self.path = None
-        self.ln = None
-        self._extra = None
+        # Initialize core attributes, directly as None needs no checks
+        for att in Resource.CORE_ATTS:
+            object.__setattr__(self, att, None)
+        object.__setattr__(self, '_extra', None)
         # Create from a Resource-like object? Copy any attributes, both ones
         # that have slots and ones that live in _extra
-        if (resource is not None):
+        if (isinstance(resource, Resource)):
+            self._copy_from(resource)
+        elif (resource is not None):
             for att in ['uri', 'timestamp', 'length', 'mime_type',
                         'md5', 'sha1', 'sha256', 'change', 'ts_datetime', 'path', 'ln',
                         # the following in _extra
@@ -148,6 +146,56 @@ class Resource(object):
         if (self.uri is None):
             raise ValueError("Cannot create Resource without a URI")
 
+    @classmethod
+    def from_values(cls, uri, timestamp=None, length=None, mime_type=None,
+                    md5=None, sha1=None, sha256=None, change=None,
+                    ts_datetime=None, path=None):
+        """Create Resource from values for the core attributes.
+
+        A fast alternative to the general constructor for code that
+        creates many Resource objects, such as parsing and scanning disk.
+        Only the change value is checked.
+        """
+        if (uri is None):
+            raise ValueError("Cannot create Resource without a URI")
+        if (change is not None and Resource.CHANGE_TYPES
+                and change not in Resource.CHANGE_TYPES):
+            raise ChangeTypeError(change)
+        self = cls.__new__(cls)
+        setter = object.__setattr__
+        setter(self, 'uri', uri)
+        setter(self, 'timestamp', timestamp)
+        setter(self, 'length', length)
+        setter(self, 'mime_type', mime_type)
+        setter(self, 'md5', md5)
+        setter(self, 'sha1', sha1)
+        setter(self, 'sha256', sha256)
+        setter(self, 'change', change)
+        setter(self, 'ts_datetime', ts_datetime)
+        setter(self, 'path', path)
+        setter(self, 'ln', None)
+        setter(self, '_extra', None)
+        return(self)
+
+    def __copy__(self):
+        """Return a shallow copy of this Resource.
+
+        Values are shared with this Resource except that a new _extra dict
+        is created, as for Resource(resource=self).
+        """
+        cls = self.__class__
+        new = cls.__new__(cls)
+        new._copy_from(self)
+        return(new)
+
+    def _copy_from(self, resource):
+        # Copy all core and extra attributes from another Resource without
+        # going through __setattr__
+        for att in Resource.CORE_ATTS:
+            object.__setattr__(self, att, getattr(resource, att))
+        extra = resource._extra
+        object.__setattr__(self, '_extra', None if extra is None else dict(extra))
+
     def __setattr__(self, prop, value):
         """Attribute setter with check and support for extra attributes.
 
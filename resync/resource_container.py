@@ -30,6 +30,74 @@ def _str_datetime_now(x='now'):
         return x
 
 
+class CountedList(list):
+    """List of resources that counts modifications in its changes attribute.
+
+    Like ResourceListDict and ResourceListOrdered, the changes attribute
+    may be used to check whether anything derived from the resources,
+    such as the part boundaries of a sitemap, is still current. Changes
+    to the attributes of a resource already in the list are not counted.
+    """
+
+    changes = 0
+
+    def __setitem__(self, index, value):
+        self.changes += 1
+        super(CountedList, self).__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self.changes += 1
+        super(CountedList, self).__delitem__(index)
+
+    def __iadd__(self, other):
+        self.changes += 1
+        return(super(CountedList, self).__iadd__(other))
+
+    def __imul__(self, n):
+        self.changes += 1
+        return(super(CountedList, self).__imul__(n))
+
+    def append(self, resource):
+        """Add resource at the end."""
+        self.changes += 1
+        super(CountedList, self).append(resource)
+
+    def extend(self, resources):
+        """Add each of resources at the end."""
+        self.changes += 1
+        super(CountedList, self).extend(resources)
+
+    def insert(self, index, resource):
+        """Insert resource before index."""
+        self.changes += 1
+        super(CountedList, self).insert(index, resource)
+
+    def pop(self, *args):
+        """Remove and return resource at index, default last."""
+        self.changes += 1
+        return(super(CountedList, self).pop(*args))
+
+    def remove(self, resource):
+        """Remove first occurrence of resource."""
+        self.changes += 1
+        super(CountedList, self).remove(resource)
+
+    def clear(self):
+        """Remove all resources."""
+        self.changes += 1
+        super(CountedList, self).clear()
+
+    def sort(self, *args, **kwargs):
+        """Sort resources in place."""
+        self.changes += 1
+        super(CountedList, self).sort(*args, **kwargs)
+
+    def reverse(self):
+        """Reverse order of resources in place."""
+        self.changes += 1
+        super(CountedList, self).reverse()
+
+
 class ResourceContainer(object):
     """Class containing resource-like objects.
 
@@ -214,27 +282,26 @@ class ResourceContainer(object):
         Returns the number of entries removed. Also removes all entries for a
         given URI where the first entry is a create and the last entry is a
         delete.
+
+        One pass records the first change and last position for each URI,
+        a second compacts the list in place keeping the entries that are
+        both the last for their URI and not cancelled.
         """
-        n = 0
-        pruned1 = []
-        seen = set()
-        deletes = {}
-        for r in reversed(self.resources):
-            if (r.uri in seen):
-                n += 1
-                if (r.uri in deletes):
-                    deletes[r.uri] = r.change
-            else:
-                pruned1.append(r)
-                seen.add(r.uri)
-                if (r.change == 'deleted'):
-                    deletes[r.uri] = r.change
-        # go through all deletes and prune if first was create
-        pruned2 = []
-        for r in reversed(pruned1):
-            if (r.uri in deletes and deletes[r.uri] == 'created'):
-                n += 1
+        if (not isinstance(self.resources, list)):
+            self.resources = list(self.resources)
+        resources = self.resources
+        first_and_last = {}  # uri -> [first change, index of last entry]
+        for (j, r) in enumerate(resources):
+            if (r.uri in first_and_last):
+                first_and_last[r.uri][1] = j
             else:
-                pruned2.append(r)
-        self.resources = pruned2
+                first_and_last[r.uri] = [r.change, j]
+        kept = 0
+        for (j, r) in enumerate(resources):
+            (first_change, last_j) = first_and_last[r.uri]
+            if (j == last_j and not (r.change == 'deleted' and first_change == 'created')):
+                resources[kept] = r
+                kept += 1
+        n = len(resources) - kept
+        del resources[kept:]
         return(n)
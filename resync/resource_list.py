@@ -45,22 +45,93 @@ class SortedIterMixin(object):
             return None
 
 
-class ResourceListDict(dict, SortedIterMixin):
+class UriIndexMixin(object):
+    """Mixin to keep a list of URIs in iteration order for random access.
+
+    The list is built when first needed and rebuilt only after the dict
+    has been changed, so that resource_slice(...) can pick out any range
+    of resources without iterating from the start. The changes attribute
+    counts modifications and may be used to check whether anything
+    derived from the resources is still current.
+    """
+
+    changes = 0
+    _uri_index = None
+    _uri_index_changes = -1
+
+    def uri_index(self):
+        """List of URIs in iteration order, must not be modified."""
+        if (self._uri_index_changes != self.changes):
+            self._uri_index = self._build_uri_index()
+            self._uri_index_changes = self.changes
+        return(self._uri_index)
+
+    def resource_slice(self, start, stop):
+        """List of resources from position start up to stop in iteration order."""
+        return([self[uri] for uri in self.uri_index()[start:stop]])
+
+    def _build_uri_index(self):
+        return(list(self.keys()))
+
+    def __setitem__(self, key, value):
+        self.changes += 1
+        super(UriIndexMixin, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.changes += 1
+        super(UriIndexMixin, self).__delitem__(key)
+
+    def clear(self):
+        """Remove all resources."""
+        self.changes += 1
+        super(UriIndexMixin, self).clear()
+
+    def pop(self, *args):
+        """Remove resource with given URI and return it."""
+        self.changes += 1
+        return(super(UriIndexMixin, self).pop(*args))
+
+    def popitem(self, *args):
+        """Remove and return a (uri, resource) pair."""
+        self.changes += 1
+        return(super(UriIndexMixin, self).popitem(*args))
+
+    def setdefault(self, *args):
+        """Return resource for URI, adding default if not present."""
+        self.changes += 1
+        return(super(UriIndexMixin, self).setdefault(*args))
+
+    def update(self, *args, **kwargs):
+        """Add resources from another dict or iterable of (uri, resource) pairs."""
+        self.changes += 1
+        super(UriIndexMixin, self).update(*args, **kwargs)
+
+
+class ResourceListDict(UriIndexMixin, dict, SortedIterMixin):
     """Default implementation of class to store resources in ResourceList.
 
     Key properties of this class are:
     - has add(resource) method
     - is iterable and gives resources (not keys) in alphanumeric order by
       resource.uri
+    - keeps the sorted list of URIs between changes so that repeated
+      iteration and resource_slice(...) do not sort again
     """
 
     def __iter__(self):
         """Iterator over all the resources in this ResourceListDict."""
         return self.sorted_iter()
 
+    def sorted_iter(self):
+        """Iterator over all the resources in this dict by sorted key order."""
+        return(self[uri] for uri in self.uri_index())
+
     def uris(self):
         """Extract sorted list of URIs for resources in this ResourceListDict."""
-        return sorted(self.keys())
+        return list(self.uri_index())
+
+    def _build_uri_index(self):
+        return(sorted(self.keys()))
 
     def add(self, resource, replace=False):
         """Add just a single resource."""
@@ -71,7 +142,7 @@ class ResourceListDict(dict, SortedIterMixin):
         self[uri] = resource
 
 
-class ResourceListOrdered(OrderedDict, SortedIterMixin):
+class ResourceListOrdered(UriIndexMixin, OrderedDict, SortedIterMixin):
     """Alternative implementation of class to store resources in ResourceList.
 
     Key properties of this class are:
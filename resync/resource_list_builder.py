@@ -82,6 +82,10 @@ class ResourceListBuilder():
                 return True
         return False
 
+    def is_excluded(self, name):
+        """True if file or directory name matches one of the exclude patterns."""
+        return(self._exclude(name))
+
     def from_disk(self, resource_list=None, paths=None):
         """Create or extend resource_list with resources from disk scan.
 
@@ -178,9 +182,8 @@ class ResourceListBuilder():
             self.logger.warning("Ignoring file '%s' (error: %s)" % (file, str(e)))
             return
         timestamp = file_stat.st_mtime  # UTC
-        r = Resource(uri=uri, timestamp=timestamp)
-        if self.set_path:  # add full local path
-            r.path = file
+        r = Resource.from_values(uri, timestamp=timestamp,
+                                 path=(file if self.set_path else None))
         if self.set_hashes:  # add any hashes requested
             Hashes(self.set_hashes, file).set(r)
         if self.set_length:  # add length
@@ -0,0 +1,210 @@
+"""Retry and backoff policy for web requests made by the client.
+
+The client makes many requests to a source and must cope both with
+transient failures (timeouts, dropped connections, 5xx responses) and
+with a source that asks it to slow down (429 Too Many Requests or 503
+Service Unavailable, perhaps with a Retry-After header). The RetryPolicy
+class decides whether a failed request should be retried, how long to
+wait before the next try, and keeps adaptive per-host state so that the
+delay between requests and the number of requests in flight back off
+when a source is throttling and recover when it is not.
+"""
+
+import datetime
+import email.utils
+import logging
+import random
+import socket
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+
+class HostThrottle(object):
+    """Adaptive delay and concurrency state for requests to one host.
+
+    Uses additive increase, multiplicative decrease (AIMD) in the manner of
+    TCP congestion control:
+      - on success the delay between requests is reduced by delay_step
+        (additive) and, after a full window of successes, the number of
+        requests permitted in flight (concurrency) is increased by one
+      - when throttled the delay is doubled (multiplicative, starting at
+        delay_step) and the concurrency is halved
+
+    The synchronous Client makes one request at a time and so uses only
+    the delay, the concurrency is provided for concurrent engines.
+    """
+
+    def __init__(self, min_delay=0.0, max_delay=60.0, delay_step=0.5,
+                 max_concurrency=8):
+        """Initialize HostThrottle with no delay and concurrency 1."""
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.max_concurrency = max_concurrency
+        self.delay = min_delay
+        self.concurrency = 1
+        self.successes = 0
+        self.throttles = 0
+        self._window = 0
+
+    def record_success(self):
+        """Additive recovery after a successful request."""
+        self.successes += 1
+        self.delay = max(self.min_delay, self.delay - self.delay_step)
+        self._window += 1
+        if (self._window >= self.concurrency):
+            self._window = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def record_throttle(self):
+        """Multiplicative backoff after the host asked us to slow down."""
+        self.throttles += 1
+        self.delay = min(self.max_delay, max(self.delay * 2, self.delay_step))
+        self.concurrency = max(1, self.concurrency // 2)
+        self._window = 0
+
+
+class RetryPolicy(object):
+    """Policy for retries with exponential backoff and jitter.
+
+    tries - maximum number of attempts for a request (including the first)
+        that times out or has its connection dropped
+
+    status_tries - maximum number of attempts for a request that gets an
+        HTTP response with a status in RETRY_STATUS_CODES, kept small so
+        that a sync against a broken source fails in reasonable time
+
+    backoff_base - backoff in seconds before the first retry, doubled for
+        each subsequent retry
+
+    backoff_max - upper limit on the backoff computed for a retry
+
+    jitter - if True use "full jitter", a random wait between zero and the
+        computed backoff, so that many clients do not retry in lockstep
+
+    max_retry_after - upper limit on any wait requested by the source in a
+        Retry-After header, which otherwise takes precedence over backoff
+
+    adaptive - if True keep per-host HostThrottle state that adds a delay
+        before each request to a host that has recently throttled us
+
+    Failures that are retried are timeouts, connection errors, and HTTP
+    responses with a status in RETRY_STATUS_CODES. Other errors such as
+    404 Not Found or connection refused to a local file are not retried.
+    """
+
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    THROTTLE_STATUS_CODES = (429, 503)
+
+    def __init__(self, tries=20, status_tries=3, backoff_base=1.0, backoff_max=10.0,
+                 jitter=True, max_retry_after=60.0, adaptive=True,
+                 max_concurrency=8):
+        """Initialize RetryPolicy with default settings."""
+        self.tries = tries
+        self.status_tries = status_tries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.adaptive = adaptive
+        self.max_concurrency = max_concurrency
+        self.sleep = time.sleep  # override to test without waiting
+        self.hosts = {}
+        self.logger = logging.getLogger('resync.retry_policy')
+        self._lock = threading.Lock()
+
+    def host_throttle(self, uri):
+        """Return the HostThrottle object for the host of uri."""
+        host = urlsplit(uri).netloc
+        with self._lock:
+            if (host not in self.hosts):
+                self.hosts[host] = HostThrottle(max_delay=self.backoff_max,
+                                                max_concurrency=self.max_concurrency)
+            return(self.hosts[host])
+
+    def is_throttle(self, exception):
+        """True if exception is a response asking us to slow down."""
+        return(isinstance(exception, HTTPError)
+               and exception.code in self.THROTTLE_STATUS_CODES)
+
+    def is_retryable(self, exception):
+        """True if the request that raised exception is worth retrying."""
+        if (isinstance(exception, HTTPError)):
+            return(exception.code in self.RETRY_STATUS_CODES)
+        if (isinstance(exception, URLError)):
+            # urlopen wraps connection problems, look at the underlying reason
+            exception = exception.reason
+        return(isinstance(exception, (socket.timeout, ConnectionResetError,
+                                      ConnectionAbortedError)))
+
+    def tries_for(self, exception):
+        """Maximum number of tries for a request that failed with exception."""
+        if (isinstance(exception, HTTPError)):
+            return(min(self.tries, self.status_tries))
+        return(self.tries)
+
+    def retry_after(self, exception):
+        """Seconds to wait from any Retry-After header in exception, else None.
+
+        The header value may be either a number of seconds or an HTTP-date.
+        """
+        headers = getattr(exception, 'headers', None)
+        if (headers is None):
+            return(None)
+        value = headers.get('Retry-After')
+        if (value is None):
+            return(None)
+        value = value.strip()
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                self.logger.info("Ignoring bad Retry-After header '%s'" % (value))
+                return(None)
+            if (when.tzinfo is None):
+                when = when.replace(tzinfo=datetime.timezone.utc)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            seconds = (when - now).total_seconds()
+        return(min(max(0.0, seconds), self.max_retry_after))
+
+    def backoff(self, try_i, exception=None):
+        """Seconds to wait after failed try number try_i (starting at 1).
+
+        A Retry-After value from the source takes precedence, otherwise
+        exponential backoff capped at self.backoff_max, with jitter.
+        """
+        seconds = self.retry_after(exception)
+        if (seconds is not None):
+            return(seconds)
+        seconds = min(self.backoff_max, self.backoff_base * (2 ** (try_i - 1)))
+        if (self.jitter):
+            seconds = random.uniform(0, seconds)
+        return(seconds)
+
+    def wait_before_request(self, uri):
+        """Sleep for any adaptive delay currently applied to the host of uri."""
+        if (not self.adaptive):
+            return
+        delay = self.host_throttle(uri).delay
+        if (delay > 0):
+            self.sleep(delay)
+
+    def record_success(self, uri):
+        """Record successful request to uri."""
+        if (self.adaptive):
+            throttle = self.host_throttle(uri)
+            with self._lock:
+                throttle.record_success()
+
+    def record_failure(self, uri, exception):
+        """Record failed request to uri, backing off if throttled."""
+        if (self.adaptive and self.is_throttle(exception)):
+            throttle = self.host_throttle(uri)
+            with self._lock:
+                throttle.record_throttle()
+            self.logger.info("Throttled by %s, delay now %.1fs with concurrency %d" %
+                             (urlsplit(uri).netloc, throttle.delay, throttle.concurrency))
@@ -75,14 +75,18 @@ class Sitemap(object):
             if no specific lastmod is specified. Applies only when spec_version
             '1.1' is selected, provide compatibility with systems that do not
             understand datetime but instead rely on lastmod
+        uri_table - UriTable used to share the URI strings of resources parsed
+            with other lists, None to not share
     """
 
-    def __init__(self, pretty_xml=False, spec_version='1.1', add_lastmod=False):
+    def __init__(self, pretty_xml=False, spec_version='1.1', add_lastmod=False,
+                 uri_table=None):
         """Initialize Sitemap object."""
         self.logger = logging.getLogger('resync.sitemap')
         self.pretty_xml = pretty_xml
         self.spec_1_0 = (spec_version == '1.0')  # v1.0 else assume v1.1
         self.add_lastmod = add_lastmod  # Optional in v1.1
+        self.uri_table = uri_table
         # Classes used when parsing
         self.resource_class = Resource
         # Information recorded for logging
@@ -114,21 +118,8 @@ class Sitemap(object):
         - sitemapindex - set True to write sitemapindex instead of sitemap
         - fh - write to filehandle fh instead of returning string
         """
-        # element names depending on sitemapindex or not
-        root_element = ('sitemapindex' if (sitemapindex) else 'urlset')
         item_element = ('sitemap' if (sitemapindex) else 'url')
-        # namespaces and other settings
-        namespaces = {'xmlns': SITEMAP_NS, 'xmlns:rs': RS_NS}
-        root = Element(root_element, namespaces)
-        if (self.pretty_xml):
-            root.text = "\n"
-        # <rs:ln>
-        if (hasattr(resources, 'ln')):
-            for ln in resources.ln:
-                self.add_element_with_atts_to_etree(root, 'rs:ln', ln)
-        # <rs:md>
-        if (hasattr(resources, 'md')):
-            self.add_element_with_atts_to_etree(root, 'rs:md', resources.md)
+        root = self.root_etree_element(resources, sitemapindex)
         # <url> entries from either an iterable or an iterator
         for r in resources:
             e = self.resource_etree_element(r, element_name=item_element)
@@ -147,6 +138,39 @@ class Sitemap(object):
         if (xml_buf is not None):
             return(xml_buf.getvalue())
 
+    def root_etree_element(self, resources, sitemapindex=False):
+        """Return root Element for resources with any <rs:ln> and <rs:md>."""
+        # element names depending on sitemapindex or not
+        root_element = ('sitemapindex' if (sitemapindex) else 'urlset')
+        # namespaces and other settings
+        namespaces = {'xmlns': SITEMAP_NS, 'xmlns:rs': RS_NS}
+        root = Element(root_element, namespaces)
+        if (self.pretty_xml):
+            root.text = "\n"
+        # <rs:ln>
+        if (hasattr(resources, 'ln')):
+            for ln in resources.ln:
+                self.add_element_with_atts_to_etree(root, 'rs:ln', ln)
+        # <rs:md>
+        if (hasattr(resources, 'md')):
+            self.add_element_with_atts_to_etree(root, 'rs:md', resources.md)
+        return(root)
+
+    def xml_head_and_tail(self, resources, sitemapindex=False):
+        """Return (head, tail) strings of XML that go around entries for resources.
+
+        head + resource_as_xml(r) for each resource + tail is the same as
+        resources_as_xml(resources), but allows the entries to be
+        serialized (and their size known) one at a time.
+        """
+        root = self.root_etree_element(resources, sitemapindex)
+        root.append(Element('entries'))
+        xml_buf = io.StringIO()
+        ElementTree(root).write(xml_buf, encoding='unicode',
+                                xml_declaration=True, method='xml')
+        (head, tail) = xml_buf.getvalue().split('<entries />')
+        return(head, tail)
+
     # Read/parse an XML sitemap or sitemapindex
 
     def parse_xml(self, fh=None, etree=None, resources=None,
@@ -283,14 +307,14 @@ class Sitemap(object):
             e.tail = "\n"
         return(e)
 
-    def resource_as_xml(self, resource):
+    def resource_as_xml(self, resource, element_name='url'):
         """Return string for the resource as part of an XML sitemap.
 
         Returns a string with the XML snippet representing the resource,
         without any XML declaration. (So much simpler now only Python 3.x
         supported, see earlier versions for 2.6, 2.7 etc.)
         """
-        e = self.resource_etree_element(resource)
+        e = self.resource_etree_element(resource, element_name=element_name)
         return(tostring(e, encoding='unicode', method='xml'))
 
     def resource_from_etree(self, etree, resource_class):
@@ -321,8 +345,12 @@ class Sitemap(object):
         if (loc is None or loc == ''):
             raise SitemapParseError(
                 "Bad <loc> element with no content while parsing <url> in sitemap")
-        # must at least have a URI, make this object
-        resource = resource_class(uri=loc)
+        if (self.uri_table is not None):
+            loc = self.uri_table.intern(loc)
+        # must at least have a URI, make this object, quickly if the class
+        # supports it (Resource and subclasses)
+        from_values = getattr(resource_class, 'from_values', None)
+        resource = (from_values(loc) if from_values is not None else resource_class(uri=loc))
         # and hopefully a lastmod datetime (but none is OK)
         lastmod_elements = etree.findall('{' + SITEMAP_NS + "}lastmod")
         if (len(lastmod_elements) > 1):
@@ -339,7 +367,8 @@ class Sitemap(object):
             # have on element, look at attributes
             md = self.md_from_etree(md_elements[0], context=loc)
             # simple attributes that map directly to Resource object attributes
-            for att in ('capability', 'change', 'datetime', 'length', 'path', 'mime_type'):
+            for att in ('capability', 'change', 'datetime', 'length', 'path', 'mime_type',
+                        'md_at', 'md_completed', 'md_from', 'md_until'):
                 if (att in md):
                     setattr(resource, att, md[att])
             # The ResourceSync beta spec lists md5, sha-1 and sha-256 fixity
@@ -0,0 +1,418 @@
+"""Server for ResourceSync documents generated on request.
+
+Instead of writing sitemap files with resync-build, a source may serve
+its Source Description, Capability List and lists from objects held in
+memory. Large lists are served as a sitemapindex and component sitemaps
+generated with as_xml_index() and as_xml_part():
+
+       rl = ResourceList()
+       ...
+       app = SourceServer('http://example.org/rs/', resource_list=rl)
+
+app is a WSGI application, for example for wsgiref.simple_server, and
+app.asgi is the same as an ASGI application. The documents served are:
+
+       /.well-known/resourcesync      Source Description
+       /rs/capabilitylist.xml         Capability List
+       /rs/resourcelist.xml           Resource List or Resource List Index
+       /rs/resourcelist00000.xml ...  Component Resource Lists
+
+and likewise for a Change List or any other list added with add_list().
+A component sitemap requested with the name ending .xml.gz, as listed in
+the index when gzip_components is set, is served gzipped. Each document
+has an ETag, conditional requests with If-None-Match and If-Match are
+supported, and a single byte range may be requested with Range and
+If-Range. The XML for each document is kept until the list it comes from
+changes, see ListBaseWithIndex.part_starts_key(), except for lists whose
+changes cannot be detected that way which are serialized for each request.
+At most max_cache_bytes of documents are kept, least recently used first
+to go.
+"""
+
+import asyncio
+from collections import OrderedDict
+import copy
+import gzip
+import hashlib
+from http import HTTPStatus
+import io
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+from .capability_list import CapabilityList
+from .list_base_with_index import ListBaseIndexError
+from .resource_list import ResourceList
+from .source_description import SourceDescription
+
+WELL_KNOWN_PATH = '/.well-known/resourcesync'
+XML_CONTENT_TYPE = 'application/xml'
+GZIP_CONTENT_TYPE = 'application/gzip'
+
+
+class ListFileLoader(object):
+    """Callable that returns a list read from a sitemap file on disk.
+
+    The file is read again only when its modification time changes, so
+    an instance can be given to SourceServer.add_list() to serve a list
+    that is rewritten by another process. mapper is used to find the
+    component sitemaps of a sitemapindex.
+    """
+
+    def __init__(self, path, list_class=ResourceList, mapper=None):
+        """Initialize ListFileLoader for sitemap file path."""
+        self.path = path
+        self.list_class = list_class
+        self.mapper = mapper
+        self.mtime = None
+        self.list = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        """Return the list, reading it if the file has changed."""
+        with self.lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if (self.list is None or mtime != self.mtime):
+                lst = (self.list_class() if self.mapper is None
+                       else self.list_class(mapper=self.mapper))
+                lst.read(uri=self.path)
+                (self.list, self.mtime) = (lst, mtime)
+            return(self.list)
+
+
+class Response(object):
+    """Status, headers and body of a response from SourceServer."""
+
+    def __init__(self, status, headers=None, body=b''):
+        """Initialize Response with status code, list of headers and body bytes."""
+        self.status = status
+        self.headers = headers or []
+        self.body = body
+
+    @property
+    def status_line(self):
+        """HTTP status line, e.g. '200 OK'."""
+        return("%d %s" % (self.status, HTTPStatus(self.status).phrase))
+
+    def header(self, name):
+        """Return value of header name, or None."""
+        name = name.lower()
+        for (k, v) in self.headers:
+            if (k.lower() == name):
+                return(v)
+        return(None)
+
+
+class SourceServer(object):
+    """WSGI and ASGI application serving ResourceSync documents.
+
+    base_uri - URI of the directory in which the capability list and lists
+        are served, the Source Description is always at the root
+
+    resource_list, change_list - lists to serve, more may be added with
+        add_list()
+
+    max_sitemap_entries - if not None then used as the max_sitemap_entries
+        of each list served, so that large lists are served as component
+        sitemaps
+
+    max_cache_bytes - limit on the total size of the documents kept
+    """
+
+    def __init__(self, base_uri, resource_list=None, change_list=None,
+                 max_sitemap_entries=None, max_cache_bytes=64 * 1024 * 1024):
+        """Initialize SourceServer."""
+        if (not base_uri.endswith('/')):
+            base_uri += '/'
+        self.base_uri = base_uri
+        self.base_path = urlsplit(base_uri).path or '/'
+        self.max_sitemap_entries = max_sitemap_entries
+        self.max_cache_bytes = max_cache_bytes
+        self.lists = OrderedDict()     # name -> list or callable
+        self.views = {}                # name -> (list, copy of list as served)
+        self.cache = OrderedDict()     # path -> (list, key, etag, body, content_type)
+        self.cache_bytes = 0           # total size of bodies in self.cache
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('resync.source_server')
+        if (resource_list is not None):
+            self.add_list(resource_list)
+        if (change_list is not None):
+            self.add_list(change_list)
+
+    def add_list(self, lst, name=None):
+        """Add list lst to be served as name in base_uri.
+
+        lst is a ListBaseWithIndex object, such as a ResourceList or
+        ChangeList, or a callable that returns one when called for each
+        request (e.g. a ListFileLoader). name defaults to the capability
+        name with .xml appended.
+        """
+        if (name is None):
+            name = self.get_list(lst).capability_name + '.xml'
+        self.lists[name] = lst
+
+    def get_list(self, lst):
+        """Return list object from lst, calling it if it is a callable."""
+        if (callable(lst)):
+            lst = lst()
+        return(lst)
+
+    def served_list(self, name):
+        """Return (list, copy) for the list served as name, the copy set up to be served.
+
+        max_sitemap_entries and the up link are set on a copy so that the
+        list added, which the application may also write or change, is
+        not altered. The copy shares the resources of the list and takes
+        its other settings afresh for each request, but is kept while the
+        list is the same object so that the part boundaries found for it
+        are reused.
+        """
+        lst = self.get_list(self.lists[name])
+        with self.lock:
+            (orig, view) = self.views.get(name, (None, None))
+            if (orig is not lst):
+                view = copy.copy(lst)
+                self.views[name] = (lst, view)
+        part_starts = view._part_starts
+        view.__dict__.update(lst.__dict__)
+        view._part_starts = part_starts
+        view.ln = copy.deepcopy(lst.ln)
+        if (self.max_sitemap_entries is not None):
+            view.max_sitemap_entries = self.max_sitemap_entries
+        if (view.up is None):
+            view.up = self.base_uri + 'capabilitylist.xml'
+        return(lst, view)
+
+    # Documents
+
+    def source_description_xml(self):
+        """Return XML of the Source Description."""
+        sd = SourceDescription()
+        sd.add_capability_list(self.base_uri + 'capabilitylist.xml')
+        return(sd.as_xml())
+
+    def capability_list_xml(self):
+        """Return XML of the Capability List for the lists served."""
+        caps = CapabilityList()
+        caps.up = urlsplit(self.base_uri)._replace(path=WELL_KNOWN_PATH).geturl()
+        for (name, lst) in self.lists.items():
+            caps.add_capability(uri=self.base_uri + name,
+                                name=self.get_list(lst).capability_name)
+        return(caps.as_xml())
+
+    def document(self, path):
+        """Return (etag, body, content_type) for the document at path, or None.
+
+        The XML of lists is cached using a key from part_starts_key() so
+        that it is regenerated only when the list changes, there is no
+        cache for a list without a key. The Source Description and
+        Capability List are small and generated each time.
+        """
+        if (path == WELL_KNOWN_PATH):
+            return(self.etag_and_body(self.source_description_xml()))
+        if (not path.startswith(self.base_path)):
+            return(None)
+        name = path[len(self.base_path):]
+        if (name == 'capabilitylist.xml'):
+            return(self.etag_and_body(self.capability_list_xml()))
+        for list_name in list(self.lists):
+            part_number = self.match_list(list_name, name)
+            if (part_number is False):
+                continue
+            (orig, lst) = self.served_list(list_name)
+            key = lst.part_starts_key()
+            if (key is not None):
+                cached = self.cache_get(path)
+                if (cached is not None and cached[0] is orig and cached[1] == key):
+                    return(cached[2:])
+            try:
+                if (part_number is None):
+                    xml = lst.as_xml(allow_multifile=True, basename=self.base_uri + list_name)
+                else:
+                    xml = lst.as_xml_part(basename=self.base_uri + list_name,
+                                          part_number=part_number)
+            except ListBaseIndexError as e:
+                self.logger.info("No document at %s (%s)" % (path, str(e)))
+                return(None)
+            doc = self.etag_and_body(xml, gzipped=name.endswith('.gz'))
+            if (key is not None):
+                self.cache_put(path, (orig, key) + doc)
+            return(doc)
+        return(None)
+
+    def cache_get(self, path):
+        """Return cache entry for path, or None, marking it as recently used."""
+        with self.lock:
+            entry = self.cache.get(path)
+            if (entry is not None):
+                self.cache.move_to_end(path)
+            return(entry)
+
+    def cache_put(self, path, entry):
+        """Add entry (list, key, etag, body, content_type) for path to the cache.
+
+        Least recently used entries are removed to keep the total size of
+        bodies within self.max_cache_bytes, a body larger than that is
+        not kept.
+        """
+        size = len(entry[3])
+        with self.lock:
+            old = self.cache.pop(path, None)
+            if (old is not None):
+                self.cache_bytes -= len(old[3])
+            if (size > self.max_cache_bytes):
+                return
+            self.cache[path] = entry
+            self.cache_bytes += size
+            while (self.cache_bytes > self.max_cache_bytes):
+                (_, old) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(old[3])
+
+    def match_list(self, list_name, name):
+        """Return None if name is list_name, the part number if a component, else False."""
+        if (name == list_name):
+            return(None)
+        if (list_name.endswith('.xml')):
+            m = re.match(re.escape(list_name[:-4]) + r'(\d{5})\.xml(\.gz)?$', name)
+            if (m):
+                return(int(m.group(1)))
+        return(False)
+
+    def etag_and_body(self, xml, gzipped=False):
+        """Return (etag, body, content_type) for the XML string xml.
+
+        If gzipped is set then the body is gzipped, with no timestamp so
+        that the same XML always gives the same body and ETag.
+        """
+        body = xml.encode('utf-8')
+        content_type = XML_CONTENT_TYPE
+        if (gzipped):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fh:
+                fh.write(body)
+            (body, content_type) = (buf.getvalue(), GZIP_CONTENT_TYPE)
+        return('"%s"' % (hashlib.sha1(body).hexdigest()), body, content_type)
+
+    # HTTP
+
+    def respond(self, method, path, headers=None):
+        """Return Response to request with method for path.
+
+        headers is a dict of request headers with lower case names.
+        """
+        headers = headers or {}
+        if (method not in ('GET', 'HEAD')):
+            return(Response(405, [('Allow', 'GET, HEAD'), ('Content-Type', 'text/plain'),
+                                  ('Content-Length', '0')]))
+        doc = self.document(path)
+        if (doc is None):
+            return(Response(404, [('Content-Type', 'text/plain'), ('Content-Length', '9')],
+                            b'' if method == 'HEAD' else b'Not Found'))
+        (etag, body, content_type) = doc
+        resp_headers = [('ETag', etag), ('Accept-Ranges', 'bytes')]
+        if_match = headers.get('if-match')
+        if (if_match is not None and not etag_matches(if_match, etag, weak=False)):
+            return(Response(412, resp_headers + [('Content-Type', 'text/plain'),
+                                                 ('Content-Length', '0')]))
+        if_none_match = headers.get('if-none-match')
+        if (if_none_match is not None and etag_matches(if_none_match, etag)):
+            return(Response(304, resp_headers))
+        resp_headers.append(('Content-Type', content_type))
+        status = 200
+        byte_range = headers.get('range')
+        if_range = headers.get('if-range')
+        if (method == 'GET' and byte_range is not None
+                and (if_range is None or if_range.strip() == etag)):
+            r = parse_range(byte_range, len(body))
+            if (r is False):
+                return(Response(416, resp_headers[0:2] + [('Content-Type', 'text/plain'),
+                                                          ('Content-Range', 'bytes */%d' % len(body)),
+                                                          ('Content-Length', '0')]))
+            if (r is not None):
+                (start, end) = r
+                resp_headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, len(body))))
+                body = body[start:end + 1]
+                status = 206
+        resp_headers.append(('Content-Length', str(len(body))))
+        return(Response(status, resp_headers, b'' if method == 'HEAD' else body))
+
+    def __call__(self, environ, start_response):
+        """WSGI application."""
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        headers = {}
+        for (k, v) in environ.items():
+            if (k.startswith('HTTP_')):
+                headers[k[5:].replace('_', '-').lower()] = v
+        response = self.respond(environ.get('REQUEST_METHOD', 'GET'), path or '/', headers)
+        start_response(response.status_line, response.headers)
+        return([response.body])
+
+    async def asgi(self, scope, receive, send):
+        """ASGI application, the response is generated in a thread."""
+        if (scope['type'] == 'lifespan'):
+            while True:
+                message = await receive()
+                if (message['type'] == 'lifespan.startup'):
+                    await send({'type': 'lifespan.startup.complete'})
+                elif (message['type'] == 'lifespan.shutdown'):
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if (scope['type'] != 'http'):
+            return
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1'))
+                       for (k, v) in scope.get('headers', []))
+        path = scope.get('root_path', '') + scope['path']
+        # get_running_loop() is new in Python 3.7
+        loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+        response = await loop.run_in_executor(None, self.respond, scope['method'], path, headers)
+        await send({'type': 'http.response.start',
+                    'status': response.status,
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                for (k, v) in response.headers]})
+        await send({'type': 'http.response.body', 'body': response.body})
+
+
+def etag_matches(header, etag, weak=True):
+    """True if etag matches an entity tag in If-Match or If-None-Match header.
+
+    With weak set, W/ prefixes are ignored for the weak comparison used
+    by If-None-Match, else only a strong match counts.
+    """
+    if (header.strip() == '*'):
+        return(True)
+    for tag in header.split(','):
+        tag = tag.strip()
+        if (tag.startswith('W/')):
+            if (not weak):
+                continue
+            tag = tag[2:]
+        if (tag == etag):
+            return(True)
+    return(False)
+
+
+def parse_range(header, length):
+    """Parse Range header for a body of length bytes.
+
+    Returns (start, end) of a single satisfiable byte range, inclusive,
+    False if the range cannot be satisfied, or None if the header is not
+    a single byte range and so should be ignored.
+    """
+    m = re.match(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', header)
+    if (not m or (m.group(1) == '' and m.group(2) == '')):
+        return(None)
+    if (m.group(1) == ''):
+        # Suffix range, last n bytes
+        n = int(m.group(2))
+        if (n == 0 or length == 0):
+            return(False)
+        return(max(0, length - n), length - 1)
+    start = int(m.group(1))
+    end = length - 1 if m.group(2) == '' else int(m.group(2))
+    if (start >= length):
+        return(False)
+    if (end < start):
+        return(None)
+    return(start, min(end, length - 1))
@@ -0,0 +1,271 @@
+"""Sequential reader for ZIP files from a stream.
+
+The central directory of a ZIP file is at the end, so zipfile.ZipFile
+needs the whole file before any member can be read. The local file header
+before each member also gives its name, compression and (usually) sizes,
+so a file written sequentially can be read sequentially as it arrives:
+
+       for member in StreamingZipReader(fh):
+           data = member.read()
+
+Each member must be read before moving on to the next, any unread data
+is skipped. Members are checked against the CRC-32 in the header as they
+are read. Members that are stored with a data descriptor (sizes given
+after the data) cannot be read, but such deflated members can.
+"""
+
+import struct
+import zlib
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+CENTRAL_HEADER_SIGNATURE = b'PK\x01\x02'
+END_SIGNATURE = b'PK\x05\x06'
+ZIP64_END_SIGNATURE = b'PK\x06\x06'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+FLAG_ENCRYPTED = 0x01
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+
+class StreamingZipError(Exception):
+    """Error reading ZIP file from stream."""
+
+    pass
+
+
+class StreamBuffer(object):
+    """Wrapper for a file-like object allowing exact reads and unreading."""
+
+    def __init__(self, fh):
+        """Initialize StreamBuffer reading from fh."""
+        self.fh = fh
+        self.pending = b''
+        self.bytes_read = 0
+
+    def read(self, size):
+        """Read up to size bytes, may return fewer before end of stream."""
+        if (self.pending):
+            data = self.pending[:size]
+            self.pending = self.pending[size:]
+        else:
+            data = self.fh.read(size)
+        self.bytes_read += len(data)
+        return(data)
+
+    def read_exact(self, size):
+        """Read exactly size bytes, raise StreamingZipError at end of stream."""
+        parts = []
+        while (size > 0):
+            data = self.read(size)
+            if (not data):
+                raise StreamingZipError("Unexpected end of ZIP stream")
+            parts.append(data)
+            size -= len(data)
+        return(b''.join(parts))
+
+    def unread(self, data):
+        """Push data back to be read again."""
+        self.pending = data + self.pending
+        self.bytes_read -= len(data)
+
+
+class StreamingZipMember(object):
+    """One member of a ZIP file being read from a stream.
+
+    Attributes filename, compress_type, CRC, file_size and compress_size are
+    taken from the local file header. With a data descriptor the sizes are
+    None until the member has been read.
+    """
+
+    def __init__(self, buf, filename, flags, compress_type, crc,
+                 compress_size, file_size, zip64=False):
+        """Initialize member reading data from StreamBuffer buf."""
+        self.buf = buf
+        self.filename = filename
+        self.flags = flags
+        self.compress_type = compress_type
+        self.CRC = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.zip64 = zip64
+        self.has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        self.remaining = (None if self.has_descriptor else compress_size)
+        self.decompressor = (zlib.decompressobj(-15)
+                             if compress_type == ZIP_DEFLATED else None)
+        self.crc = 0
+        self.size = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        """Read up to size bytes of uncompressed data, all if size < 0.
+
+        May return fewer than size bytes before the end of the member.
+        Returns b'' at end of member, after checking the CRC and size.
+        """
+        if (size is None or size < 0):
+            parts = []
+            while True:
+                data = self.read(1024 * 1024)
+                if (not data):
+                    return(b''.join(parts))
+                parts.append(data)
+        data = b''
+        while (not data and not self.eof):
+            data = self._read_chunk(max(size, 1))
+        return(data)
+
+    def _read_chunk(self, size):
+        # Read and decompress one chunk of data, may return b'' before end
+        if (self.decompressor is None):
+            # Stored, read exactly the compressed size
+            chunk = self.buf.read(min(size, self.remaining))
+            if (not chunk and self.remaining > 0):
+                raise StreamingZipError("Unexpected end of ZIP stream in %s" % (self.filename))
+            self.remaining -= len(chunk)
+            data = chunk
+            if (self.remaining == 0):
+                self._finish()
+        else:
+            chunk = self.decompressor.unconsumed_tail
+            if (not chunk):
+                to_read = size if self.remaining is None else min(size, self.remaining)
+                chunk = self.buf.read(to_read) if to_read > 0 else b''
+                if (self.remaining is not None):
+                    self.remaining -= len(chunk)
+                if (not chunk and to_read > 0):
+                    raise StreamingZipError("Unexpected end of ZIP stream in %s" % (self.filename))
+            data = self.decompressor.decompress(chunk, size)
+            if (self.decompressor.eof):
+                if (self.decompressor.unused_data):
+                    self.buf.unread(self.decompressor.unused_data)
+                self._finish()
+            elif (self.remaining == 0 and not self.decompressor.unconsumed_tail and not data):
+                raise StreamingZipError("Truncated deflate data in %s" % (self.filename))
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if (self.eof):
+            self._check()
+        return(data)
+
+    def _finish(self):
+        # End of member data, read any data descriptor
+        self.eof = True
+        if (self.has_descriptor):
+            sig = self.buf.read_exact(4)
+            if (sig != DATA_DESCRIPTOR_SIGNATURE):
+                self.buf.unread(sig)
+            if (self.zip64):
+                (self.CRC, self.compress_size, self.file_size) = \
+                    struct.unpack('<LQQ', self.buf.read_exact(20))
+            else:
+                (self.CRC, self.compress_size, self.file_size) = \
+                    struct.unpack('<LLL', self.buf.read_exact(12))
+
+    def _check(self):
+        # Check CRC and size when complete
+        if (self.size != self.file_size):
+            raise StreamingZipError("Bad size for %s in ZIP stream, got %d expected %d" %
+                                    (self.filename, self.size, self.file_size))
+        if ((self.crc & 0xffffffff) != self.CRC):
+            raise StreamingZipError("Bad CRC-32 for %s in ZIP stream" % (self.filename))
+
+    def skip(self):
+        """Skip over any unread data in this member."""
+        if (not self.eof and self.decompressor is None):
+            # Stored, no need to look at the data
+            while (self.remaining > 0):
+                chunk = self.buf.read(min(1024 * 1024, self.remaining))
+                if (not chunk):
+                    raise StreamingZipError("Unexpected end of ZIP stream in %s" % (self.filename))
+                self.remaining -= len(chunk)
+            self.eof = True
+        while (not self.eof):
+            self._read_chunk(1024 * 1024)
+
+
+class StreamingZipReader(object):
+    """Iterate over the members of a ZIP file read sequentially from fh."""
+
+    def __init__(self, fh):
+        """Initialize StreamingZipReader reading from file-like object fh."""
+        self.buf = StreamBuffer(fh)
+        self.member = None
+
+    @property
+    def bytes_read(self):
+        """Number of bytes of the ZIP stream read so far."""
+        return(self.buf.bytes_read)
+
+    def __iter__(self):
+        """Yield StreamingZipMember objects in stream order."""
+        while True:
+            if (self.member is not None):
+                self.member.skip()
+                self.member = None
+            member = self.next_member()
+            if (member is None):
+                return
+            self.member = member
+            yield member
+
+    def next_member(self):
+        """Read the next local file header, return None at central directory."""
+        sig = self.buf.read(4)
+        if (0 < len(sig) < 4):
+            sig += self.buf.read_exact(4 - len(sig))
+        if (sig in (b'', CENTRAL_HEADER_SIGNATURE, END_SIGNATURE, ZIP64_END_SIGNATURE)):
+            return(None)
+        if (sig != LOCAL_HEADER_SIGNATURE):
+            raise StreamingZipError("Bad local file header signature in ZIP stream")
+        header = sig + self.buf.read_exact(LOCAL_HEADER.size - 4)
+        (sig, version, flags, compress_type, mtime, mdate, crc,
+         compress_size, file_size, name_len, extra_len) = LOCAL_HEADER.unpack(header)
+        name = self.buf.read_exact(name_len)
+        extra = self.buf.read_exact(extra_len)
+        filename = name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        if (flags & FLAG_ENCRYPTED):
+            raise StreamingZipError("Encrypted member %s not supported" % (filename))
+        if (compress_type not in (ZIP_STORED, ZIP_DEFLATED)):
+            raise StreamingZipError("Compression type %d of %s not supported" %
+                                    (compress_type, filename))
+        # A ZIP64 extra field means 64-bit sizes here, if they are
+        # 0xffffffff, and in any data descriptor
+        zip64_extra = self.zip64_extra(extra)
+        zip64 = zip64_extra is not None
+        if (compress_size == 0xffffffff or file_size == 0xffffffff):
+            if (not zip64):
+                raise StreamingZipError("Missing ZIP64 extra field in ZIP stream")
+            (file_size, compress_size) = self.zip64_sizes(zip64_extra, file_size, compress_size)
+        if (flags & FLAG_DATA_DESCRIPTOR):
+            if (compress_type == ZIP_STORED):
+                raise StreamingZipError("Stored member %s with data descriptor not supported" %
+                                        (filename))
+            # Sizes and CRC follow the data
+            (crc, compress_size, file_size) = (None, None, None)
+        return(StreamingZipMember(self.buf, filename, flags, compress_type, crc,
+                                  compress_size, file_size, zip64=zip64))
+
+    def zip64_extra(self, extra):
+        """Return data of the ZIP64 extra field (id 0x0001) in extra, else None."""
+        pos = 0
+        while (pos + 4 <= len(extra)):
+            (tag, size) = struct.unpack('<HH', extra[pos:pos + 4])
+            if (tag == 0x0001):
+                return(extra[pos + 4:pos + 4 + size])
+            pos += 4 + size
+        return(None)
+
+    def zip64_sizes(self, values, file_size, compress_size):
+        """Return (file_size, compress_size) using ZIP64 extra field data values."""
+        try:
+            if (file_size == 0xffffffff):
+                file_size = struct.unpack('<Q', values[0:8])[0]
+                values = values[8:]
+            if (compress_size == 0xffffffff):
+                compress_size = struct.unpack('<Q', values[0:8])[0]
+        except struct.error:
+            raise StreamingZipError("Bad ZIP64 extra field in ZIP stream")
+        return(file_size, compress_size)
@@ -0,0 +1,68 @@
+"""Table of URI strings shared between lists.
+
+A client comparing a source resource list with the destination holds two
+Resource objects for each resource, one parsed from the source sitemap and
+one built from the file on disk by mapping its path back to a URI. Without
+sharing, each URI string is held twice. A UriTable returns the first
+string object seen for any given URI so that later equal strings may be
+garbage collected, and the lists then share a single copy of each URI.
+
+The table keeps its own reference to every URI until cleared, so it
+should be shared only by lists with the same lifetime, typically for
+one synchronization operation.
+"""
+
+import sys
+
+
+class UriTable(object):
+    """Table of interned URI strings.
+
+    lookups - number of calls to intern(...)
+
+    hits - number of calls that returned a string already in the table
+
+    bytes_saved - total size of the duplicate strings that were replaced
+        by one already in the table, and so may be freed
+    """
+
+    def __init__(self):
+        """Initialize empty UriTable."""
+        self._uris = {}
+        self.lookups = 0
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        """Number of distinct URIs in table."""
+        return(len(self._uris))
+
+    def __contains__(self, uri):
+        """True if uri is in table."""
+        return(uri in self._uris)
+
+    def intern(self, uri):
+        """Return the table's copy of uri, adding uri if not already present."""
+        self.lookups += 1
+        shared = self._uris.get(uri)
+        if (shared is None):
+            self._uris[uri] = uri
+            return(uri)
+        if (shared is not uri):
+            self.hits += 1
+            self.bytes_saved += sys.getsizeof(uri)
+        return(shared)
+
+    def clear(self):
+        """Remove all URIs from table and reset statistics."""
+        self._uris = {}
+        self.lookups = 0
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def stats(self):
+        """Return dict of statistics for this table."""
+        return({'uris': len(self._uris),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'bytes_saved': self.bytes_saved})
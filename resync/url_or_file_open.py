@@ -1,27 +1,41 @@
-"""Local version of urlopen that supports local files & web URLs, plus adds auth."""
+"""Local version of urlopen that supports local files & web URLs, plus adds auth.
+
+Web requests ask for gzip or deflate content encoding and responses are
+decoded as they are read, so callers always see the identity content.
+Callers reading sitemaps may also ask for gzipped files (such as
+sitemap.xml.gz) to be decompressed, whether local or on the web.
+"""
 
 import re
-import time
+import zlib
 from urllib.request import Request, urlopen
 
 from . import __version__
+from .rate_limiter import RateLimiter
 
 
 # Global configuration settings
-NUM_REQUESTS = 0
 CONFIG = {
     'bearer_token': None,
-    'delay': None
+    'accept_encoding': 'gzip, deflate',
+    'delay': None,
+    'burst': 1
 }
 
+# Per-host rate limiter shared by all web requests, configured by the
+# delay and burst settings
+RATE_LIMITER = RateLimiter()
+
 
 def set_url_or_file_open_config(key, value):
     """Set the global config."""
     global CONFIG
     CONFIG[key] = value
+    if (key in ('delay', 'burst')):
+        RATE_LIMITER.configure(delay=CONFIG['delay'], burst=CONFIG['burst'])
 
 
-def url_or_file_open(uri, method=None, timeout=None):
+def url_or_file_open(uri, method=None, timeout=None, gunzip=False):
     """Wrapper around urlopen() to prepend file: if no scheme provided.
 
     Can be used as a context manager because the return value from urlopen(...)
@@ -29,10 +43,16 @@ def url_or_file_open(uri, method=None, timeout=None):
 
     If timeout is exceeded then urlopen(..) will raise a socket.timeout exception. If
     no timeout is specified then the global default will be used.
+
+    Except for HEAD requests, the response is wrapped in a DecodingResponse
+    that removes any Content-Encoding. If gunzip is set then content that
+    is itself gzipped is also decompressed.
     """
     if (not re.match(r'''\w+:''', uri)):
         uri = 'file:' + uri
     headers = {'User-Agent': 'resync/' + __version__}
+    if CONFIG['accept_encoding'] and not uri.startswith('file:'):
+        headers['Accept-Encoding'] = CONFIG['accept_encoding']
     # Do we need to send an Authorization header?
     # FIXME - This token will be added blindy to all requests. This is insecure
     # if the --noauth setting is used allowing requests across different domains.
@@ -40,10 +60,197 @@ def url_or_file_open(uri, method=None, timeout=None):
     # domain, or domain pattern.
     if CONFIG['bearer_token'] is not None:
         headers['Authorization'] = 'Bearer ' + CONFIG['bearer_token']
-    # Have we got a delay set? Apply only to web requests after first
-    global NUM_REQUESTS
-    if NUM_REQUESTS != 0 and CONFIG['delay'] is not None and not uri.startswith('file:'):
-        time.sleep(CONFIG['delay'])
-    NUM_REQUESTS += 1
+    # Apply any per-host rate limit to web requests
+    if not uri.startswith('file:'):
+        RATE_LIMITER.acquire(uri)
     maybe_timeout = {} if timeout is None else {'timeout': timeout}
-    return urlopen(Request(url=uri, headers=headers, method=method), **maybe_timeout)
+    response = urlopen(Request(url=uri, headers=headers, method=method), **maybe_timeout)
+    if method == 'HEAD':
+        return response
+    fh = DecodingResponse(response, response.headers.get('Content-Encoding'))
+    if gunzip and fh.peek(2)[0:2] == GZIP_MAGIC:
+        fh = DecodingResponse(fh, 'gzip')
+    return fh
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class DecodingResponse(object):
+    """File-like wrapper for a response that decodes content as it is read.
+
+    encoding is the Content-Encoding of fh, one of gzip, x-gzip, deflate or
+    identity (None). Other attributes, such as info() and geturl(), are
+    those of fh.
+
+    bytes_read is the number of bytes read from the underlying response,
+    compressed if encoded, and bytes_decoded the number returned.
+    """
+
+    def __init__(self, fh, encoding=None, chunk_size=64 * 1024):
+        """Initialize DecodingResponse reading from fh."""
+        self.fh = fh
+        self.encoding = (encoding or 'identity').strip().lower()
+        if self.encoding not in ('identity', 'gzip', 'x-gzip', 'deflate'):
+            raise IOError("Unsupported Content-Encoding %s" % (encoding))
+        self.chunk_size = chunk_size
+        self.decompressor = None
+        self.pending = b''
+        self.eof = False
+        self._bytes_read = 0
+        self.bytes_decoded = 0
+
+    @property
+    def bytes_read(self):
+        """Number of bytes read from the original response."""
+        if isinstance(self.fh, DecodingResponse):
+            return self.fh.bytes_read
+        return self._bytes_read
+
+    def __getattr__(self, name):
+        """Delegate other attributes to the response."""
+        return getattr(self.fh, name)
+
+    def __enter__(self):
+        """Enter context, returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit context, closing the response."""
+        self.close()
+
+    def __iter__(self):
+        """Iterate over lines."""
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        """Close the response."""
+        self.fh.close()
+
+    def peek(self, size=1):
+        """Return at least size bytes of decoded data, if available, without consuming them."""
+        while len(self.pending) < size and not self.eof:
+            self.pending += self._decode_chunk()
+        return self.pending
+
+    def read(self, size=-1):
+        """Read up to size bytes of decoded content, all if size < 0."""
+        if size is None or size < 0:
+            parts = [self.pending]
+            self.pending = b''
+            while not self.eof:
+                parts.append(self._decode_chunk())
+            data = b''.join(parts)
+        else:
+            while not self.pending and not self.eof:
+                self.pending = self._decode_chunk(size)
+            data = self.pending[:size]
+            self.pending = self.pending[size:]
+        self.bytes_decoded += len(data)
+        return data
+
+    def readline(self, size=-1):
+        """Read a line of decoded content."""
+        while b'\n' not in self.pending and not self.eof:
+            self.pending += self._decode_chunk()
+        end = self.pending.find(b'\n') + 1 or len(self.pending)
+        if size is not None and 0 <= size < end:
+            end = size
+        data = self.pending[:end]
+        self.pending = self.pending[end:]
+        self.bytes_decoded += len(data)
+        return data
+
+    def _decode_chunk(self, size=None):
+        # Read and decode the next chunk, may return b'' before the end
+        size = max(size or self.chunk_size, 1)
+        d = self.decompressor
+        if d is not None and d.eof and d.unused_data:
+            # Start of another gzip member already read
+            data = b''
+        elif d is not None and not d.eof and d.unconsumed_tail:
+            data = d.unconsumed_tail
+        else:
+            data = self.fh.read(self.chunk_size)
+            self._bytes_read += len(data)
+            if not data:
+                self.eof = True
+                if d is not None and not d.eof:
+                    raise IOError("Truncated %s encoded content" % (self.encoding))
+                return b''
+        if self.encoding == 'identity':
+            return data
+        if d is None or d.eof:
+            if d is not None:
+                data = d.unused_data + data
+            self.decompressor = self._new_decompressor(data)
+            if self.decompressor is None:
+                return b''  # padding after last member
+        try:
+            return self.decompressor.decompress(data, size)
+        except zlib.error as e:
+            raise IOError("Cannot decode %s encoded content (%s)" % (self.encoding, str(e)))
+
+    def _new_decompressor(self, data):
+        return new_decompressor(self.encoding, data)
+
+
+class DecodingWriter(object):
+    """File-like wrapper that decodes content written to it and writes that to fh.
+
+    The counterpart of DecodingResponse for a response body that is
+    received in chunks rather than read. encoding is the Content-Encoding,
+    as for DecodingResponse. finish() must be called after the last write
+    to check that the content was complete.
+
+    bytes_written is the number of bytes written, compressed if encoded.
+    """
+
+    def __init__(self, fh, encoding=None):
+        """Initialize DecodingWriter writing to fh."""
+        self.fh = fh
+        self.encoding = (encoding or 'identity').strip().lower()
+        if self.encoding not in ('identity', 'gzip', 'x-gzip', 'deflate'):
+            raise IOError("Unsupported Content-Encoding %s" % (encoding))
+        self.decompressor = None
+        self.bytes_written = 0
+
+    def write(self, data):
+        """Decode data and write the result."""
+        self.bytes_written += len(data)
+        if self.encoding == 'identity':
+            self.fh.write(data)
+            return
+        while data:
+            if self.decompressor is None or self.decompressor.eof:
+                self.decompressor = new_decompressor(self.encoding, data)
+                if self.decompressor is None:
+                    return  # padding after last member
+            try:
+                self.fh.write(self.decompressor.decompress(data))
+            except zlib.error as e:
+                raise IOError("Cannot decode %s encoded content (%s)" % (self.encoding, str(e)))
+            data = self.decompressor.unused_data if self.decompressor.eof else b''
+
+    def finish(self):
+        """Check that the end of the encoded content was reached."""
+        if self.decompressor is not None and not self.decompressor.eof:
+            raise IOError("Truncated %s encoded content" % (self.encoding))
+
+
+def new_decompressor(encoding, data):
+    """Return zlib decompressor for encoding given the first data, None if data is padding.
+
+    deflate content may be zlib-wrapped or raw.
+    """
+    if encoding == 'deflate':
+        if len(data) >= 2 and (data[0] & 0x0f) == 8 and (data[0] * 256 + data[1]) % 31 == 0:
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+    if not data.strip(b'\x00'):
+        return None
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
@@ -0,0 +1,63 @@
+"""Tests for resync.archives."""
+
+import unittest
+
+from resync.archives import ChangeListArchive, ResourceListArchive
+from resync.resource import Resource
+
+
+def make_archive():
+    cla = ChangeListArchive()
+    # Deliberately out of order and with one long entry
+    cla.add(Resource('cl3', ts_from=300, ts_until=400))
+    cla.add(Resource('cl1', ts_from=100, ts_until=200))
+    cla.add(Resource('long', ts_from=50, ts_until=350))
+    cla.add(Resource('cl2', ts_from=200, ts_until=300))
+    cla.add(Resource('current', ts_from=400))
+    return(cla)
+
+
+def uris(resources):
+    return([r.uri for r in resources])
+
+
+class TestArchives(unittest.TestCase):
+
+    def test01_overlapping(self):
+        cla = make_archive()
+        self.assertEqual(uris(cla.overlapping()), ['long', 'cl1', 'cl2', 'cl3', 'current'])
+        self.assertEqual(uris(cla.overlapping(210, 250)), ['long', 'cl2'])
+        self.assertEqual(uris(cla.overlapping(360, 410)), ['cl3', 'current'])
+        self.assertEqual(uris(cla.overlapping(1000)), ['current'])
+        self.assertEqual(uris(cla.overlapping(None, 100)), ['long'])
+        self.assertEqual(uris(cla.overlapping(0, 10)), [])
+        # Index is rebuilt when entries are added
+        cla.add(Resource('early', ts_until=20))
+        self.assertEqual(uris(cla.overlapping(0, 10)), ['early'])
+
+    def test02_covering(self):
+        cla = make_archive()
+        self.assertEqual(uris(cla.covering(100)), ['long', 'cl1'])
+        self.assertEqual(uris(cla.covering(350)), ['cl3'])
+        self.assertEqual(uris(cla.covering(10 ** 10)), ['current'])
+        self.assertEqual(uris(cla.covering(10)), [])
+        rla = ResourceListArchive()
+        rla.add(Resource('rl1', ts_from=100, ts_until=200))
+        self.assertEqual(uris(rla.covering(150)), ['rl1'])
+
+    def test03_index_kept_while_unchanged(self):
+        cla = make_archive()
+        self.assertEqual(uris(cla.covering(340)), ['long', 'cl3'])
+        index = cla.interval_index()
+        self.assertIs(cla.interval_index(), index)
+        # Replacing an entry is counted so the index is rebuilt
+        cla.resources[0] = Resource('cl3', ts_from=300, ts_until=320)
+        self.assertEqual(uris(cla.covering(340)), ['long'])
+        # A plain list does not count changes so no index is kept
+        cla = ChangeListArchive(resources=[])
+        cla.add(Resource('cl1', ts_from=100, ts_until=200))
+        cla.covering(150)
+        cla.resources[0].ts_until = 120
+        self.assertEqual(uris(cla.covering(150)), [])
+        cla.resources[0] = Resource('cl2', ts_from=200, ts_until=300)
+        self.assertEqual(uris(cla.covering(250)), ['cl2'])
@@ -0,0 +1,168 @@
+from .testlib import TestCase, webserver
+
+import asyncio
+import gzip
+import logging
+import os.path
+import re
+from testfixtures import LogCapture
+
+from resync.async_client import AsyncClient
+from resync.client import ClientFatalError
+from resync.mapper import Mapper
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestAsyncClient(TestCase):
+    """Test cases for resync.async_client."""
+
+    def make_source(self, name, num=25):
+        """Write num resources and a resource list with sitemapindex in self.tmpdir/name."""
+        src = os.path.join(self.tmpdir, name)
+        os.mkdir(src)
+        rl = ResourceList()
+        for j in range(0, num):
+            rname = 'r%02d' % (j)
+            with open(os.path.join(src, rname), 'w') as fh:
+                fh.write('resource %d' % (j))
+            rl.add(Resource(uri='http://localhost:9999/%s/%s' % (name, rname),
+                            length=len('resource %d' % (j)), lastmod='2020-01-01T00:00:%02dZ' % (j)))
+        rl.mapper = Mapper(['http://localhost:9999/' + name, src])
+        rl.max_sitemap_entries = 10
+        rl.write(basename=os.path.join(src, 'resourcelist.xml'))
+        return(src)
+
+    def test01_baseline_or_audit(self):
+        c = AsyncClient(max_concurrency=4)
+        c.status_file = os.path.join(self.tmpdir, 'test01_status.cfg')
+        dst = os.path.join(self.tmpdir, 'dst_dir1')
+        with webserver('tests/testdata/client', 'localhost', 9999):
+            c.set_mappings(['http://localhost:9999/dir1', dst])
+            with LogCapture() as lc:
+                c.baseline_or_audit(audit_only=True)
+                self.assertTrue(
+                    re.match(r'Status:\s+NOT IN SYNC.*to create=3', lc.records[-2].msg))
+            with LogCapture() as lc:
+                c.baseline_or_audit()
+                self.assertTrue(
+                    re.match(r'Status:\s+SYNCED.*created=3', lc.records[-2].msg))
+                self.assertEqual(lc.records[-1].msg, 'Completed baseline sync')
+        self.assertEqual(sorted(os.listdir(dst)), ['resource1', 'resource2', 'resource3'])
+
+    def test02_read_sitemapindex(self):
+        src = self.make_source('src2')
+        c = AsyncClient(max_concurrency=2)
+        with webserver(self.tmpdir, 'localhost', 9999):
+            rl = ResourceList()
+            c.read_list(rl, 'http://localhost:9999/src2/resourcelist.xml')
+        self.assertEqual(len(rl), 25)
+        self.assertEqual(rl.num_files, 4)
+        self.assertEqual(rl.resources.uris()[0], 'http://localhost:9999/src2/r00')
+        # Same for local file, component URIs mapped to files
+        c.set_mappings(['http://localhost:9999/src2', src])
+        rl = ResourceList(mapper=c.mapper)
+        c.read_list(rl, os.path.join(src, 'resourcelist.xml'))
+        self.assertEqual(len(rl), 25)
+
+    def test03_sync_with_index(self):
+        self.make_source('src3')
+        c = AsyncClient(max_concurrency=8, max_per_host=3)
+        c.status_file = os.path.join(self.tmpdir, 'test03_status.cfg')
+        dst = os.path.join(self.tmpdir, 'dst')
+        with webserver(self.tmpdir, 'localhost', 9999):
+            c.set_mappings(['http://localhost:9999/src3', dst])
+            c.sitemap_name = 'http://localhost:9999/src3/resourcelist.xml'
+            c.baseline_or_audit()
+        names = sorted(os.listdir(dst))
+        self.assertEqual(len([n for n in names if n.startswith('r')]), 25)
+        with open(os.path.join(dst, 'r07'), 'r') as fh:
+            self.assertEqual(fh.read(), 'resource 7')
+        self.assertEqual(int(os.stat(os.path.join(dst, 'r07')).st_mtime), 1577836807)
+
+    def test04_failures(self):
+        c = AsyncClient()
+        c.tries = 1
+        dst = os.path.join(self.tmpdir, 'dst')
+        with webserver('tests/testdata/client', 'localhost', 9999):
+            r = Resource(uri='http://localhost:9999/dir1/not_there')
+            self.assertRaises(ClientFatalError, c.run,
+                              c.update_resource_async(r, os.path.join(dst, 'x')))
+            c.ignore_failures = True
+            with LogCapture() as lc:
+                n = c.run(c.update_resource_async(r, os.path.join(dst, 'x')))
+            self.assertEqual(n, 0)
+            self.assertTrue(re.match(r'Failed to GET .*not_there -- HTTP Error 404', lc.records[-1].msg))
+
+    def test05_checkpoint(self):
+        self.make_source('src5', num=10)
+        c = AsyncClient(max_concurrency=4)
+        c.tries = 1
+        c.checkpoint_interval = 0
+        dst = os.path.join(self.tmpdir, 'dst5')
+        c.set_mappings(['http://localhost:9999/src5', dst])
+        changes = [(Resource(uri='http://localhost:9999/src5/r%02d' % (j)), 'created')
+                   for j in range(0, 10)]
+        changes.insert(5, (Resource(uri='http://localhost:9999/src5/not_there'), 'created'))
+        checkpoints = []
+        with webserver(self.tmpdir, 'localhost', 9999):
+            self.assertRaises(ClientFatalError, c.apply_changes, changes,
+                              checkpoint=checkpoints.append)
+            # Never past the failure, changes before it may be cancelled
+            self.assertEqual(checkpoints, sorted(checkpoints))
+            self.assertLessEqual(checkpoints[-1], 5)
+            checkpoints = []
+            c.ignore_failures = True
+            self.assertEqual(c.apply_changes(changes, checkpoint=checkpoints.append), (10, 0, 0))
+        self.assertEqual(checkpoints, sorted(checkpoints))
+        self.assertEqual(checkpoints[-1], 11)
+
+    def test06_read_local(self):
+        src = os.path.join(self.tmpdir, 'local6')
+        with open(src, 'wb') as fh:
+            fh.write(b'x' * 200000)
+        c = AsyncClient()
+        c.CHUNK_SIZE = 1000
+        self.assertEqual(c.run(c.read_local('file://' + src)), b'x' * 200000)
+        dst = os.path.join(self.tmpdir, 'local6_copy')
+        self.assertEqual(c.run(c.read_local(src, dst)), None)
+        self.assertEqual(os.path.getsize(dst), 200000)
+
+    def test07_encoding_and_redirect(self):
+        data = b'<urlset>' + b'x' * 10000 + b'</urlset>'
+        requests = []
+
+        async def handle(reader, writer):
+            request = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+            requests.append(request)
+            if (request.startswith('GET /redirect ')):
+                port = writer.get_extra_info('sockname')[1]
+                writer.write(b'HTTP/1.1 302 Found\r\nLocation: http://127.0.0.1:%d/data\r\n'
+                             b'Content-Length: 0\r\n\r\n' % (port))
+            else:
+                body = gzip.compress(data)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n'
+                             b'Content-Length: %d\r\n\r\n' % (len(body)) + body)
+            await writer.drain()
+            writer.close()
+
+        async def get(c):
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return(await c.fetch('http://localhost:%d/redirect' % (port)), port)
+            finally:
+                server.close()
+
+        c = AsyncClient(max_per_host=1)
+        (body, port) = c.run(get(c))
+        # Content encoding is asked for and decoded
+        self.assertEqual(body, data)
+        self.assertEqual(len(requests), 2)
+        for request in requests:
+            self.assertIn('Accept-Encoding: gzip, deflate', request)
+        # Each request is limited against the host it is made to
+        self.assertEqual(sorted(c._local.host_limits),
+                         ['127.0.0.1:%d' % (port), 'localhost:%d' % (port)])
@@ -0,0 +1,89 @@
+"""Tests for resync.change_journal."""
+
+from .testlib import TestCase
+
+import os
+import os.path
+
+from resync.change_journal import ChangeJournal
+from resync.change_list import ChangeList
+from resync.resource import Resource
+
+
+def add_changes(journal, times):
+    for t in times:
+        journal.append(Resource('http://ex.org/r%d' % (t), timestamp=t, length=t,
+                                md5='abc', change='updated'))
+
+
+class TestChangeJournal(TestCase):
+
+    def test01_append_and_windows(self):
+        journal = ChangeJournal(os.path.join(self.tmpdir, 'test01'),
+                                block_records=3, segment_records=9)
+        self.assertEqual(len(journal), 0)
+        self.assertEqual(list(journal.changes(0, 10)), [])
+        add_changes(journal, range(100, 125))
+        self.assertEqual(len(journal), 25)
+        self.assertEqual(journal.segments(), [0, 1, 2])
+        self.assertEqual([r.timestamp for r in journal.changes(110, 113)], [110, 111, 112])
+        self.assertEqual([r.timestamp for r in journal.changes(None, 102)], [100, 101])
+        self.assertEqual([r.timestamp for r in journal.changes(122)], [122, 123, 124])
+        r = list(journal.changes(107, 108))[0]
+        self.assertEqual((r.uri, r.length, r.md5, r.change), ('http://ex.org/r107', 107, 'abc', 'updated'))
+        self.assertEqual(journal.first_time(), 100)
+        self.assertEqual(journal.last_time(), 124)
+        # Only blocks that may be in the window are read
+        read = []
+        read_block = journal.read_block
+        journal.read_block = lambda *args: read.append(args) or read_block(*args)
+        list(journal.changes(110, 113))
+        self.assertEqual(len(read), 2)
+        journal.close()
+
+    def test02_reopen(self):
+        dirname = os.path.join(self.tmpdir, 'test02')
+        journal = ChangeJournal(dirname, block_records=3, segment_records=6)
+        add_changes(journal, range(0, 10))
+        journal.close()
+        # Partial record at end is discarded
+        with open(os.path.join(dirname, '00000001.log'), 'ab') as fh:
+            fh.write(b'{"t":99,"u":"http')
+        journal = ChangeJournal(dirname, block_records=3, segment_records=6)
+        self.assertEqual(len(journal), 10)
+        add_changes(journal, range(10, 14))
+        self.assertEqual([r.timestamp for r in journal], list(range(0, 14)))
+        self.assertEqual([r.timestamp for r in journal.changes(8, 11)], [8, 9, 10])
+        journal.close()
+        # Out of order changes are still found
+        journal = ChangeJournal(dirname, block_records=3, segment_records=6)
+        add_changes(journal, [5.5])
+        self.assertEqual([r.timestamp for r in journal.changes(5, 6)], [5, 5.5])
+        self.assertEqual(journal.prune(6), 6)
+        self.assertEqual(journal.segments(), [1, 2])
+        self.assertEqual([r.timestamp for r in journal.changes(None, 7)], [6, 5.5])
+        journal.close()
+
+    def test03_change_list(self):
+        journal = ChangeJournal(os.path.join(self.tmpdir, 'test03'), block_records=2)
+        cl = ChangeList(resources=journal)
+        cl.add(Resource('http://ex.org/a', timestamp=86400, change='created'))
+        cl.add(Resource('http://ex.org/b', timestamp=86500, change='created'))
+        cl.add(Resource('http://ex.org/a', timestamp=2 * 86400 + 5, change='deleted'))
+        self.assertEqual(len(cl), 3)
+        self.assertIn('<loc>http://ex.org/b</loc>', cl.as_xml())
+        # Appends are counted so part boundaries by size can be kept
+        self.assertEqual(journal.num_writes, 3)
+        self.assertEqual(cl.resources_changes(), 3)
+        self.assertNotEqual(cl.part_starts_key(), None)
+        window = journal.change_list(86450, 86400 * 2)
+        self.assertEqual([r.uri for r in window], ['http://ex.org/b'])
+        self.assertEqual(window.md_from, '1970-01-02T00:00:50Z')
+        self.assertEqual(window.md_until, '1970-01-03T00:00:00Z')
+        cla = journal.change_list_archive('http://ex.org/', 86400, until_ts=86400 * 4)
+        self.assertEqual([(r.uri, r.md_from, r.md_until) for r in cla],
+                         [('http://ex.org/changelist-19700102T000000Z.xml',
+                           '1970-01-02T00:00:00Z', '1970-01-03T00:00:00Z'),
+                          ('http://ex.org/changelist-19700103T000000Z.xml',
+                           '1970-01-03T00:00:00Z', '1970-01-04T00:00:00Z')])
+        journal.close()
@@ -5,10 +5,14 @@ try:  # python2
     import StringIO as io
 except ImportError:  # python3
     import io
+import os.path
 import re
+import shutil
+import tempfile
 
+from resync.mapper import Mapper
 from resync.resource import Resource
-from resync.change_list import ChangeList, ChangeTypeError
+from resync.change_list import ChangeList, ChangeFolder, ChangeTypeError
 from resync.resource_list import ResourceList
 from resync.sitemap import SitemapParseError
 
@@ -192,3 +196,92 @@ class TestChangeList(unittest.TestCase):
         # without a ts_datetime
         cl.resources.append(Resource('nt_1_1', timestamp=456))
         self.assertRaises(Exception, cl.prune_updates_before, 3.5, spec_version='1.1')
+
+    def test12_parse_from_timestamp(self):
+        """Test skipping changes before from_timestamp while parsing."""
+        xml = '<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n\
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<rs:md capability="changelist" from="2013-01-01"/>\
+<url><loc>http://example.com/a</loc><rs:md change="updated" datetime="2013-01-02T00:00:00Z"/></url>\
+<url><loc>http://example.com/b</loc><rs:md change="created" datetime="2013-01-03T00:00:00Z"/></url>\
+<url><loc>http://example.com/c</loc><rs:md change="deleted" datetime="2013-01-04T00:00:00Z"/></url>\
+</urlset>'
+        cl = ChangeList(from_timestamp=1357171200)  # 2013-01-03T00:00:00Z
+        cl.parse(fh=io.StringIO(xml))
+        self.assertEqual([r.uri for r in cl], ['http://example.com/b', 'http://example.com/c'])
+        self.assertEqual(cl.num_skipped, 1)
+        self.assertEqual(cl.prune_updates_before(1357171200), 0)
+
+    def test13_read_index_from_timestamp(self):
+        """Test reading Change List Index skipping sitemaps before from_timestamp."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            index = '<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n\
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<rs:md capability="changelist" from="2013-01-01T00:00:00Z"/>\
+<sitemap><loc>http://example.com/cl1.xml</loc><rs:md from="2013-01-01T00:00:00Z" until="2013-01-02T00:00:00Z"/></sitemap>\
+<sitemap><loc>http://example.com/cl2.xml</loc><rs:md from="2013-01-02T00:00:00Z" until="2013-01-04T00:00:00Z"/></sitemap>\
+</sitemapindex>'
+            component = '<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n\
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<rs:md capability="changelist"/>\
+<url><loc>http://example.com/%s</loc><rs:md change="updated" datetime="2013-01-0%dT00:00:00Z"/></url>\
+</urlset>'
+            with open(os.path.join(tmpdir, 'changelist.xml'), 'w') as fh:
+                fh.write(index)
+            # cl1.xml is missing so would fail if read
+            with open(os.path.join(tmpdir, 'cl2.xml'), 'w') as fh:
+                fh.write(component % ('x', 3))
+            mapper = Mapper(['http://example.com/', tmpdir])
+            cl = ChangeList(mapper=mapper, from_timestamp=1357171200)  # 2013-01-03T00:00:00Z
+            cl.read(os.path.join(tmpdir, 'changelist.xml'))
+            self.assertEqual([r.uri for r in cl], ['http://example.com/x'])
+            self.assertEqual(cl.num_sitemaps_skipped, 1)
+            self.assertEqual(cl.md['md_from'], '2013-01-01T00:00:00Z')
+            # Without from_timestamp both are read
+            cl = ChangeList(mapper=mapper)
+            self.assertRaises(Exception, cl.read, os.path.join(tmpdir, 'changelist.xml'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test14_change_folder(self):
+        """Test ChangeFolder gives same result as prune_dupes."""
+        changes = [('a', 'created'), ('b', 'created'), ('c', 'updated'), ('d', 'deleted'),
+                   ('a', 'updated'), ('b', 'deleted'), ('b', 'created'), ('b', 'deleted'),
+                   ('c', 'deleted'), ('d', 'created'), ('e', 'created'), ('e', 'deleted'),
+                   ('e', 'created')]
+        cl1 = ChangeList()
+        cl2 = ChangeList(resources_class=ChangeFolder)
+        for (j, (uri, change)) in enumerate(changes):
+            cl1.add(Resource(uri, timestamp=j, change=change))
+            cl2.add(Resource(uri, timestamp=j, change=change))
+        self.assertEqual(cl1.prune_dupes(), 9)
+        self.assertEqual(cl2.prune_dupes(), 9)
+        self.assertEqual([(r.uri, r.change, r.timestamp) for r in cl1],
+                         [('a', 'updated', 4), ('c', 'deleted', 8), ('d', 'created', 9), ('e', 'created', 12)])
+        self.assertEqual([(r.uri, r.change, r.timestamp) for r in cl2],
+                         [(r.uri, r.change, r.timestamp) for r in cl1])
+        self.assertEqual(len(cl2), 4)
+        self.assertEqual(cl2.resources[1].uri, 'c')
+        self.assertEqual(cl2.resources[-1].uri, 'e')
+        self.assertRaises(IndexError, cl2.resources.__getitem__, 4)
+        # Nothing to prune by time leaves folder in place
+        self.assertEqual(cl2.prune_updates_before(0, spec_version='1.0'), 0)
+        self.assertTrue(isinstance(cl2.resources, ChangeFolder))
+
+    def test15_change_folder_fold_in(self):
+        """Test folding in a later ChangeFolder is the same as folding all changes."""
+        changes = [('a', 'created'), ('b', 'updated'), ('c', 'created'), ('a', 'deleted'),
+                   ('b', 'created'), ('b', 'deleted'), ('c', 'updated'), ('d', 'deleted'),
+                   ('a', 'created'), ('c', 'deleted'), ('d', 'created')]
+        changes = [Resource(uri, timestamp=j, change=change)
+                   for (j, (uri, change)) in enumerate(changes)]
+        whole = ChangeFolder(changes)
+        for k in range(0, len(changes) + 1):
+            folder = ChangeFolder(changes[:k])
+            folder.fold_in(ChangeFolder(changes[k:]))
+            self.assertEqual([(r.uri, r.change) for r in folder],
+                             [(r.uri, r.change) for r in whole])
+            self.assertEqual(folder.num_pruned, whole.num_pruned)
+        self.assertEqual([(r.uri, r.change) for r in whole],
+                         [('b', 'deleted'), ('a', 'created'), ('d', 'created')])
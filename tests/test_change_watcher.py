@@ -0,0 +1,121 @@
+"""Tests for resync.change_watcher."""
+
+from .testlib import TestCase
+
+import os
+import os.path
+import shutil
+import unittest
+
+from resync.change_list import ChangeList
+from resync.archives import ChangeListArchive
+from resync.change_watcher import ChangeWatcher, InotifyEvents
+from resync.mapper import Mapper
+
+
+def write_file(path, data):
+    with open(path, 'w') as fh:
+        fh.write(data)
+
+
+def changes(watcher):
+    return([(r.uri, r.change) for r in watcher.change_list])
+
+
+class TestChangeWatcher(TestCase):
+
+    def make_watcher(self, name, use_inotify):
+        src = os.path.join(self.tmpdir, name)
+        out = os.path.join(self.tmpdir, name + '_out')
+        os.makedirs(os.path.join(src, 'sub'))
+        os.mkdir(out)
+        write_file(os.path.join(src, 'a'), 'aaa')
+        write_file(os.path.join(src, 'sub', 'b'), 'bbb')
+        watcher = ChangeWatcher(Mapper(['http://ex.org/', src]),
+                                basename=os.path.join(out, 'changelist.xml'),
+                                use_inotify=use_inotify, poll_interval=0.0,
+                                publish_interval=0.0)
+        watcher.start()
+        return(watcher, src, out)
+
+    def check_changes(self, watcher, src, out):
+        self.assertEqual(len(watcher.current), 2)
+        self.assertEqual(watcher.check(), 0)
+        write_file(os.path.join(src, 'c'), 'ccc')
+        write_file(os.path.join(src, 'a'), 'aaaa')
+        os.unlink(os.path.join(src, 'sub', 'b'))
+        os.mkdir(os.path.join(src, 'new'))
+        write_file(os.path.join(src, 'new', 'd'), 'ddd')
+        watcher.check(0.1)
+        self.assertEqual(sorted(changes(watcher)),
+                         [('http://ex.org/a', 'updated'),
+                          ('http://ex.org/c', 'created'),
+                          ('http://ex.org/new/d', 'created'),
+                          ('http://ex.org/sub/b', 'deleted')])
+        # Published
+        cl = ChangeList()
+        cl.read(uri=os.path.join(out, 'changelist.xml'))
+        self.assertEqual(len(cl), 4)
+        # Deleting a directory deletes everything in it
+        shutil.rmtree(os.path.join(src, 'new'))
+        watcher.check(0.1)
+        self.assertEqual(changes(watcher)[-1], ('http://ex.org/new/d', 'deleted'))
+        self.assertEqual(watcher.current.uris(), ['http://ex.org/a', 'http://ex.org/c'])
+
+    def test01_polling(self):
+        (watcher, src, out) = self.make_watcher('test01', False)
+        self.check_changes(watcher, src, out)
+
+    @unittest.skipUnless(InotifyEvents.available(), "inotify not available")
+    def test02_inotify(self):
+        (watcher, src, out) = self.make_watcher('test02', True)
+        self.assertTrue(watcher.use_inotify)
+        self.check_changes(watcher, src, out)
+        watcher.events.close()
+
+    def test03_rotate(self):
+        (watcher, src, out) = self.make_watcher('test03', False)
+        watcher.max_changes = 2
+        write_file(os.path.join(src, 'c'), 'ccc')
+        watcher.check()
+        self.assertEqual(len(watcher.change_list), 1)
+        write_file(os.path.join(src, 'd'), 'ddd')
+        write_file(os.path.join(src, 'e'), 'eee')
+        watcher.check()
+        # Archived, new empty list started
+        self.assertEqual(len(watcher.change_list), 0)
+        self.assertEqual(sorted(os.listdir(out)),
+                         ['changelist-00000.xml', 'changelist-archive.xml', 'changelist.xml'])
+        cla = ChangeListArchive()
+        cla.read(uri=os.path.join(out, 'changelist-archive.xml'))
+        self.assertEqual(len(cla), 1)
+        entry = list(cla)[0]
+        self.assertEqual(entry.uri, 'changelist-00000.xml')
+        self.assertEqual(entry.md_until, watcher.change_list.md_from)
+        cl = ChangeList()
+        cl.read(uri=os.path.join(out, 'changelist-00000.xml'))
+        self.assertEqual([r.uri for r in cl], ['http://ex.org/c', 'http://ex.org/d', 'http://ex.org/e'])
+        self.assertEqual(cl.md_until, entry.md_until)
+        # A new watcher continues numbering from the archive
+        write_file(os.path.join(src, 'f'), 'fff')
+        watcher2 = ChangeWatcher(watcher.mapper, basename=watcher.basename,
+                                 use_inotify=False, poll_interval=0.0, max_changes=1)
+        watcher2.start()
+        write_file(os.path.join(src, 'g'), 'ggg')
+        watcher2.check()
+        self.assertIn('changelist-00001.xml', os.listdir(out))
+
+    def test04_publish_replaces_file(self):
+        (watcher, src, out) = self.make_watcher('test04', False)
+        changelist = os.path.join(out, 'changelist.xml')
+        with open(changelist, 'rb') as fh:
+            write_file(os.path.join(src, 'c'), 'ccc')
+            watcher.check()
+            # A reader of the old file still sees the whole old document
+            self.assertNotIn(b'http://ex.org/c', fh.read())
+        with open(changelist, 'rb') as fh:
+            self.assertIn(b'http://ex.org/c', fh.read())
+        self.assertEqual(sorted(os.listdir(out)), ['changelist.xml'])
+        # Temporary files written before renaming are not changes
+        self.assertTrue(watcher.is_output(os.path.join(out, '.tmp-abc123changelist.xml')))
+        self.assertFalse(watcher.is_output(os.path.join(src, '.tmp-abc123changelist.xml')))
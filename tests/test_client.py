@@ -6,11 +6,21 @@ import logging
 from testfixtures import LogCapture
 import sys
 import os.path
+import threading
+import zipfile
 
-from resync.client import Client, ClientError, ClientFatalError
+from resync.client import Client, ClientError, ClientFatalError, ResumeTimes
+from resync.client_state import ClientState
 from resync.resource import Resource
 from resync.resource_list import ResourceList
 from resync.change_list import ChangeList
+from resync.archives import ChangeListArchive
+from resync.change_dump import ChangeDump
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.capability_list import CapabilityList
+from resync.dump import Dump
+from resync.w3c_datetime import datetime_to_str
+from resync.resource_dump import ResourceDump
 
 logging.basicConfig(level=logging.INFO)
 
@@ -25,6 +35,7 @@ class TestClient(TestCase):
 
     def test02_bad_source_uri(self):
         c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test02_status.cfg')
         self.assertRaises(ClientFatalError, c.baseline_or_audit)
         c.set_mappings(['http://example.org/bbb', '/tmp/this_does_not_exist'])
         self.assertRaises(ClientFatalError, c.baseline_or_audit)
@@ -49,6 +60,7 @@ class TestClient(TestCase):
 
     def test05_find_resource_list(self):
         c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test05_status.cfg')
         # Filesystem tests
         c.set_mappings(['tests/testdata/find/find1', 'xxx'])
         self.assertEqual(c.find_resource_list().up, 'find1')
@@ -71,10 +83,38 @@ class TestClient(TestCase):
             c.set_mappings(['http://localhost:9999/data/data1', 'xxx'])
             self.assertEqual(c.find_resource_list().up, 'find3')
 
+    def test06_find_resource_list_cached(self):
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'discovery_status.cfg')
+        c.set_mappings(['tests/testdata/find/find3', 'xxx'])
+        # Not cached by default
+        self.assertEqual(c.find_resource_list().up, 'find3')
+        self.assertFalse(os.path.exists(c.status_file))
+        c.discovery_ttl = 86400
+        with LogCapture() as lc:
+            self.assertEqual(c.find_resource_list().up, 'find3')
+            self.assertFalse(any('cached' in r.msg for r in lc.records))
+        with LogCapture() as lc:
+            self.assertEqual(c.find_resource_list().up, 'find3')
+            self.assertEqual(lc.records[0].msg,
+                             'Using cached discovery of resource list tests/testdata/find/find3/sitemap.xml')
+        # Disabled
+        c.discovery_ttl = 0
+        with LogCapture() as lc:
+            self.assertEqual(c.find_resource_list().up, 'find3')
+            self.assertFalse(any('cached' in r.msg for r in lc.records))
+        # Cached value that fails falls back to discovery
+        c.discovery_ttl = 100
+        ClientState(c.status_file).set_discovery(c.sitemap, {'resourcelist': 'tests/testdata/find/not_there.xml'})
+        self.assertEqual(c.find_resource_list().up, 'find3')
+        self.assertEqual(ClientState(c.status_file).get_discovery(c.sitemap)['resourcelist'],
+                         'tests/testdata/find/find3/sitemap.xml')
+
     def test10_baseline_or_audit(self):
         # FIXME - this is the guts of the client, tough to test, need to work
         # through more cases...
         c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test10_status.cfg')
         dst = os.path.join(self.tmpdir, 'dst_dir1')
         with webserver('tests/testdata/client', 'localhost', 9999):
             c.set_mappings(['http://localhost:9999/dir1', dst])
@@ -91,6 +131,271 @@ class TestClient(TestCase):
                     re.match(r'Status:\s+SYNCED.*created=3', lc.records[-2].msg))
                 self.assertEqual(lc.records[-1].msg, 'Completed baseline sync')
 
+    def test11_baseline_from_dump(self):
+        src = os.path.join(self.tmpdir, 'test11_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test11_src'
+        for j in range(0, 5):
+            with open(os.path.join(src, 'r%d' % (j)), 'w') as fh:
+                fh.write('resource %d' % (j))
+        c = Client()
+        c.set_mappings([base, src])
+        rl = c.build_resource_list(set_path=True)
+        rl.write(basename=os.path.join(src, 'resourcelist.xml'))
+        Dump(rl).write(basename=os.path.join(src, 'dump_'), write_separate_manifests=False)
+        rd = ResourceDump()
+        rd.add(Resource(base + '/dump_00000.zip'))
+        rd.write(basename=os.path.join(src, 'resourcedump.xml'))
+        capl = CapabilityList()
+        capl.add_capability(uri=base + '/resourcelist.xml', name='resourcelist')
+        capl.add_capability(uri=base + '/resourcedump.xml', name='resourcedump')
+        capl.write(basename=os.path.join(src, 'capabilitylist.xml'))
+        # Remove one resource from dump, it should be fetched individually
+        rl.add(Resource(base + '/extra', length=5))
+        with open(os.path.join(src, 'extra'), 'w') as fh:
+            fh.write('extra')
+        rl.write(basename=os.path.join(src, 'resourcelist.xml'))
+        # Streaming extraction with 1 worker, download then extract otherwise
+        for workers in (1, 2):
+            dst = os.path.join(self.tmpdir, 'test11_dst%d' % (workers))
+            c = Client()
+            c.status_file = os.path.join(self.tmpdir, 'test11_status.cfg')
+            c.use_dumps = True
+            c.dump_workers = workers
+            c.set_mappings([base, dst])
+            c.capability_list_uri = base + '/capabilitylist.xml'
+            with webserver(self.tmpdir, 'localhost', 9999):
+                with LogCapture() as lc:
+                    c.baseline_or_audit()
+            msgs = [r.getMessage() for r in lc.records]
+            self.assertIn('Copied 5 resources from dump, 1 left to GET', msgs)
+            self.assertTrue(re.match(r'Status:\s+SYNCED.*created=6', msgs[-2]))
+            self.assertEqual(sorted(os.listdir(dst)), ['extra', 'r0', 'r1', 'r2', 'r3', 'r4'])
+            with open(os.path.join(dst, 'r3'), 'r') as fh:
+                self.assertEqual(fh.read(), 'resource 3')
+
+    def test12_incremental_from_archive(self):
+        src = os.path.join(self.tmpdir, 'test12_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test12_src'
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(src, name), 'w') as fh:
+                fh.write('resource ' + name)
+        # Archived change lists for days 1 and 2, current from day 3
+        day = 86400
+        cla = ChangeListArchive()
+        for (n, name) in ((1, 'a'), (2, 'b')):
+            cl = ChangeList()
+            cl.md_from = datetime_to_str(n * day)
+            cl.md_until = datetime_to_str((n + 1) * day)
+            cl.add(Resource.from_values(base + '/' + name, timestamp=n * day + 10, length=10,
+                                        change='created', ts_datetime=n * day + 10))
+            cl.write(basename=os.path.join(src, 'changelist%d.xml' % (n)))
+            cla.add(Resource(uri='changelist%d.xml' % (n), ts_from=n * day, ts_until=(n + 1) * day))
+        cla.write(basename=os.path.join(src, 'changelist-archive.xml'))
+        cl = ChangeList()
+        cl.md_from = datetime_to_str(3 * day)
+        cl.add(Resource.from_values(base + '/c', timestamp=3 * day + 10, length=10,
+                                    change='created', ts_datetime=3 * day + 10))
+        cl.write(basename=os.path.join(src, 'changelist.xml'))
+        dst = os.path.join(self.tmpdir, 'test12_dst')
+        os.mkdir(dst)
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test12_status.cfg')
+        c.set_mappings([base, dst])
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.incremental(change_list_uri=base + '/changelist.xml',
+                              from_datetime='1970-01-03T00:00:05Z',
+                              change_list_archive_uri=base + '/changelist-archive.xml')
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertIn('Reading 1 of 2 archived change lists', msgs)
+        self.assertEqual(sorted(os.listdir(dst)), ['b', 'c'])
+        # Without an archive the gap is reported
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test12_status_noarchive.cfg')
+        c.set_mappings([base, dst])
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.incremental(change_list_uri=base + '/changelist.xml',
+                              from_datetime='1970-01-03T00:00:05Z')
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertTrue([m for m in msgs if 'no change list archive' in m])
+
+    def test13_incremental_from_archive_parallel(self):
+        src = os.path.join(self.tmpdir, 'test13_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test13_src'
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(src, name), 'w') as fh:
+                fh.write('resource ' + name)
+        day = 86400
+        # Day 3 is missing from the archive
+        changes = {1: [('a', 'created')], 2: [('a', 'updated'), ('b', 'created')],
+                   4: [('c', 'created')], 5: [('b', 'updated')]}
+        cla = ChangeListArchive()
+        for (n, entries) in sorted(changes.items()):
+            cl = ChangeList()
+            cl.md_from = datetime_to_str(n * day)
+            for (j, (name, change)) in enumerate(entries):
+                cl.add(Resource.from_values(base + '/' + name, timestamp=n * day + j, length=10,
+                                            change=change, ts_datetime=n * day + j))
+            if (n == 5):
+                cl.write(basename=os.path.join(src, 'changelist.xml'))
+                continue
+            cl.md_until = datetime_to_str((n + 1) * day)
+            cl.write(basename=os.path.join(src, 'changelist%d.xml' % (n)))
+            cla.add(Resource(uri='changelist%d.xml' % (n), ts_from=n * day, ts_until=(n + 1) * day))
+        cla.write(basename=os.path.join(src, 'changelist-archive.xml'))
+        dst = os.path.join(self.tmpdir, 'test13_dst')
+        os.mkdir(dst)
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test13_status.cfg')
+        c.archive_workers = 3
+        c.set_mappings([base, dst])
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.incremental(change_list_uri=base + '/changelist.xml',
+                              from_datetime='1970-01-02T00:00:00Z',
+                              change_list_archive_uri=base + '/changelist-archive.xml')
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertIn('Reading 3 of 3 archived change lists', msgs)
+        self.assertIn('Change list archive %s/changelist-archive.xml has no change list for '
+                      '1970-01-04T00:00:00Z, changes may be missed' % (base), msgs)
+        # Changes for a and b are folded to one each
+        self.assertIn('Removed 2 prior changes', msgs)
+        self.assertEqual(sorted(os.listdir(dst)), ['a', 'b', 'c'])
+
+    def test14_incremental_checkpoint(self):
+        src = os.path.join(self.tmpdir, 'test14_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test14_src'
+        cl = ChangeList()
+        for (name, ts) in (('a', 1000), ('b', 2000), ('c', 3000)):
+            cl.add(Resource.from_values(base + '/' + name, timestamp=ts, length=10,
+                                        change='created', ts_datetime=ts))
+        cl.write(basename=os.path.join(src, 'changelist.xml'))
+        for name in ('a', 'c'):
+            with open(os.path.join(src, name), 'w') as fh:
+                fh.write('resource ' + name)
+        dst = os.path.join(self.tmpdir, 'test14_dst')
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test14_status.cfg')
+        c.checkpoint_interval = 3600
+        c.set_mappings([base, dst])
+        # GET of b fails, the checkpoint allows the next sync to start from it
+        with webserver(self.tmpdir, 'localhost', 9999):
+            self.assertRaises(ClientFatalError, c.incremental,
+                              change_list_uri=base + '/changelist.xml',
+                              from_datetime='1970-01-01T00:00:00Z')
+        self.assertEqual(ClientState(c.status_file).get_state(c.sitemap), 2000)
+        with open(os.path.join(src, 'b'), 'w') as fh:
+            fh.write('resource b')
+        c.checkpoint_interval = 0
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.incremental(change_list_uri=base + '/changelist.xml')
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertIn('Skipped 1 changes before 1970-01-01T00:33:20Z', msgs)
+        self.assertEqual(sorted(os.listdir(dst)), ['a', 'b', 'c'])
+        self.assertEqual(ClientState(c.status_file).get_state(c.sitemap), 3000)
+
+    def test15_baseline_resume(self):
+        src = os.path.join(self.tmpdir, 'test15_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test15_src'
+        for (name, ts) in (('r0', 1000), ('r1', 3000), ('r2', 2000)):
+            with open(os.path.join(src, name), 'w') as fh:
+                fh.write('resource ' + name)
+            os.utime(os.path.join(src, name), (ts, ts))
+        c = Client()
+        c.set_mappings([base, src])
+        rl = c.build_resource_list(set_path=True)
+        rl.write(basename=os.path.join(src, 'resourcelist.xml'))
+        os.rename(os.path.join(src, 'r2'), os.path.join(src, 'r2.tmp'))
+        dst = os.path.join(self.tmpdir, 'test15_dst')
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test15_status.cfg')
+        c.checkpoint_interval = 3600
+        c.set_mappings([base, dst])
+        # GET of r2 fails, r0 and r1 were copied
+        with webserver(self.tmpdir, 'localhost', 9999):
+            self.assertRaises(ClientFatalError, c.baseline_or_audit)
+        cs = ClientState(c.status_file)
+        self.assertEqual(cs.get_state(c.sitemap), None)
+        checkpoint = cs.get_checkpoint(c.sitemap)
+        self.assertEqual(checkpoint['done'], 2)
+        self.assertEqual(checkpoint['last_timestamp'], 3000)
+        # Resume copies only r2 and keeps the last timestamp of r1
+        os.rename(os.path.join(src, 'r2.tmp'), os.path.join(src, 'r2'))
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.baseline_or_audit()
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertTrue([m for m in msgs if m.startswith('Resuming baseline sync interrupted')])
+        self.assertIn('Will GET 1 resources', msgs)
+        self.assertEqual(sorted(os.listdir(dst)), ['r0', 'r1', 'r2'])
+        self.assertEqual(cs.get_state(c.sitemap), 3000)
+        self.assertEqual(cs.get_checkpoint(c.sitemap), None)
+
+    def test16_incremental_archive_fold(self):
+        src = os.path.join(self.tmpdir, 'test16_src')
+        os.mkdir(src)
+        base = 'http://localhost:9999/test16_src'
+        day = 86400
+        # a is created in the archive and deleted in the current list, b was
+        # updated in the archive then created and deleted in the current list
+        cl = ChangeList()
+        cl.md_from = datetime_to_str(day)
+        cl.md_until = datetime_to_str(2 * day)
+        cl.add(Resource.from_values(base + '/a', timestamp=day + 1, length=10,
+                                    change='created', ts_datetime=day + 1))
+        cl.add(Resource.from_values(base + '/b', timestamp=day + 2, length=10,
+                                    change='updated', ts_datetime=day + 2))
+        cl.write(basename=os.path.join(src, 'changelist1.xml'))
+        cla = ChangeListArchive()
+        cla.add(Resource(uri='changelist1.xml', ts_from=day, ts_until=2 * day))
+        cla.write(basename=os.path.join(src, 'changelist-archive.xml'))
+        cl = ChangeList()
+        cl.md_from = datetime_to_str(2 * day)
+        for (j, (name, change)) in enumerate((('a', 'deleted'), ('b', 'created'), ('b', 'deleted'))):
+            cl.add(Resource.from_values(base + '/' + name, timestamp=2 * day + j, length=10,
+                                        change=change, ts_datetime=2 * day + j))
+        cl.write(basename=os.path.join(src, 'changelist.xml'))
+        dst = os.path.join(self.tmpdir, 'test16_dst')
+        os.mkdir(dst)
+        with open(os.path.join(dst, 'b'), 'w') as fh:
+            fh.write('old b')
+        c = Client()
+        c.status_file = os.path.join(self.tmpdir, 'test16_status.cfg')
+        c.set_mappings([base, dst])
+        with webserver(self.tmpdir, 'localhost', 9999):
+            with LogCapture() as lc:
+                c.incremental(allow_deletion=True,
+                              change_list_uri=base + '/changelist.xml',
+                              from_datetime='1970-01-02T00:00:00Z',
+                              change_list_archive_uri=base + '/changelist-archive.xml')
+        msgs = [r.getMessage() for r in lc.records]
+        self.assertIn('Removed 4 prior changes', msgs)
+        self.assertTrue([m for m in msgs if re.match(r'Status:.*created=0, updated=0, deleted=1', m)])
+        self.assertEqual(os.listdir(dst), [])
+
+    def test17_resume_times(self):
+        times = [10, 20, 15, 30, 30, 25, 40]
+        changes = [(Resource('http://ex.org/r%d' % (j), timestamp=ts, change='updated'), 'updated')
+                   for (j, ts) in enumerate(times)]
+        resume = ResumeTimes(lambda: iter(changes), 99)
+        # Only the changes out of time order are kept from the first pass
+        self.assertEqual(list(resume.late), [(2, 15), (5, 25)])
+        it = iter(resume)
+        expected = [min(times[n:]) for n in range(0, len(times))] + [99]
+        for n in range(0, len(times)):
+            self.assertEqual(next(it), changes[n])
+            self.assertEqual(resume.resume_from(n), expected[n])
+            self.assertEqual(resume.resume_from(n + 1), expected[n + 1])
+        self.assertEqual(list(it), [])
+        self.assertEqual(resume.resume_from(len(times)), 99)
+
     def test18_update_resource(self):
         c = Client()
         resource = Resource(uri='http://example.org/dir/2')
@@ -335,10 +640,31 @@ class TestClient(TestCase):
         c = Client()
         # no dump file
         self.assertFalse(c.write_dump_if_requested(ChangeList(), None))
-        # with dump file
-        with capture_stdout() as capturer:
-            c.write_dump_if_requested(ChangeList(), '/tmp/a_file')
-        self.assertRegex(capturer.result, r'FIXME')
+        # with dump file, created resources packaged and deletions in manifest only
+        src = os.path.join(self.tmpdir, 'test48_src')
+        os.mkdir(src)
+        with open(os.path.join(src, 'a'), 'w') as fh:
+            fh.write('aaa')
+        c.set_mappings(['http://ex.org/', src])
+        cl = ChangeList()
+        cl.add(Resource('http://ex.org/a', timestamp=10, length=3, change='created',
+                        path=os.path.join(src, 'a')))
+        cl.add(Resource('http://ex.org/b', timestamp=20, change='deleted'))
+        dump = os.path.join(src, 'changedump.xml')
+        self.assertEqual(c.write_dump_if_requested(cl, dump), 1)
+        cd = ChangeDump()
+        cd.parse(uri=dump)
+        package = list(cd)[0]
+        self.assertEqual(package.uri, 'http://ex.org/changedump_00000.zip')
+        self.assertEqual(package.mime_type, 'application/zip')
+        self.assertEqual(package.ts_until, 20)
+        with zipfile.ZipFile(os.path.join(src, 'changedump_00000.zip')) as zf:
+            self.assertEqual(zf.namelist(), ['manifest.xml', 'a'])
+            cdm = ChangeDumpManifest()
+            cdm.parse(str_data=zf.read('manifest.xml').decode('utf-8'))
+        self.assertEqual([(r.uri, r.change, r.path) for r in cdm],
+                         [('http://ex.org/a', 'created', 'a'),
+                          ('http://ex.org/b', 'deleted', None)])
 
     def test49_read_reference_resource_list(self):
         c = Client()
@@ -392,3 +718,24 @@ class TestClient(TestCase):
             c.log_status(in_sync=False)
             self.assertEqual(lc.records[-1].msg,
                              'Status:          SYNCED (created=0, updated=0, deleted=0)')
+
+    def test51_start_probe(self):
+        c = Client()
+        release = threading.Event()
+
+        def slow(uri):
+            release.wait(10)
+            return({'resourcelist': uri})
+        future = c.start_probe(slow, 'http://example.org/slow')
+        # The probe thread is a daemon and is left running if not wanted
+        threads = [t for t in threading.enumerate() if t.name == 'probe http://example.org/slow']
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].daemon)
+        self.assertFalse(future.done())
+        release.set()
+        self.assertEqual(future.result(5), {'resourcelist': 'http://example.org/slow'})
+
+        def bad(uri):
+            raise ClientError('no ' + uri)
+        future = c.start_probe(bad, 'x')
+        self.assertRaises(ClientError, future.result, 5)
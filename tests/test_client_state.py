@@ -1,6 +1,8 @@
 from .testlib import TestCase
 
+import multiprocessing
 import os.path
+import threading
 from resync.client_state import ClientState
 
 
@@ -13,9 +15,112 @@ class TestClientState(TestCase):
         # Get state
         site = 'https://this.site/'
         self.assertEqual(cs.get_state(site), None)
+        # Reading or removing nothing writes no files
+        cs.set_state(site)
+        self.assertFalse(os.path.exists(cs.status_file))
         cs.set_state(site, 123)
         self.assertEqual(cs.get_state(site), 123)
+        self.assertFalse(os.path.exists(cs.status_file + '.lock'))
         cs.set_state(site, 456)
         self.assertEqual(cs.get_state(site), 456)
         cs.set_state(site)
         self.assertEqual(cs.get_state(site), None)
+
+    def test02_discovery(self):
+        cs = ClientState(os.path.join(self.tmpdir, 'discovery.cfg'))
+        site = 'https://this.site/resourcelist.xml'
+        self.assertEqual(cs.get_discovery(site), None)
+        found = {'resourcelist': 'https://this.site/rl%20a.xml', 'changelist': None}
+        cs.set_discovery(site, found)
+        got = cs.get_discovery(site, max_age=100)
+        self.assertEqual(got['resourcelist'], 'https://this.site/rl%20a.xml')
+        self.assertEqual(got['changelist'], None)
+        self.assertEqual(cs.get_discovery(site, max_age=-1), None)
+        # Incremental state is independent
+        cs.set_state(site, 123)
+        self.assertEqual(cs.get_state(site), 123)
+        self.assertEqual(cs.get_discovery(site)['resourcelist'], 'https://this.site/rl%20a.xml')
+        cs.set_discovery(site)
+        self.assertEqual(cs.get_discovery(site), None)
+
+    def test03_update(self):
+        cs = ClientState(os.path.join(self.tmpdir, 'update.cfg'))
+        site = 'https://this.site/'
+        with cs.update():
+            cs.set_state(site, 123)
+            cs.set_checkpoint(site, {'done': 5})
+            # Not written until the end of the update
+            self.assertEqual(ClientState(cs.status_file).get_state(site), None)
+            self.assertEqual(cs.get_state(site), 123)
+        self.assertEqual(ClientState(cs.status_file).get_state(site), 123)
+        self.assertEqual(cs.get_checkpoint(site)['done'], 5)
+        # An exception abandons the update
+        try:
+            with cs.update():
+                cs.set_state(site, 456)
+                raise ValueError('stop')
+        except ValueError:
+            pass
+        self.assertEqual(cs.get_state(site), 123)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)).count('update.cfg'), 1)
+        self.assertEqual([f for f in os.listdir(self.tmpdir) if f.startswith('.tmp-')], [])
+
+    def test04_concurrent_updates(self):
+        status_file = os.path.join(self.tmpdir, 'concurrent.cfg')
+
+        def worker(n):
+            for j in range(0, 20):
+                ClientState(status_file).set_state('site%d' % (n), j)
+                ClientState(status_file).set_discovery('site%d' % (n), {'resourcelist': j})
+        # Processes are started first as forking while other threads hold
+        # locks can deadlock the child
+        processes = [multiprocessing.Process(target=worker, args=(n,)) for n in range(0, 4)]
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4, 12)]
+        for t in processes + threads:
+            t.start()
+        for t in processes + threads:
+            t.join()
+        self.assertFalse(os.path.exists(status_file + '.lock'))
+        cs = ClientState(status_file)
+        for n in range(0, 12):
+            self.assertEqual(cs.get_state('site%d' % (n)), 19)
+            self.assertEqual(cs.get_discovery('site%d' % (n))['resourcelist'], 19)
+
+    def test05_checkpoint(self):
+        cs = ClientState(os.path.join(self.tmpdir, 'checkpoint.cfg'))
+        site = 'https://this.site/'
+        self.assertEqual(cs.get_checkpoint(site), None)
+        cs.set_checkpoint(site, {'done': 10, 'last_timestamp': 1234.5})
+        cp = cs.get_checkpoint(site)
+        self.assertEqual(cp['done'], 10)
+        self.assertEqual(cp['last_timestamp'], 1234.5)
+        self.assertTrue(cp['time'] > 0)
+        cs.set_state(site, 99)
+        self.assertEqual(cs.get_checkpoint(site)['done'], 10)
+        cs.set_checkpoint(site)
+        self.assertEqual(cs.get_checkpoint(site), None)
+        self.assertEqual(cs.get_state(site), 99)
+        # Empty section is removed
+        with open(cs.status_file, 'r') as fh:
+            self.assertNotIn('checkpoint', fh.read())
+
+    def test06_update_shared_between_threads(self):
+        cs = ClientState(os.path.join(self.tmpdir, 'shared.cfg'))
+        seen = []
+
+        def other():
+            # Must wait for the update of the main thread, not join it
+            with cs.update() as parser:
+                seen.append(parser.has_section('incremental'))
+                cs.set_state('site2', 2)
+        with cs.update():
+            cs.set_state('site1', 1)
+            t = threading.Thread(target=other)
+            t.start()
+            t.join(0.2)
+            self.assertTrue(t.is_alive())
+            self.assertEqual(seen, [])
+        t.join()
+        self.assertEqual(seen, [True])
+        self.assertEqual(cs.get_state('site1'), 1)
+        self.assertEqual(cs.get_state('site2'), 2)
@@ -3,7 +3,7 @@ from .testlib import TestCase
 import os.path
 import zipfile
 
-from resync.dump import Dump, DumpError
+from resync.dump import Dump, DumpError, byte_entropy, raw_members_supported, WarcReader, read_cdx
 from resync.resource_list import ResourceList
 from resync.change_list import ChangeList
 from resync.resource import Resource
@@ -135,6 +135,160 @@ class TestDump(TestCase):
         zo.close()
         os.unlink(zipf)
 
+    def test05_parallel_write(self):
+        src = os.path.join(self.tmpdir, 'test05_src')
+        os.mkdir(src)
+        rl = ResourceList()
+        for j in range(0, 10):
+            fname = os.path.join(src, 'f%02d' % (j))
+            with open(fname, 'wb') as fh:
+                # mix of small files and ones above parallel_min_size
+                fh.write((b'line %d of some text\n' % (j)) * (j * 1000 + 1))
+            rl.add(Resource('http://ex.org/f%02d' % (j), path=fname))
+        d = Dump(rl, workers=3)
+        d.parallel_min_size = 50000
+        d.max_files = 4
+        tmpbase = os.path.join(self.tmpdir, 'test05_')
+        self.assertEqual(d.write(tmpbase), 3)
+        self.assertEqual(d.pool, None)
+        names = []
+        for n in range(0, 3):
+            with zipfile.ZipFile(tmpbase + '%05d.zip' % (n), 'r') as zo:
+                self.assertEqual(zo.testzip(), None)
+                self.assertEqual(zo.namelist()[0], 'manifest.xml')
+                for name in zo.namelist()[1:]:
+                    info = zo.getinfo(name)
+                    self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                    with open(os.path.join(src, name), 'rb') as fh:
+                        self.assertEqual(zo.read(name), fh.read())
+                    names.append(name)
+        self.assertEqual(names, ['f%02d' % (j) for j in range(0, 10)])
+
+    def test06_store_incompressible(self):
+        src = os.path.join(self.tmpdir, 'test06_src')
+        os.mkdir(src)
+        files = {'a.txt': b'some text ' * 10000,
+                 'b.jpg': b'not really a jpeg ' * 1000,
+                 'c': os.urandom(100000),
+                 'd': b'\x00\x01' * 50000}
+        rl = ResourceList()
+        for name in sorted(files):
+            with open(os.path.join(src, name), 'wb') as fh:
+                fh.write(files[name])
+            rl.add(Resource('http://ex.org/' + name, path=os.path.join(src, name)))
+        rl.resources['http://ex.org/d'].mime_type = 'image/png'
+        for workers in (1, 2):
+            d = Dump(rl, workers=workers)
+            tmpbase = os.path.join(self.tmpdir, 'test06_%d_' % (workers))
+            self.assertEqual(d.write(tmpbase, write_separate_manifests=False), 1)
+            with zipfile.ZipFile(tmpbase + '00000.zip', 'r') as zo:
+                self.assertEqual(zo.testzip(), None)
+                self.assertEqual(zo.getinfo('a.txt').compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zo.getinfo('b.jpg').compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zo.getinfo('c').compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zo.getinfo('d').compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zo.read('c'), files['c'])
+            stats = d.compression_stats
+            self.assertEqual(sorted(stats.keys()),
+                             ['application/octet-stream', 'image/jpeg', 'image/png', 'text/plain'])
+            self.assertEqual(stats['text/plain']['stored'], 0)
+            self.assertTrue(stats['text/plain']['bytes_out'] < 1000)
+            self.assertEqual(stats['image/jpeg']['stored'], 1)
+            report = d.compression_report()
+            self.assertEqual(len(report), 5)
+            self.assertTrue(report[-1].startswith('Estimated '))
+            # Paths are not changed
+            self.assertEqual(rl.resources['http://ex.org/c'].path, os.path.join(src, 'c'))
+        # Everything stored without compression
+        d = Dump(rl, compress=False)
+        self.assertEqual(d.compression_for(rl.resources['http://ex.org/a.txt'],
+                                           os.path.join(src, 'a.txt')),
+                         zipfile.ZIP_STORED)
+
+    def test07_byte_entropy(self):
+        self.assertEqual(byte_entropy(b''), 0.0)
+        self.assertEqual(byte_entropy(b'aaaa'), 0.0)
+        self.assertAlmostEqual(byte_entropy(b'abab'), 1.0)
+        self.assertAlmostEqual(byte_entropy(bytes(range(256))), 8.0)
+
+    def test08_single_pass_write(self):
+        src = os.path.join(self.tmpdir, 'test08_src')
+        rl = ResourceList()
+        for d in ('x/one', 'x/two'):
+            os.makedirs(os.path.join(src, d))
+            for j in range(0, 5):
+                fname = os.path.join(src, d, 'f%d' % (j))
+                with open(fname, 'w') as fh:
+                    fh.write('%s %d' % (d, j))
+                rl.add(Resource('http://ex.org/%s/f%d' % (d, j), path=fname))
+        d = Dump(rl)
+        d.stat_batch_size = 3
+        d.max_files = 5
+        tmpbase = os.path.join(self.tmpdir, 'test08_')
+        self.assertEqual(d.write(tmpbase), 2)
+        self.assertEqual(d.total_size, 10 * 7)
+        self.assertEqual(d.path_prefix, None)
+        # Each dump file has paths relative to its own files
+        for n in (0, 1):
+            with zipfile.ZipFile(tmpbase + '%05d.zip' % (n), 'r') as zo:
+                self.assertEqual(zo.namelist(), ['manifest.xml', 'f0', 'f1', 'f2', 'f3', 'f4'])
+            rdm = ResourceDumpManifest()
+            rdm.read(tmpbase + '%05d.xml' % (n))
+            self.assertEqual([r.path for r in rdm], ['f0', 'f1', 'f2', 'f3', 'f4'])
+        self.assertEqual(rl.resources['http://ex.org/x/two/f3'].path,
+                         os.path.join(src, 'x/two/f3'))
+        # check_files sets a prefix for all
+        self.assertTrue(d.check_files())
+        self.assertEqual(d.path_prefix, os.path.join(src, 'x'))
+        self.assertEqual(d.write(tmpbase), 2)
+        with zipfile.ZipFile(tmpbase + '00001.zip', 'r') as zo:
+            self.assertEqual(zo.namelist()[1], 'two/f0')
+
+    def test09_warc(self):
+        rl = ResourceList()
+        rl.add(Resource('http://ex.org/a', length=7, path='tests/testdata/a',
+                        timestamp=1000000000, mime_type='text/plain'))
+        rl.add(Resource('http://ex.org/b', length=21, path='tests/testdata/b',
+                        sha1='a31a6c1b1a4d1ae15ed8b5d6c1e3c5f7d9a4c9ad'))
+        rl.add(Resource('http://ex.org/c', change='deleted'))
+        for compress in (True, False):
+            d = Dump(rl, format='warc', compress=compress)
+            d.resources = ResourceList()
+            for r in rl:
+                if (r.sha1 is None):
+                    d.resources.add(r)
+            tmpbase = os.path.join(self.tmpdir, 'test09_%d_' % (compress))
+            self.assertEqual(d.write(tmpbase), 1)
+            warcfile = tmpbase + '00000.warc' + ('.gz' if compress else '')
+            self.assertEqual(d.packages[0].path, warcfile)
+            with open(warcfile, 'rb') as fh:
+                records = [(r.type, r.uri, r.content_type, r.read()) for r in WarcReader(fh)]
+            self.assertEqual(records[0][0:2], ('warcinfo', None))
+            self.assertEqual(records[1:], [('resource', 'http://ex.org/a', 'text/plain',
+                                            b'A file\n')])
+            cdx = list(read_cdx(tmpbase + '00000.cdx'))
+            self.assertEqual(len(cdx), 1)
+            self.assertEqual(cdx[0]['uri'], 'http://ex.org/a')
+            self.assertEqual(cdx[0]['timestamp'], '20010909014640')
+            with open(warcfile, 'rb') as fh:
+                record = WarcReader(fh).record_at(cdx[0]['offset'])
+                self.assertEqual(record.uri, 'http://ex.org/a')
+                self.assertEqual(record.read(3), b'A f')
+                self.assertEqual(record.read(), b'ile\n')
+        # Known SHA-1 must match content
+        d = Dump(rl, format='warc')
+        self.assertRaises(DumpError, d.write, os.path.join(self.tmpdir, 'test09_bad_'))
+        # Corrupt payload is detected when read
+        warcfile = os.path.join(self.tmpdir, 'test09_0_00000.warc')
+        with open(warcfile, 'rb') as fh:
+            data = fh.read()
+        with open(warcfile, 'wb') as fh:
+            fh.write(data.replace(b'A file', b'A fila'))
+        with open(warcfile, 'rb') as fh:
+            with self.assertRaises(DumpError):
+                for record in WarcReader(fh):
+                    record.read()
+
     def test10_no_path(self):
         rl = ResourceList()
         rl.add(Resource('http://ex.org/a', length=7, path='tests/testdata/a'))
@@ -162,3 +316,24 @@ class TestDump(TestCase):
         d = Dump(rl)
         self.assertTrue(d.check_files(check_length=False))
         self.assertRaises(DumpError, d.check_files)
+
+    def test12_deflated_member_fallback(self):
+        zipname = os.path.join(self.tmpdir, 'test12.zip')
+        zf = zipfile.ZipFile(zipname, 'w', allowZip64=True)
+        self.assertTrue(raw_members_supported(zf))
+        d = Dump(ResourceList())
+        d.write_deflated_member(zf, Resource('http://ex.org/a', path='a'), 'tests/testdata/a')
+        zf.close()
+        # mode 'a' is not supported, falls back to ZipFile.write()
+        zf = zipfile.ZipFile(zipname, 'a', allowZip64=True)
+        self.assertFalse(raw_members_supported(zf))
+        d.write_deflated_member(zf, Resource('http://ex.org/b', path='b'), 'tests/testdata/b')
+        zf.close()
+        with zipfile.ZipFile(zipname, 'r') as zo:
+            self.assertFalse(raw_members_supported(zo))
+            self.assertEqual(zo.testzip(), None)
+            self.assertEqual(zo.namelist(), ['a', 'b'])
+            for name in ('a', 'b'):
+                self.assertEqual(zo.getinfo(name).compress_type, zipfile.ZIP_DEFLATED)
+                with open(os.path.join('tests/testdata', name), 'rb') as fh:
+                    self.assertEqual(zo.read(name), fh.read())
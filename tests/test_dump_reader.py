@@ -0,0 +1,146 @@
+from .testlib import TestCase
+
+import os.path
+import zipfile
+
+from resync.dump import Dump
+from resync.dump_reader import DumpReader, DumpReaderError
+from resync.mapper import Mapper
+from resync.resource import Resource
+from resync.resource_dump_manifest import ResourceDumpManifest
+from resync.resource_list_builder import ResourceListBuilder
+
+
+def make_dump(src, base_uri, basename, num=5):
+    """Write num files in src and a dump of them at basename, return ResourceList."""
+    os.mkdir(src)
+    os.mkdir(os.path.join(src, 'sub'))
+    for j in range(0, num):
+        with open(os.path.join(src, 'sub' if j % 2 else '', 'f%d' % (j)), 'w') as fh:
+            fh.write('file %d ' % (j) * (j + 1))
+    rlb = ResourceListBuilder(mapper=Mapper([base_uri, src]), set_hashes=['md5'])
+    rlb.set_path = True
+    rl = rlb.from_disk()
+    Dump(rl).write(basename=basename)
+    return(rl)
+
+
+class TestDumpReader(TestCase):
+
+    def test01_extract(self):
+        src = os.path.join(self.tmpdir, 'test01_src')
+        rl = make_dump(src, 'http://ex.org/', os.path.join(self.tmpdir, 'test01_'))
+        for workers in (1, 3):
+            dst = os.path.join(self.tmpdir, 'test01_dst%d' % (workers))
+            reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]), workers=workers)
+            extracted = reader.extract(os.path.join(self.tmpdir, 'test01_00000.zip'))
+            self.assertEqual([r.uri for r in extracted], rl.resources.uris())
+            self.assertEqual(sorted(os.listdir(dst)), ['f0', 'f2', 'f4', 'sub'])
+            self.assertEqual(sorted(os.listdir(os.path.join(dst, 'sub'))), ['f1', 'f3'])
+            with open(os.path.join(dst, 'sub', 'f3'), 'r') as fh:
+                self.assertEqual(fh.read(), 'file 3 file 3 file 3 file 3 ')
+
+    def test02_select(self):
+        src = os.path.join(self.tmpdir, 'test02_src')
+        rl = make_dump(src, 'http://ex.org/', os.path.join(self.tmpdir, 'test02_'))
+        dst = os.path.join(self.tmpdir, 'test02_dst')
+        reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]))
+        wanted = {'http://ex.org/f0': Resource(resource=rl.resources['http://ex.org/f0']),
+                  'http://ex.org/f2': Resource(uri='http://ex.org/f2', timestamp=1),
+                  'http://ex.org/sub/f3': Resource(uri='http://ex.org/sub/f3',
+                                                   timestamp=rl.resources['http://ex.org/sub/f3'].timestamp),
+                  'http://ex.org/not_in_dump': Resource(uri='http://ex.org/not_in_dump')}
+        extracted = reader.extract(os.path.join(self.tmpdir, 'test02_00000.zip'), wanted)
+        # f2 has different timestamp so not used
+        self.assertEqual([r.uri for r in extracted], ['http://ex.org/f0', 'http://ex.org/sub/f3'])
+        self.assertEqual(sorted(os.listdir(dst)), ['f0', 'sub'])
+
+    def test03_bad_packages(self):
+        dumpfile = os.path.join(self.tmpdir, 'test03.zip')
+        reader = DumpReader(mapper=Mapper(['http://ex.org/', os.path.join(self.tmpdir, 'test03_dst')]))
+        # Not a ZIP file
+        with open(dumpfile, 'w') as fh:
+            fh.write('not a zip')
+        self.assertRaises(DumpReaderError, reader.extract, dumpfile)
+        # No manifest
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('a', 'aaa')
+        self.assertRaises(DumpReaderError, reader.extract, dumpfile)
+        # Manifest does not match members
+        rdm = ResourceDumpManifest()
+        rdm.add(Resource('http://ex.org/a', length=4, path='/a'))
+        rdm.add(Resource('http://ex.org/b', length=3, path='/b'))
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('manifest.xml', rdm.as_xml())
+            zf.writestr('a', 'aaa')
+        with self.assertRaises(DumpReaderError) as cm:
+            reader.extract(dumpfile)
+        self.assertIn('size of /a is 3, not 4', str(cm.exception))
+        self.assertIn('missing /b', str(cm.exception))
+
+    def test04_digest_mismatch(self):
+        dumpfile = os.path.join(self.tmpdir, 'test04.zip')
+        dst = os.path.join(self.tmpdir, 'test04_dst')
+        rdm = ResourceDumpManifest()
+        rdm.add(Resource('http://ex.org/a', length=3, path='/a',
+                         md5='47bce5c74f589f4867dbd57e9ca9f808'))
+        rdm.add(Resource('http://ex.org/b', length=3, path='/b', md5='bad'))
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('manifest.xml', rdm.as_xml())
+            zf.writestr('a', 'aaa')
+            zf.writestr('b', 'bbb')
+        reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]))
+        extracted = reader.extract(dumpfile)
+        self.assertEqual([r.uri for r in extracted], ['http://ex.org/a'])
+        self.assertEqual(os.listdir(dst), ['a'])
+
+    def test05_extract_stream(self):
+        src = os.path.join(self.tmpdir, 'test05_src')
+        rl = make_dump(src, 'http://ex.org/', os.path.join(self.tmpdir, 'test05_'))
+        for read_ahead in (True, False):
+            dst = os.path.join(self.tmpdir, 'test05_dst%d' % (read_ahead))
+            reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]))
+            reader.chunk_size = 5  # lots of small reads
+            with open(os.path.join(self.tmpdir, 'test05_00000.zip'), 'rb') as fh:
+                extracted = reader.extract_stream(fh, read_ahead=read_ahead)
+            self.assertEqual([r.uri for r in extracted], rl.resources.uris())
+            with open(os.path.join(dst, 'sub', 'f3'), 'r') as fh:
+                self.assertEqual(fh.read(), 'file 3 file 3 file 3 file 3 ')
+        # Only wanted
+        dst = os.path.join(self.tmpdir, 'test05_dst_wanted')
+        reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]))
+        with open(os.path.join(self.tmpdir, 'test05_00000.zip'), 'rb') as fh:
+            extracted = reader.extract_stream(
+                fh, wanted={'http://ex.org/f4': rl.resources['http://ex.org/f4']})
+        self.assertEqual([r.uri for r in extracted], ['http://ex.org/f4'])
+        self.assertEqual(os.listdir(dst), ['f4'])
+
+    def test06_extract_stream_errors(self):
+        dumpfile = os.path.join(self.tmpdir, 'test06.zip')
+        dst = os.path.join(self.tmpdir, 'test06_dst')
+        reader = DumpReader(mapper=Mapper(['http://ex.org/', dst]))
+        rdm = ResourceDumpManifest()
+        rdm.add(Resource('http://ex.org/a', length=3, path='/a'))
+        rdm.add(Resource('http://ex.org/b', length=3, path='/b'))
+        # manifest.xml not first
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('a', 'aaa')
+            zf.writestr('manifest.xml', rdm.as_xml())
+        with open(dumpfile, 'rb') as fh:
+            self.assertRaises(DumpReaderError, reader.extract_stream, fh)
+        # Missing and wrong size members are not extracted
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('manifest.xml', rdm.as_xml())
+            zf.writestr('a', 'aaaa')
+        with open(dumpfile, 'rb') as fh:
+            self.assertEqual(reader.extract_stream(fh), [])
+        # Truncated stream
+        with zipfile.ZipFile(dumpfile, 'w') as zf:
+            zf.writestr('manifest.xml', rdm.as_xml())
+            zf.writestr('a', 'aaa')
+        with open(dumpfile, 'rb') as fh:
+            data = fh.read()
+        with open(dumpfile, 'wb') as fh:
+            fh.write(data[0:-150])
+        with open(dumpfile, 'rb') as fh:
+            self.assertRaises(DumpReaderError, reader.extract_stream, fh)
@@ -10,6 +10,8 @@ except ImportError:  # python3
 
 from resync.resource import Resource
 from resync.list_base_with_index import ListBaseWithIndex, ListBaseIndexError
+from resync.resource_list import ResourceList
+from resync.change_list import ChangeList
 from resync.sitemap import Sitemap, SitemapIndexError
 
 # etree gives ParseError in 2.7, ExpatError in 2.6
@@ -119,6 +121,61 @@ class TestListBaseWithIndex(unittest.TestCase):
         self.assertFalse(re.search(r'<loc>b</loc>', xml))
         self.assertTrue(re.search(r'<loc>c</loc>', xml))
 
+    def test19_as_xml_part_by_size(self):
+        r = [Resource(uri='http://example.org/r%03d' % (j)) for j in range(0, 30)]
+        lb = ResourceList()
+        for x in r:
+            lb.add(x)
+        # No size limit by default so parts are found without serializing
+        self.assertEqual(lb.max_sitemap_bytes, None)
+        lb.serialize_entries = None
+        lb.max_sitemap_entries = 8
+        self.assertEqual(lb.part_starts(), [0, 8, 16, 24])
+        self.assertEqual(lb.requires_multifile(), 4)
+        del lb.serialize_entries
+        lb.max_sitemap_entries = None
+        lb.max_sitemap_bytes = 800
+        starts = lb.part_starts()
+        self.assertGreater(len(starts), 2)
+        # Boundary table is kept until something changes
+        calls = []
+        serialize_entries = lb.serialize_entries
+        lb.serialize_entries = lambda it: calls.append(1) or serialize_entries(it)
+        uris = []
+        for n in range(0, len(starts)):
+            xml = lb.as_xml_part(part_number=n)
+            uris.extend(re.findall(r'<loc>(http://example.org/r\d+)</loc>', xml))
+        self.assertEqual(uris, [x.uri for x in r])
+        self.assertEqual(calls, [])
+        lb.add(Resource(uri='http://example.org/r999'))
+        lb.part_starts()
+        self.assertEqual(calls, [1])
+        lb.max_sitemap_bytes = 1000
+        self.assertLess(len(lb.part_starts()), len(starts))
+        self.assertEqual(calls, [1, 1])
+        # A ChangeList counts changes so boundaries are kept likewise
+        cl = ChangeList()
+        for x in r:
+            cl.add(Resource(uri=x.uri, change='created'))
+        cl.max_sitemap_entries = None
+        cl.max_sitemap_bytes = 1000
+        cl_starts = cl.part_starts()
+        self.assertGreater(len(cl_starts), 2)
+        self.assertNotEqual(cl.part_starts_key(), None)
+        cl.serialize_entries = None
+        self.assertEqual(cl.part_starts(), cl_starts)
+        del cl.serialize_entries
+        cl.resources[0] = Resource(uri='http://example.org/' + 'x' * 400, change='created')
+        self.assertLess(cl.part_starts()[1], cl_starts[1])
+        # A plain list may have an entry replaced without changing its
+        # length, so only the number of entries is used
+        lb = ListBaseWithIndex(resources=list(r))
+        lb.max_sitemap_bytes = 800
+        lb.max_sitemap_entries = 8
+        self.assertEqual(lb.part_starts_key(), None)
+        lb.serialize_entries = None
+        self.assertEqual(lb.part_starts(), [0, 8, 16, 24])
+
     def test20_index_as_xml(self):
         # Check XML for empty case
         lb = ListBaseWithIndex()
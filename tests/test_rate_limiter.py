@@ -0,0 +1,71 @@
+from .testlib import TestCase
+
+import asyncio
+import threading
+import time
+
+from resync.rate_limiter import TokenBucket, RateLimiter
+
+
+class TestRateLimiter(TestCase):
+
+    def test01_unlimited(self):
+        tb = TokenBucket()
+        for j in range(5):
+            self.assertEqual(tb.reserve(), 0.0)
+        self.assertEqual(tb.stats(), {'requests': 5, 'waits': 0,
+                                      'wait_time': 0.0, 'max_wait': 0.0})
+
+    def test02_reserve(self):
+        tb = TokenBucket(rate=10.0, burst=2)
+        # Full bucket allows burst requests with no wait
+        self.assertEqual(tb.reserve(), 0.0)
+        self.assertEqual(tb.reserve(), 0.0)
+        # Then reservations queue up at 1/rate intervals
+        self.assertAlmostEqual(tb.reserve(), 0.1, places=2)
+        self.assertAlmostEqual(tb.reserve(), 0.2, places=2)
+        st = tb.stats()
+        self.assertEqual(st['requests'], 4)
+        self.assertEqual(st['waits'], 2)
+        self.assertAlmostEqual(st['wait_time'], 0.3, places=2)
+        self.assertAlmostEqual(st['max_wait'], 0.2, places=2)
+        # Reconfigure starts from empty
+        tb.configure(rate=100.0, burst=1)
+        self.assertAlmostEqual(tb.reserve(), 0.01, places=2)
+
+    def test03_acquire_threads(self):
+        tb = TokenBucket(rate=50.0, burst=1)
+        before = time.monotonic()
+        threads = [threading.Thread(target=tb.acquire) for j in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # First immediate, the other 4 spaced at 0.02s
+        self.assertGreater(time.monotonic() - before, 0.075)
+        self.assertEqual(tb.stats()['requests'], 5)
+        self.assertEqual(tb.stats()['waits'], 4)
+
+    def test04_acquire_async(self):
+        rl = RateLimiter(delay=0.02, burst=1)
+
+        async def get_all():
+            await asyncio.gather(*[rl.acquire_async('http://a.example.org/%d' % j)
+                                   for j in range(5)])
+        loop = asyncio.new_event_loop()
+        before = time.monotonic()
+        loop.run_until_complete(get_all())
+        loop.close()
+        self.assertGreater(time.monotonic() - before, 0.075)
+        self.assertEqual(rl.stats()['a.example.org']['waits'], 4)
+
+    def test05_per_host(self):
+        rl = RateLimiter(delay=10.0, burst=1)
+        self.assertEqual(rl.rate, 0.1)
+        self.assertEqual(rl.bucket('http://a.example.org/1').reserve(), 0.0)
+        self.assertEqual(rl.bucket('http://b.example.org/1').reserve(), 0.0)
+        self.assertGreater(rl.bucket('http://a.example.org/2').reserve(), 9.0)
+        self.assertEqual(sorted(rl.stats().keys()), ['a.example.org', 'b.example.org'])
+        rl.configure(delay=None)
+        self.assertEqual(rl.rate, None)
+        self.assertEqual(rl.bucket('http://a.example.org/3').reserve(), 0.0)
@@ -316,3 +316,40 @@ class TestResource(unittest.TestCase):
         """Test error from bad change type."""
         cte = ChangeTypeError('unk')
         self.assertIn('ChangeTypeError: got unk, expected one of ', str(cte))
+
+    def test20_from_values(self):
+        """Test from_values fast constructor."""
+        r = Resource.from_values('uri:a', timestamp=10, length=99, change='created', path='/a')
+        self.assertEqual(r.uri, 'uri:a')
+        self.assertEqual(r.timestamp, 10)
+        self.assertEqual(r.length, 99)
+        self.assertEqual(r.change, 'created')
+        self.assertEqual(r.path, '/a')
+        self.assertEqual(r.md5, None)
+        self.assertEqual(r.capability, None)
+        self.assertEqual(r, Resource(uri='uri:a', timestamp=10, length=99))
+        r.lastmod = '2021-01-01T00:00:00Z'
+        self.assertEqual(r.lastmod, '2021-01-01T00:00:00Z')
+        self.assertRaises(ValueError, Resource.from_values, None)
+        self.assertRaises(ChangeTypeError, Resource.from_values, 'uri:a', change='bad')
+
+    def test21_copy(self):
+        """Test __copy__ and copy constructor."""
+        import copy
+        r1 = Resource(uri='uri:a', timestamp=10, md5='abc', change='updated', capability='resourcelist')
+        for r2 in (copy.copy(r1), Resource(resource=r1)):
+            self.assertEqual(r2.uri, 'uri:a')
+            self.assertEqual(r2.timestamp, 10)
+            self.assertEqual(r2.md5, 'abc')
+            self.assertEqual(r2.change, 'updated')
+            self.assertEqual(r2.capability, 'resourcelist')
+            # extra attributes are not shared
+            r2.capability = 'changelist'
+            self.assertEqual(r1.capability, 'resourcelist')
+        # copy constructor arguments override
+        r3 = Resource(resource=r1, change='deleted', length=5)
+        self.assertEqual(r3.change, 'deleted')
+        self.assertEqual(r3.length, 5)
+        self.assertEqual(r1.change, 'updated')
+        # no extra dict created when there are no extra attributes
+        self.assertEqual(copy.copy(Resource(uri='uri:b'))._extra, None)
@@ -148,6 +148,27 @@ class TestResourceList(TestCase):
         self.assertEqual(i.resources['a'].uri, 'a')
         self.assertEqual(i.resources['a'].timestamp, 11)
 
+    def test10_resource_slice(self):
+        rl = ResourceList()
+        for uri in ('d', 'b', 'a', 'c'):
+            rl.add(Resource(uri))
+        self.assertEqual([r.uri for r in rl.resources.resource_slice(1, 3)], ['b', 'c'])
+        index = rl.resources.uri_index()
+        self.assertIs(rl.resources.uri_index(), index)
+        # Changes rebuild the index
+        rl.add(Resource('bb'))
+        self.assertEqual([r.uri for r in rl.resources.resource_slice(1, 3)], ['b', 'bb'])
+        del rl.resources['a']
+        self.assertEqual(rl.uris(), ['b', 'bb', 'c', 'd'])
+        self.assertEqual([r.uri for r in rl], ['b', 'bb', 'c', 'd'])
+        # Ordered keeps order added
+        rlo = ResourceList(resources_class=ResourceListOrdered)
+        for uri in ('d', 'b', 'a', 'c'):
+            rlo.add(Resource(uri))
+        self.assertEqual([r.uri for r in rlo.resources.resource_slice(1, 3)], ['b', 'a'])
+        rlo.resources.pop('b')
+        self.assertEqual([r.uri for r in rlo.resources.resource_slice(1, 3)], ['a', 'c'])
+
     def test20_as_xml(self):
         rl = ResourceList()
         rl.add(Resource('a', timestamp=1))
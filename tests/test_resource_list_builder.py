@@ -161,12 +161,14 @@ class TestResourceListBuilder(unittest.TestCase):
         self.assertRaises(ValueError, rlb._compile_excludes)
 
     def test12_exclude(self):
-        """Test _exclude method."""
+        """Test _exclude and is_excluded methods."""
         rlb = ResourceListBuilder()
         rlb.add_exclude_patterns(['.*frog.*'])
         rlb._compile_excludes()
         self.assertTrue(rlb._exclude('a frog'))
         self.assertFalse(rlb._exclude('toad'))
+        self.assertTrue(rlb.is_excluded('a frog'))
+        self.assertFalse(rlb.is_excluded('toad'))
 
     def test13_from_disk_add_path(self):
         """Test from_disk_add_path method."""
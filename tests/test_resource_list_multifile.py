@@ -2,8 +2,10 @@ import sys
 import unittest
 import tempfile
 import os.path
+import gzip
 import shutil
 
+from resync.hashes import Hashes
 from resync.list_base_with_index import ListBaseIndexError
 from resync.resource import Resource
 from resync.resource_list import ResourceList
@@ -99,3 +101,66 @@ class TestResourceListMultifile(unittest.TestCase):
         self.assertEqual(next(i).uri, 'http://localhost/d')
         # cleanup tempdir
         shutil.rmtree(tempdir)
+
+    def test_12_write_multifile_by_size(self):
+        tempdir = tempfile.mkdtemp(prefix='test_resource_list_multifile_dir')
+        rl = ResourceList()
+        rl.mapper = Mapper(['http://localhost/=%s/' % (tempdir)])
+        for j in range(0, 10):
+            rl.add(Resource(uri='http://localhost/%s%d' % ('x' * 100, j), length=j))
+        rl.md['from'] = None
+        one_file = rl.as_xml()
+        rl.max_sitemap_bytes = len(one_file) // 3
+        self.assertRaises(ListBaseIndexError, rl.as_xml)
+        num = rl.requires_multifile()
+        self.assertTrue(num >= 3)
+        self.assertIn('x9</loc>', rl.as_xml_part(part_number=num - 1))
+        rl.gzip_components = True
+        rl.write(basename=os.path.join(tempdir, 'sitemap.xml'))
+        self.assertTrue(os.path.exists(os.path.join(tempdir, 'sitemap%05d.xml.gz' % (num - 1))))
+        self.assertFalse(os.path.exists(os.path.join(tempdir, 'sitemap%05d.xml.gz' % (num))))
+        for n in range(0, num):
+            part = os.path.join(tempdir, 'sitemap%05d.xml.gz' % (n))
+            with gzip.open(part, 'rb') as fh:
+                self.assertLessEqual(len(fh.read()), rl.max_sitemap_bytes)
+        # read back transparently
+        rli = ResourceList(mapper=rl.mapper)
+        rli.read(os.path.join(tempdir, 'sitemap.xml'))
+        self.assertEqual(len(rli), 10)
+        self.assertEqual(sorted(rli.uris()), sorted(rl.uris()))
+        # single gzipped sitemap
+        rl.max_sitemap_bytes = None
+        rl.write(basename=os.path.join(tempdir, 'single.xml.gz'))
+        rls = ResourceList()
+        rls.read(os.path.join(tempdir, 'single.xml.gz'))
+        self.assertEqual(len(rls), 10)
+        shutil.rmtree(tempdir)
+
+    def test_13_write_multifile_parallel(self):
+        tempdir = tempfile.mkdtemp(prefix='test_resource_list_multifile_dir')
+        rl = ResourceList()
+        rl.mapper = Mapper(['http://localhost/=%s/' % (tempdir)])
+        for j in range(0, 100):
+            rl.add(Resource(uri='http://localhost/r%03d' % (j), length=j))
+        rl.max_sitemap_entries = 15
+        rl.write(basename=os.path.join(tempdir, 'serial.xml'))
+        rl.write_workers = 3
+        rl.write_batch_size = 7
+        rl.write(basename=os.path.join(tempdir, 'parallel.xml'))
+        for n in range(0, 7):
+            with open(os.path.join(tempdir, 'serial%05d.xml' % (n)), 'rb') as fh:
+                serial = fh.read()
+            with open(os.path.join(tempdir, 'parallel%05d.xml' % (n)), 'rb') as fh:
+                self.assertEqual(fh.read(), serial)
+        self.assertFalse(os.path.exists(os.path.join(tempdir, 'parallel00007.xml')))
+        # index has md5 of each component
+        rli = ResourceList()
+        rli.read(os.path.join(tempdir, 'parallel.xml'), index_only=True)
+        self.assertEqual(len(rli), 7)
+        for r in rli:
+            filename = rl.mapper.src_to_dst(r.uri)
+            self.assertEqual(r.md5, Hashes(['md5'], filename).md5)
+        rli = ResourceList(mapper=rl.mapper)
+        rli.read(os.path.join(tempdir, 'parallel.xml'))
+        self.assertEqual(rli.uris(), rl.uris())
+        shutil.rmtree(tempdir)
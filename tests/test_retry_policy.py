@@ -0,0 +1,106 @@
+from .testlib import TestCase
+
+import email.utils
+import socket
+import time
+from urllib.error import HTTPError, URLError
+
+from resync.retry_policy import RetryPolicy, HostThrottle
+
+
+def http_error(code, headers=None):
+    return HTTPError('http://example.org/a', code, 'msg', headers or {}, None)
+
+
+class TestRetryPolicy(TestCase):
+
+    def test01_is_retryable(self):
+        rp = RetryPolicy()
+        self.assertTrue(rp.is_retryable(socket.timeout('timed out')))
+        self.assertTrue(rp.is_retryable(URLError(socket.timeout('timed out'))))
+        self.assertTrue(rp.is_retryable(ConnectionResetError()))
+        self.assertTrue(rp.is_retryable(http_error(429)))
+        self.assertTrue(rp.is_retryable(http_error(503)))
+        self.assertFalse(rp.is_retryable(http_error(404)))
+        self.assertFalse(rp.is_retryable(URLError(ConnectionRefusedError())))
+        self.assertFalse(rp.is_retryable(FileNotFoundError()))
+        self.assertTrue(rp.is_throttle(http_error(429)))
+        self.assertFalse(rp.is_throttle(http_error(500)))
+
+    def test02_backoff(self):
+        rp = RetryPolicy(backoff_base=1.0, backoff_max=10.0, jitter=False)
+        self.assertEqual(rp.backoff(1), 1.0)
+        self.assertEqual(rp.backoff(2), 2.0)
+        self.assertEqual(rp.backoff(3), 4.0)
+        self.assertEqual(rp.backoff(5), 10.0)
+        rp.jitter = True
+        for try_i in range(1, 10):
+            b = rp.backoff(try_i)
+            self.assertTrue(0.0 <= b <= 10.0)
+
+    def test03_retry_after(self):
+        rp = RetryPolicy(jitter=False, max_retry_after=100.0)
+        self.assertEqual(rp.retry_after(socket.timeout()), None)
+        self.assertEqual(rp.retry_after(http_error(503)), None)
+        self.assertEqual(rp.retry_after(http_error(503, {'Retry-After': '7'})), 7.0)
+        self.assertEqual(rp.backoff(1, http_error(503, {'Retry-After': '7'})), 7.0)
+        self.assertEqual(rp.retry_after(http_error(503, {'Retry-After': '9999'})), 100.0)
+        self.assertEqual(rp.retry_after(http_error(503, {'Retry-After': 'junk'})), None)
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        s = rp.retry_after(http_error(429, {'Retry-After': date}))
+        self.assertTrue(25.0 < s <= 30.0)
+        date = email.utils.formatdate(time.time() - 30, usegmt=True)
+        self.assertEqual(rp.retry_after(http_error(429, {'Retry-After': date})), 0.0)
+
+    def test04_host_throttle(self):
+        ht = HostThrottle(delay_step=0.5, max_delay=4.0, max_concurrency=3)
+        self.assertEqual(ht.delay, 0.0)
+        self.assertEqual(ht.concurrency, 1)
+        ht.record_success()
+        self.assertEqual(ht.concurrency, 2)
+        ht.record_success()
+        ht.record_success()
+        self.assertEqual(ht.concurrency, 3)
+        ht.record_throttle()
+        self.assertEqual(ht.delay, 0.5)
+        self.assertEqual(ht.concurrency, 1)
+        ht.record_throttle()
+        ht.record_throttle()
+        ht.record_throttle()
+        self.assertEqual(ht.delay, 4.0)
+        ht.record_throttle()
+        self.assertEqual(ht.delay, 4.0)
+        ht.record_success()
+        self.assertEqual(ht.delay, 3.5)
+
+    def test05_adaptive_delay(self):
+        rp = RetryPolicy()
+        slept = []
+        rp.sleep = slept.append
+        rp.wait_before_request('http://a.example.org/1')
+        self.assertEqual(slept, [])
+        rp.record_failure('http://a.example.org/1', http_error(429))
+        rp.record_failure('http://a.example.org/2', http_error(404))
+        rp.wait_before_request('http://a.example.org/3')
+        rp.wait_before_request('http://b.example.org/3')
+        self.assertEqual(slept, [0.5])
+        rp.record_success('http://a.example.org/4')
+        rp.wait_before_request('http://a.example.org/5')
+        self.assertEqual(slept, [0.5])
+        # non-adaptive
+        rp = RetryPolicy(adaptive=False)
+        rp.sleep = slept.append
+        rp.record_failure('http://a.example.org/1', http_error(503))
+        rp.wait_before_request('http://a.example.org/3')
+        self.assertEqual(slept, [0.5])
+        self.assertEqual(rp.hosts, {})
+
+    def test06_tries_for(self):
+        rp = RetryPolicy()
+        self.assertEqual(rp.tries_for(socket.timeout('timed out')), 20)
+        self.assertEqual(rp.tries_for(http_error(503)), 3)
+        self.assertEqual(rp.backoff_max, 10.0)
+        rp = RetryPolicy(tries=2, status_tries=5)
+        self.assertEqual(rp.tries_for(http_error(500)), 2)
+        rp.status_tries = 1
+        self.assertEqual(rp.tries_for(http_error(500)), 1)
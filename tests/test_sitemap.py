@@ -433,3 +433,30 @@ class TestSitemap(unittest.TestCase):
 '''
             et = parse(io.StringIO(xml)).getroot()
             self.assertRaises(SitemapParseError, Sitemap().md_from_etree, et)
+
+    def test_33_xml_head_and_tail(self):
+        """Test entries serialized one at a time match resources_as_xml."""
+        rl = ResourceList(ln=[{'rel': 'up', 'href': 'http://ex.org/caps.xml'}])
+        rl.add(Resource('http://ex.org/a&b', length=1, md5='aabbcc'))
+        rl.add(Resource('http://ex.org/c', lastmod='2001-01-01'))
+        for pretty_xml in (False, True):
+            s = Sitemap(pretty_xml=pretty_xml)
+            (head, tail) = s.xml_head_and_tail(rl)
+            self.assertEqual(head + ''.join(s.resource_as_xml(r) for r in rl) + tail,
+                             s.resources_as_xml(rl))
+
+    def test_34_resource_from_etree_custom_class(self):
+        """Test resource_from_etree with a resource_class that is not a Resource."""
+        class PlainResource(object):
+            def __init__(self, uri=None):
+                self.uri = uri
+        xml = '''<?xml version=\'1.0\' encoding=\'UTF-8\'?>
+<url xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<loc>a_name</loc>
+<lastmod>2013-01-02T13:00:00Z</lastmod>
+</url>'''
+        et = parse(io.StringIO(xml))
+        r = Sitemap().resource_from_etree(et, PlainResource)
+        self.assertIsInstance(r, PlainResource)
+        self.assertEqual(r.uri, 'a_name')
+        self.assertEqual(r.lastmod, '2013-01-02T13:00:00Z')
@@ -0,0 +1,226 @@
+"""Tests for resync.source_server."""
+
+from .testlib import TestCase
+
+import asyncio
+import gzip
+import hashlib
+import os.path
+import re
+import time
+from wsgiref.util import setup_testing_defaults
+from wsgiref.validate import validator
+
+from resync.change_list import ChangeList
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+from resync.source_server import SourceServer, ListFileLoader, etag_matches, parse_range
+
+
+def wsgi_get(app, path, method='GET', **headers):
+    """Make request to WSGI app, return (status, headers dict, body)."""
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': method,
+               'SCRIPT_NAME': '', 'QUERY_STRING': ''}
+    for (k, v) in headers.items():
+        environ['HTTP_' + k.upper()] = v
+    setup_testing_defaults(environ)
+    result = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        result['status'] = status
+        result['headers'] = dict(response_headers)
+    response = validator(app)(environ, start_response)
+    body = b''.join(response)
+    response.close()
+    return(result['status'], result['headers'], body)
+
+
+def make_resource_list(num):
+    rl = ResourceList()
+    for j in range(0, num):
+        rl.add(Resource('http://example.org/r%03d' % (j), timestamp=1000000 + j, length=j))
+    return(rl)
+
+
+class TestSourceServer(TestCase):
+
+    def test01_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        self.assertFalse(parse_range('bytes=100-', 100))
+        self.assertFalse(parse_range('bytes=-0', 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('bytes=5-1', 100))
+        self.assertIsNone(parse_range('lines=1-2', 100))
+        self.assertTrue(etag_matches('"a", "b"', '"b"'))
+        self.assertTrue(etag_matches('*', '"b"'))
+        self.assertTrue(etag_matches('W/"b"', '"b"'))
+        self.assertFalse(etag_matches('W/"b"', '"b"', weak=False))
+
+    def test02_documents(self):
+        rl = make_resource_list(3)
+        cl = ChangeList()
+        cl.add(Resource('http://example.org/r001', timestamp=1000010, change='updated'))
+        app = SourceServer('http://example.org/rs', resource_list=rl, change_list=cl)
+        (status, headers, body) = wsgi_get(app, '/.well-known/resourcesync')
+        self.assertEqual(status, '200 OK')
+        self.assertIn(b'<loc>http://example.org/rs/capabilitylist.xml</loc>', body)
+        (status, headers, body) = wsgi_get(app, '/rs/capabilitylist.xml')
+        self.assertEqual(status, '200 OK')
+        self.assertIn(b'<loc>http://example.org/rs/resourcelist.xml</loc>', body)
+        self.assertIn(b'<loc>http://example.org/rs/changelist.xml</loc>', body)
+        (status, headers, body) = wsgi_get(app, '/rs/resourcelist.xml')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'application/xml')
+        self.assertEqual(len(re.findall(b'<url>', body)), 3)
+        self.assertIn(b'href="http://example.org/rs/capabilitylist.xml" rel="up"', body)
+        (status, headers, body) = wsgi_get(app, '/rs/changelist.xml')
+        self.assertIn(b'<rs:md change="updated"', body)
+        self.assertEqual(wsgi_get(app, '/rs/other.xml')[0], '404 Not Found')
+        self.assertEqual(wsgi_get(app, '/rs/resourcelist00000.xml')[0], '404 Not Found')
+        self.assertEqual(wsgi_get(app, '/rs/resourcelist.xml', method='POST')[0],
+                         '405 Method Not Allowed')
+        (status, headers, body) = wsgi_get(app, '/rs/resourcelist.xml', method='HEAD')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, b'')
+        self.assertGreater(int(headers['Content-Length']), 0)
+
+    def test03_parts(self):
+        rl = make_resource_list(25)
+        app = SourceServer('http://example.org/', resource_list=rl, max_sitemap_entries=10)
+        (status, headers, body) = wsgi_get(app, '/resourcelist.xml')
+        self.assertIn(b'<sitemapindex', body)
+        self.assertEqual(re.findall(b'<loc>([^<]+)</loc>', body),
+                         [b'http://example.org/resourcelist00000.xml',
+                          b'http://example.org/resourcelist00001.xml',
+                          b'http://example.org/resourcelist00002.xml'])
+        uris = []
+        for n in range(0, 3):
+            (status, headers, body) = wsgi_get(app, '/resourcelist%05d.xml' % (n))
+            self.assertEqual(status, '200 OK')
+            uris.extend(re.findall(b'<loc>(http://example.org/r\\d+)</loc>', body))
+        self.assertEqual(len(uris), 25)
+        self.assertEqual(wsgi_get(app, '/resourcelist00003.xml')[0], '404 Not Found')
+
+    def test04_etag_and_range(self):
+        rl = make_resource_list(5)
+        app = SourceServer('http://example.org/', resource_list=rl)
+        (status, headers, body) = wsgi_get(app, '/resourcelist.xml')
+        etag = headers['ETag']
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        # Conditional
+        (status, headers, body2) = wsgi_get(app, '/resourcelist.xml', if_none_match=etag)
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(body2, b'')
+        self.assertEqual(wsgi_get(app, '/resourcelist.xml', if_match='"other"')[0],
+                         '412 Precondition Failed')
+        # Ranges
+        (status, headers, part) = wsgi_get(app, '/resourcelist.xml', range='bytes=10-19')
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(part, body[10:20])
+        self.assertEqual(headers['Content-Range'], 'bytes 10-19/%d' % (len(body)))
+        (status, headers, part) = wsgi_get(app, '/resourcelist.xml', range='bytes=-10',
+                                           if_range=etag)
+        self.assertEqual(part, body[-10:])
+        (status, headers, part) = wsgi_get(app, '/resourcelist.xml', range='bytes=-10',
+                                           if_range='"old"')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(part, body)
+        (status, headers, part) = wsgi_get(app, '/resourcelist.xml',
+                                           range='bytes=%d-' % (len(body)))
+        self.assertEqual(status, '416 Requested Range Not Satisfiable')
+        # Changing list changes ETag
+        rl.add(Resource('http://example.org/new'))
+        (status, headers, body3) = wsgi_get(app, '/resourcelist.xml', if_none_match=etag)
+        self.assertEqual(status, '200 OK')
+        self.assertNotEqual(headers['ETag'], etag)
+        self.assertIn(b'http://example.org/new', body3)
+
+    def test05_list_file_loader(self):
+        filename = os.path.join(self.tmpdir, 'test05_rl.xml')
+        make_resource_list(2).write(basename=filename)
+        app = SourceServer('http://example.org/')
+        app.add_list(ListFileLoader(filename))
+        body = wsgi_get(app, '/resourcelist.xml')[2]
+        self.assertEqual(len(re.findall(b'<url>', body)), 2)
+        make_resource_list(4).write(basename=filename)
+        os.utime(filename, (time.time() + 10, time.time() + 10))
+        body = wsgi_get(app, '/resourcelist.xml')[2]
+        self.assertEqual(len(re.findall(b'<url>', body)), 4)
+
+    def test06_asgi(self):
+        app = SourceServer('http://example.org/', resource_list=make_resource_list(3))
+        sent = []
+
+        async def receive():
+            return({'type': 'http.request', 'body': b''})
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'GET', 'path': '/resourcelist.xml',
+                 'headers': [(b'range', b'bytes=0-4')]}
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(app.asgi(scope, receive, send))
+        finally:
+            loop.close()
+        self.assertEqual(sent[0]['status'], 206)
+        self.assertIn((b'content-length', b'5'), sent[0]['headers'])
+        self.assertEqual(sent[1]['body'], b'<?xml')
+
+    def test07_gzip_parts(self):
+        rl = make_resource_list(25)
+        rl.gzip_components = True
+        app = SourceServer('http://example.org/', resource_list=rl, max_sitemap_entries=10)
+        (status, headers, body) = wsgi_get(app, '/resourcelist.xml')
+        self.assertIn(b'<loc>http://example.org/resourcelist00001.xml.gz</loc>', body)
+        (status, headers, xml) = wsgi_get(app, '/resourcelist00001.xml')
+        self.assertEqual(headers['Content-Type'], 'application/xml')
+        (status, headers, body) = wsgi_get(app, '/resourcelist00001.xml.gz')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(body), xml)
+        self.assertEqual(headers['ETag'], '"%s"' % (hashlib.sha1(body).hexdigest()))
+        self.assertEqual(wsgi_get(app, '/resourcelist00001.xml.gz')[2], body)
+
+    def test08_change_list_edited(self):
+        cl = ChangeList()
+        cl.add(Resource('http://example.org/r001', timestamp=1000010, change='updated'))
+        cl.add(Resource('http://example.org/r002', timestamp=1000020, change='updated'))
+        app = SourceServer('http://example.org/', change_list=cl)
+        (status, headers, body) = wsgi_get(app, '/changelist.xml')
+        etag = headers['ETag']
+        # Replacing an entry keeps the length but changes the document
+        cl.resources[1] = Resource('http://example.org/r002', timestamp=1000030, change='deleted')
+        (status, headers, body) = wsgi_get(app, '/changelist.xml', if_none_match=etag)
+        self.assertEqual(status, '200 OK')
+        self.assertNotEqual(headers['ETag'], etag)
+        self.assertIn(b'change="deleted"', body)
+
+    def test09_list_not_changed_and_cache_bounded(self):
+        rl = make_resource_list(25)
+        cl = ChangeList()
+        cl.add(Resource('http://example.org/r001', timestamp=1000010, change='updated'))
+        app = SourceServer('http://example.org/', resource_list=rl, change_list=cl,
+                           max_sitemap_entries=10)
+        (status, headers, body) = wsgi_get(app, '/resourcelist00001.xml')
+        self.assertIn(b'<rs:ln href="http://example.org/capabilitylist.xml" rel="up" />', body)
+        # Settings for serving are not made on the lists added
+        self.assertEqual(rl.max_sitemap_entries, 50000)
+        self.assertEqual(rl.up, None)
+        self.assertEqual(rl.ln, [])
+        # A Change List counts its changes so its XML is cached too
+        wsgi_get(app, '/changelist.xml')
+        self.assertIn('/changelist.xml', app.cache)
+        # Least recently used documents are dropped to stay within the limit
+        app.max_cache_bytes = len(body) + 10
+        for n in range(0, 3):
+            wsgi_get(app, '/resourcelist%05d.xml' % (n))
+        self.assertEqual(list(app.cache), ['/resourcelist00002.xml'])
+        self.assertLessEqual(app.cache_bytes, app.max_cache_bytes)
+        (status, headers, body) = wsgi_get(app, '/resourcelist00000.xml')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(len(re.findall(b'<url>', body)), 10)
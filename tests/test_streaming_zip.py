@@ -0,0 +1,124 @@
+import unittest
+import io
+import os
+import zipfile
+
+from resync.streaming_zip import StreamingZipReader, StreamingZipError
+
+
+class NonSeekable(io.RawIOBase):
+    """Write-only or read-only stream that is not seekable, wraps BytesIO."""
+
+    def __init__(self, data=None):
+        self.bio = io.BytesIO(data or b'')
+
+    def writable(self):
+        return(True)
+
+    def readable(self):
+        return(True)
+
+    def seekable(self):
+        return(False)
+
+    def write(self, data):
+        return(self.bio.write(data))
+
+    def read(self, size=-1):
+        # Return short reads to exercise buffering
+        return(self.bio.read(min(size, 1000) if size >= 0 else size))
+
+    def tell(self):
+        raise io.UnsupportedOperation()
+
+
+class TestStreamingZip(unittest.TestCase):
+
+    def make_zip(self, files, fh=None, compression=zipfile.ZIP_DEFLATED):
+        fh = fh or io.BytesIO()
+        with zipfile.ZipFile(fh, 'w', compression=compression) as zf:
+            for (name, data, compress_type) in files:
+                zf.writestr(zipfile.ZipInfo(name), data, compress_type=compress_type)
+        return(fh)
+
+    def test01_read(self):
+        big = os.urandom(3000000)
+        files = [('manifest.xml', b'<xml/>', zipfile.ZIP_DEFLATED),
+                 ('a', b'aaa' * 1000, zipfile.ZIP_DEFLATED),
+                 ('dir/é', b'unicode name', zipfile.ZIP_STORED),
+                 ('empty', b'', zipfile.ZIP_DEFLATED),
+                 ('big', big, zipfile.ZIP_DEFLATED),
+                 ('big_stored', big, zipfile.ZIP_STORED)]
+        data = self.make_zip(files).getvalue()
+        members = []
+        for member in StreamingZipReader(NonSeekable(data)):
+            members.append((member.filename, member.read(), member.compress_type))
+        self.assertEqual(members, files)
+        # Skip some members without reading, read others in small pieces
+        zr = StreamingZipReader(io.BytesIO(data))
+        names = []
+        for member in zr:
+            names.append(member.filename)
+            if (member.filename == 'big'):
+                start = member.read(10)
+                self.assertTrue(0 < len(start) <= 10)
+                self.assertEqual(start, big[0:len(start)])
+                self.assertEqual(member.file_size, 3000000)
+            elif (member.filename == 'a'):
+                parts = []
+                while True:
+                    part = member.read(7)
+                    if (not part):
+                        break
+                    parts.append(part)
+                self.assertEqual(b''.join(parts), b'aaa' * 1000)
+        self.assertEqual(names, [f[0] for f in files])
+        # Stops after reading signature at start of central directory
+        self.assertEqual(zr.bytes_read, zipfile.ZipFile(io.BytesIO(data)).start_dir + 4)
+
+    def test02_data_descriptors(self):
+        # ZipFile writes data descriptors when output is not seekable
+        fh = NonSeekable()
+        files = [('a', b'aaa' * 1000, zipfile.ZIP_DEFLATED),
+                 ('b', os.urandom(100000), zipfile.ZIP_DEFLATED)]
+        self.make_zip(files, fh=fh)
+        data = fh.bio.getvalue()
+        members = []
+        for member in StreamingZipReader(io.BytesIO(data)):
+            self.assertEqual(member.file_size, None)
+            members.append((member.filename, member.read(), member.compress_type))
+            self.assertEqual(member.file_size, len(members[-1][1]))
+        self.assertEqual(members, files)
+        # Stored with data descriptor can't be read
+        fh = NonSeekable()
+        self.make_zip([('a', b'aaa', zipfile.ZIP_STORED)], fh=fh)
+        self.assertRaises(StreamingZipError, list, StreamingZipReader(io.BytesIO(fh.bio.getvalue())))
+
+    def test03_errors(self):
+        data = self.make_zip([('a', b'abcdef' * 100, zipfile.ZIP_STORED)]).getvalue()
+        # Corrupt content
+        bad = data.replace(b'abcdef', b'abcdeg', 1)
+        member = next(iter(StreamingZipReader(io.BytesIO(bad))))
+        self.assertRaises(StreamingZipError, member.read)
+        # Truncated
+        member = next(iter(StreamingZipReader(io.BytesIO(data[0:100]))))
+        self.assertRaises(StreamingZipError, member.read)
+        # Not a ZIP
+        self.assertRaises(StreamingZipError, list, StreamingZipReader(io.BytesIO(b'not a zip file')))
+        # Empty stream has no members
+        self.assertEqual(list(StreamingZipReader(io.BytesIO(b''))), [])
+
+    def test04_zip64_data_descriptor(self):
+        # Streamed ZIP64 member, sizes in the local header are 0 as some
+        # writers do, only the ZIP64 extra field says the descriptor is 64-bit
+        fh = NonSeekable()
+        data = os.urandom(10000)
+        with zipfile.ZipFile(fh, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open('a', 'w', force_zip64=True) as mfh:
+                mfh.write(data)
+            zf.writestr('b', b'bbb')
+        raw = fh.bio.getvalue()
+        self.assertEqual(raw[18:26], b'\xff' * 8)
+        raw = raw[:18] + b'\x00' * 8 + raw[26:]
+        members = [(m.filename, m.read()) for m in StreamingZipReader(io.BytesIO(raw))]
+        self.assertEqual(members, [('a', data), ('b', b'bbb')])
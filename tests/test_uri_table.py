@@ -0,0 +1,42 @@
+import unittest
+
+from resync.mapper import Mapper
+from resync.resource_list import ResourceList
+from resync.uri_table import UriTable
+
+
+class TestUriTable(unittest.TestCase):
+
+    def test01_intern(self):
+        t = UriTable()
+        a1 = ''.join(['http://example.org/', 'a'])
+        a2 = ''.join(['http://example.org/', 'a'])
+        self.assertIsNot(a1, a2)
+        self.assertIs(t.intern(a1), a1)
+        self.assertIs(t.intern(a2), a1)
+        self.assertIs(t.intern(a1), a1)
+        self.assertEqual(len(t), 1)
+        self.assertTrue('http://example.org/a' in t)
+        stats = t.stats()
+        self.assertEqual(stats['lookups'], 3)
+        self.assertEqual(stats['hits'], 1)
+        self.assertTrue(stats['bytes_saved'] > 0)
+        t.clear()
+        self.assertEqual(len(t), 0)
+        self.assertEqual(t.stats()['lookups'], 0)
+
+    def test02_shared_by_sitemap_and_mapper(self):
+        t = UriTable()
+        rl = ResourceList()
+        rl.uri_table = t
+        rl.parse(str_data='<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n\
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<rs:md capability="resourcelist"/>\
+<url><loc>http://example.org/dir/a</loc></url>\
+</urlset>')
+        m = Mapper(['http://example.org/dir', '/tmp/dir'])
+        m.uri_table = t
+        uri = m.dst_to_src('/tmp/dir/a')
+        self.assertEqual(uri, 'http://example.org/dir/a')
+        self.assertIs(uri, rl.resources['http://example.org/dir/a'].uri)
+        self.assertEqual(t.stats()['hits'], 1)
@@ -1,8 +1,13 @@
 """Tests for resync.url_or_file_open."""
 from .testlib import TestCase, webserver
+import gzip
+import io
+import os.path
 import time
+import zlib
 
-from resync.url_or_file_open import NUM_REQUESTS, CONFIG, set_url_or_file_open_config, url_or_file_open
+from resync.url_or_file_open import CONFIG, RATE_LIMITER, set_url_or_file_open_config, url_or_file_open, \
+    DecodingResponse, DecodingWriter
 
 
 class TestUrlOrFileOpen(TestCase):
@@ -35,3 +40,73 @@ class TestUrlOrFileOpen(TestCase):
             with url_or_file_open('http://localhost:9999/dir1/file_a') as fh:
                 self.assertIn(b'I am file a', fh.read())
             self.assertGreater(time.time() - before, 0.099)
+            self.assertGreaterEqual(RATE_LIMITER.stats()['localhost:9999']['waits'], 1)
+            set_url_or_file_open_config('delay', None)
+
+    def test_decoding_response(self):
+        """Test DecodingResponse with different content encodings."""
+        data = b''.join(b'line %d\n' % (j) for j in range(0, 5000))
+        bodies = [('gzip', gzip.compress(data)),
+                  ('gzip', gzip.compress(data[:1000]) + gzip.compress(data[1000:])),
+                  ('deflate', zlib.compress(data)),
+                  ('deflate', zlib.compress(data)[2:-4]),  # raw deflate
+                  (None, data)]
+        for (encoding, body) in bodies:
+            fh = DecodingResponse(io.BytesIO(body), encoding, chunk_size=100)
+            parts = []
+            while True:
+                part = fh.read(77)
+                if (not part):
+                    break
+                self.assertLessEqual(len(part), 77)
+                parts.append(part)
+            self.assertEqual(b''.join(parts), data)
+            self.assertEqual(fh.bytes_read, len(body))
+            self.assertEqual(fh.bytes_decoded, len(data))
+            fh = DecodingResponse(io.BytesIO(body), encoding)
+            self.assertEqual(fh.readline(), b'line 0\n')
+            self.assertEqual(fh.read(), data[7:])
+        # Errors
+        self.assertRaises(IOError, DecodingResponse, io.BytesIO(b''), 'br')
+        fh = DecodingResponse(io.BytesIO(gzip.compress(data)[:-20]), 'gzip')
+        self.assertRaises(IOError, fh.read)
+        fh = DecodingResponse(io.BytesIO(b'not gzip'), 'gzip')
+        self.assertRaises(IOError, fh.read)
+
+    def test_decoding_writer(self):
+        """Test DecodingWriter with different content encodings."""
+        data = b''.join(b'line %d\n' % (j) for j in range(0, 5000))
+        bodies = [('gzip', gzip.compress(data)),
+                  ('gzip', gzip.compress(data[:1000]) + gzip.compress(data[1000:])),
+                  ('deflate', zlib.compress(data)),
+                  ('deflate', zlib.compress(data)[2:-4]),  # raw deflate
+                  (None, data)]
+        for (encoding, body) in bodies:
+            out = io.BytesIO()
+            fh = DecodingWriter(out, encoding)
+            for j in range(0, len(body), 100):
+                fh.write(body[j:j + 100])
+            fh.finish()
+            self.assertEqual(out.getvalue(), data)
+            self.assertEqual(fh.bytes_written, len(body))
+        # Errors
+        self.assertRaises(IOError, DecodingWriter, io.BytesIO(), 'br')
+        fh = DecodingWriter(io.BytesIO(), 'gzip')
+        fh.write(gzip.compress(data)[:-20])
+        self.assertRaises(IOError, fh.finish)
+        fh = DecodingWriter(io.BytesIO(), 'gzip')
+        self.assertRaises(IOError, fh.write, b'not gzip')
+
+    def test_url_or_file_open_gunzip(self):
+        """Test reading gzipped file with url_or_file_open."""
+        gzfile = os.path.join(self.tmpdir, 'test_gunzip.xml.gz')
+        with gzip.open(gzfile, 'wb') as fh:
+            fh.write(b'<urlset/>')
+        with url_or_file_open(gzfile, gunzip=True) as fh:
+            self.assertEqual(fh.read(), b'<urlset/>')
+            self.assertEqual(fh.bytes_read, os.path.getsize(gzfile))
+            self.assertEqual(fh.bytes_decoded, 9)
+        with url_or_file_open(gzfile) as fh:
+            self.assertEqual(fh.read(2), b'\x1f\x8b')
+        with url_or_file_open('tests/testdata/dir1/file_a', gunzip=True) as fh:
+            self.assertIn(b'I am file a', fh.read())